@@ -0,0 +1,155 @@
+# Ограничение числа одновременных задач парсинга
+import math
+import threading
+import time
+from collections import deque
+
+class Overloaded(Exception):
+    """Нет свободных слотов и очередь ожидания заполнена
+
+    draining=True - сервер останавливается и новых задач не принимает.
+    """
+
+    def __init__(self, retry_after, message='Сервер перегружен, повторите позже', draining=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.draining = draining
+
+class Ticket:
+    """Место задачи в очереди допуска
+
+    Потоки ждут через wait(), корутины подписываются on_grant().
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.started = None
+        self.cancelled = False
+
+    @property
+    def granted(self):
+        return self.event.is_set()
+
+    def grant(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_grant(self, callback):
+        """Вызвать callback при допуске (сразу, если уже допущен)"""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    async def wait_async(self):
+        """Ожидание допуска в asyncio без занятия потока"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        self.on_grant(notify)
+        await future
+
+class AdmissionController:
+    """Глобальный бюджет задач с ограниченной FIFO-очередью
+
+    Не больше max_jobs задач выполняются одновременно, еще max_queue
+    ждут своей очереди; остальным сразу отказ с оценкой Retry-After
+    по средней длительности задачи и глубине очереди.
+    """
+
+    def __init__(self, max_jobs=4, max_queue=8, initial_job_time=10.0):
+        self.max_jobs = max_jobs
+        self.max_queue = max_queue
+        self.avg_job_time = initial_job_time
+        self.active = 0
+        self.queue = deque()
+        self.rejected = 0
+        self.closed = False
+        self.lock = threading.Condition()
+
+    def retry_after(self):
+        """Оценка в секундах, когда освободится место (под self.lock)"""
+        waves = (len(self.queue) + 1) / self.max_jobs
+        return max(1, math.ceil(waves * self.avg_job_time))
+
+    def enqueue(self):
+        """Билет на выполнение; Overloaded, если очередь заполнена"""
+        ticket = Ticket()
+        with self.lock:
+            if self.closed:
+                raise Overloaded(self.retry_after(), 'Сервер останавливается', draining=True)
+            if self.active < self.max_jobs and not self.queue:
+                self.active += 1
+                grant_now = True
+            elif len(self.queue) < self.max_queue:
+                self.queue.append(ticket)
+                grant_now = False
+            else:
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+
+        if grant_now:
+            ticket.grant()
+        return ticket
+
+    def release(self, ticket):
+        """Освобождение слота и допуск следующего из очереди"""
+        if ticket.cancelled:
+            return
+        next_ticket = None
+        with self.lock:
+            if ticket.started is not None:
+                # Скользящее среднее длительности задачи для Retry-After
+                duration = time.monotonic() - ticket.started
+                self.avg_job_time = 0.8 * self.avg_job_time + 0.2 * duration
+            if self.queue:
+                next_ticket = self.queue.popleft()
+            else:
+                self.active -= 1
+                self.lock.notify_all()
+
+        if next_ticket:
+            next_ticket.grant()
+
+    def close(self):
+        """Прекратить прием задач; ожидающие в очереди получают отказ"""
+        with self.lock:
+            self.closed = True
+            cancelled = list(self.queue)
+            self.queue.clear()
+        for ticket in cancelled:
+            ticket.cancelled = True
+            ticket.grant()
+        return len(cancelled)
+
+    def wait_idle(self, timeout):
+        """Ожидание завершения выполняющихся задач; True, если успели"""
+        with self.lock:
+            return self.lock.wait_for(lambda: self.active == 0, timeout=timeout)
+
+    def stats(self):
+        """Текущая загрузка для /status"""
+        with self.lock:
+            return {
+                'active_jobs': self.active,
+                'max_jobs': self.max_jobs,
+                'queued_jobs': len(self.queue),
+                'max_queue': self.max_queue,
+                'rejected': self.rejected,
+                'closed': self.closed,
+                'avg_job_time': round(self.avg_job_time, 2)
+            }
@@ -0,0 +1,132 @@
+# Аналитика по полному набору товаров задачи
+import os
+import threading
+from collections import OrderedDict
+
+from product_store import ProductStore, get_numpy
+
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+def require_numpy():
+    """numpy нужен для векторных расчетов"""
+    np = get_numpy()
+    if np is None:
+        raise RuntimeError("Для /stats установите numpy: pip install numpy")
+    return np
+
+def fast_quantiles(np, values, quantiles):
+    """Квантили (линейная интерполяция, как np.quantile) за одно разбиение
+
+    np.quantile выполняет отдельный partition на каждый квантиль;
+    здесь все нужные позиции передаются в один np.partition.
+    """
+    positions = np.asarray(quantiles, dtype=np.float64) * (len(values) - 1)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, len(values) - 1)
+    part = np.partition(values, np.unique(np.concatenate([lower, upper])))
+    fraction = positions - lower
+    return part[lower] + (part[upper] - part[lower]) * fraction
+
+def compute_stats(store, quantiles=DEFAULT_QUANTILES, bins=10, top_n=10):
+    """Статистика цен одним набором векторных операций numpy"""
+    np = require_numpy()
+    prices = store.price_array()
+    count = len(prices)
+
+    stats = {
+        'total_products': count,
+        'total_price': int(prices.sum()) if count else 0,
+    }
+    if not count:
+        return stats
+
+    stats['min_price'] = int(prices.min())
+    stats['max_price'] = int(prices.max())
+    stats['mean_price'] = round(float(prices.mean()), 2)
+
+    values = fast_quantiles(np, prices, quantiles)
+    stats['quantiles'] = {str(q): round(float(v), 2) for q, v in zip(quantiles, values)}
+
+    # Диапазон уже известен - histogram не ищет min/max повторно
+    hist_counts, edges = np.histogram(
+        prices, bins=bins, range=(stats['min_price'], max(stats['max_price'], stats['min_price'] + 1))
+    )
+    stats['histogram'] = [
+        {'from': round(float(edges[i]), 2), 'to': round(float(edges[i + 1]), 2), 'count': int(c)}
+        for i, c in enumerate(hist_counts)
+    ]
+
+    # Количество и сумма по меткам за один проход bincount
+    codes = store.label_code_array()
+    label_count = np.bincount(codes, minlength=len(store.label_values))
+    label_sum = np.bincount(codes, weights=prices, minlength=len(store.label_values))
+    order = np.argsort(-label_count, kind='stable')
+    stats['labels'] = [
+        {'label': store.label_values[i], 'count': int(label_count[i]), 'total_price': int(label_sum[i])}
+        for i in order if label_count[i]
+    ]
+
+    # Топ-N без полной сортировки: argpartition, затем сортировка только N
+    k = min(top_n, count)
+    if k > 0:
+        top = np.argpartition(prices, count - k)[count - k:]
+        top = top[np.argsort(-prices[top], kind='stable')]
+        stats['top'] = [store[int(i)] for i in top]
+    else:
+        stats['top'] = []
+
+    return stats
+
+def parse_stats_params(get):
+    """Разбор параметров запроса /stats; get(name) -> строка или None"""
+    quantiles = DEFAULT_QUANTILES
+    if get('quantiles'):
+        quantiles = tuple(float(q) for q in get('quantiles').split(','))
+        if any(not 0 <= q <= 1 for q in quantiles):
+            raise ValueError('Квантили должны быть в диапазоне 0..1')
+
+    bins = int(get('bins') or 10)
+    top_n = int(get('top') or 10)
+    if not 1 <= bins <= 1000 or not 0 <= top_n <= 1000:
+        raise ValueError('bins должен быть 1..1000, top - 0..1000')
+
+    return {'quantiles': quantiles, 'bins': bins, 'top_n': top_n}
+
+class StoreCache:
+    """Небольшой LRU-кэш загруженных хранилищ по файлу товаров
+
+    Файл задачи после записи не меняется, поэтому повторные /stats
+    не перечитывают JSON Lines.
+    """
+
+    def __init__(self, max_items=4):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, results):
+        """Хранилище товаров задачи по ее сводке"""
+        path = results.get('products_file')
+        if not path or not os.path.exists(path):
+            return ProductStore(results.get('products', []))
+
+        key = (path, os.path.getmtime(path))
+        with self.lock:
+            store = self.items.get(key)
+            if store is not None:
+                self.items.move_to_end(key)
+                return store
+
+        store = ProductStore.load(path)
+        with self.lock:
+            self.items[key] = store
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return store
+
+def job_stats(cache, results, params):
+    """Статистика задачи с подписью, по какой задаче считали"""
+    store = cache.get(results)
+    stats = compute_stats(store, **params)
+    stats['job_id'] = results.get('job_id')
+    return stats
@@ -5,14 +5,56 @@ from aiohttp import web
 import json
 import time
 from datetime import datetime
-from bs4 import BeautifulSoup
-import re
+import os
+import signal
 import sys
+import tempfile
+
+from jobs import JobRegistry, sse_event
+from serialization import negotiate
+from results_io import (write_json_atomic, write_products, products_path, read_summary,
+                        parse_page_params, results_page)
+import export
+from product_store import ProductStore
+import analytics
+from dedup import Deduplicator
+from result_cache import ResultCache, request_key
+from admission import AdmissionController, Overloaded
+from checkpoint import Checkpoint
+import batch
+from crawler import fetch_async, parse_catalog_html, page_url
+from http_archive import open_archive
+from details import DETAIL_QUEUE_SIZE, parse_detail, detail_workers, count_details
+from memory import MemoryMonitor, SnapshotTracker, parse_debug_params, start_tracing
+from extraction import DEFAULT_PLAN, load_schema, request_plan
+from estimate import SampleEstimate, last_page, parse_mode
+from price_history import PriceHistory, history_path, history_report, parse_history_params
+from search_index import SearchIndex, parse_search_params
 
 class AsyncParserServer:
-    def __init__(self, host='localhost', port=8080):
+    def __init__(self, host='localhost', port=8080, max_jobs=4, max_queue=8, max_pages=16,
+                 max_details=8, drain_timeout=10.0, products_format='jsonl', archive=None, plan=None,
+                 history=None):
         self.host = host
         self.port = port
+        self.drain_timeout = drain_timeout
+        self.products_format = products_format
+        self.archive = archive  # http_archive.HttpArchive: запись или воспроизведение
+        self.plan = plan or DEFAULT_PLAN  # схема полей карточки (--schema)
+        self.history = history  # price_history.PriceHistory или None
+        self.search = SearchIndex()  # пополняется разобранными страницами
+        self.draining = False
+        self.admission = AdmissionController(max_jobs=max_jobs, max_queue=max_queue)
+        self.max_pages = max_pages
+        self.page_slots = None  # asyncio.Semaphore создается в цикле событий
+        self.max_details = max_details
+        self.detail_slots = None
+        self.memory = MemoryMonitor()
+        self.memory_snapshots = SnapshotTracker()
+        self.jobs = JobRegistry(monitor=self.memory)
+        self.background_tasks = set()
+        self.stores = analytics.StoreCache()
+        self.cache = ResultCache()
         self.app = web.Application()
         self.setup_routes()
     
@@ -21,6 +63,15 @@ class AsyncParserServer:
         self.app.router.add_post('/parse', self.handle_parse)
         self.app.router.add_get('/', self.handle_root)
         self.app.router.add_get('/status', self.handle_status)
+        self.app.router.add_get('/ready', self.handle_ready)
+        self.app.router.add_get('/jobs/{job_id}', self.handle_job)
+        self.app.router.add_get('/jobs/{job_id}/events', self.handle_job_events)
+        self.app.router.add_get('/export', self.handle_export)
+        self.app.router.add_get('/stats', self.handle_stats)
+        self.app.router.add_get('/results/{job_id}', self.handle_results)
+        self.app.router.add_get('/debug/memory', self.handle_debug_memory)
+        self.app.router.add_get('/history', self.handle_history)
+        self.app.router.add_get('/search', self.handle_search)
     
     async def handle_root(self, request):
         """Корневой эндпоинт"""
@@ -29,190 +80,801 @@ class AsyncParserServer:
                  "Используйте:\n"
                  "POST /parse - запуск парсинга\n"
                  "GET /status - статус сервера\n"
+                 "GET /ready - готовность сервера\n"
+                 "GET /jobs/{id}?wait=30 - ожидание завершения задачи\n"
+                 "GET /jobs/{id}/events - поток прогресса (SSE)\n"
+                 "GET /export?format=csv|parquet|arrow - экспорт результатов\n"
+                 "GET /stats - статистика цен по задаче\n"
+                 "GET /results/{id|latest}?offset=&limit= - страница товаров задачи\n"
+                 "GET /debug/memory?top=&group= - места выделения памяти (tracemalloc)\n"
+                 "GET /history?name=&label=&since=&until= - история цен товара по обходам\n"
+                 "GET /search?q=&limit=&min_price=&max_price= - поиск товаров по названию и метке\n"
                  f"\nПорт: {self.port}",
             content_type='text/plain'
         )
     
     async def handle_status(self, request):
         """Статус сервера"""
-        return web.json_response({
+        return self.respond(request, {
             'status': 'running',
             'server': 'async',
             'port': self.port,
+            'load': dict(self.admission.stats(), max_pages=self.max_pages,
+                         max_details=self.max_details),
+            'memory': self.memory.process_memory(),
             'endpoints': {
                 'POST /parse': 'Запуск парсинга каталога',
-                'GET /status': 'Статус сервера'
+                'GET /status': 'Статус сервера',
+                'GET /ready': 'Готовность сервера',
+                'GET /jobs/{id}?wait=30': 'Ожидание завершения задачи (long-poll)',
+                'GET /jobs/{id}/events': 'Прогресс задачи (Server-Sent Events)',
+                'GET /export?format=csv|parquet|arrow&job=': 'Экспорт всех товаров задачи',
+                'GET /stats?job=&quantiles=&bins=&top=': 'Статистика цен по всем товарам задачи',
+                'GET /results/{id|latest}?offset=&limit=': 'Сводка и страница товаров задачи',
+                'GET /debug/memory?top=&group=&start=&stop=': 'Топ мест выделения памяти и разница снимков',
+                'GET /history?name=&label=&since=&until=&limit=': 'История цен товаров по обходам',
+                'GET /search?q=&limit=&min_price=&max_price=': 'Поиск товаров по названию и метке'
             }
         })
     
+    def respond(self, request, data, status=200, headers=None):
+        """Ответ в формате по заголовку Accept: JSON (orjson) или MessagePack"""
+        codec = negotiate(request.headers.get('Accept'))
+        response = web.Response(body=codec.dumps(data), status=status, headers=headers)
+        response.headers['Content-Type'] = codec.content_type
+        response.headers['Vary'] = 'Accept'
+        return response
+    
+    async def handle_ready(self, request):
+        """Проба готовности для лаунчера"""
+        return self.respond(request, {'ready': True, 'server': 'async', 'port': self.port})
+    
     async def fetch_page(self, session, url):
-        """Получение HTML страницы"""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            }
-            async with session.get(url, headers=headers, timeout=30) as response:
-                if response.status == 200:
-                    return await response.text()
-                else:
-                    print(f"Ошибка {response.status} для {url}")
-                    return None
-        except Exception as e:
-            print(f"Ошибка получения {url}: {e}")
+        """Получение HTML страницы через общее ядро обхода"""
+        return await fetch_async(session, url, archive=self.archive)
+    
+    async def parse_catalog_page(self, session, page_url, links=False, plan=None):
+        """Парсинг страницы каталога; links - сохранять ссылки на товары
+        
+        None - страница не загрузилась (в отличие от пустой страницы).
+        """
+        # Общий бюджет одновременно загружаемых страниц на весь сервер
+        async with self.page_slots:
+            html = await self.fetch_page(session, page_url)
+        if html is None:
             return None
+        products = parse_catalog_html(html, page_url, links, plan=plan or self.plan)
+        self.search.add(products)
+        return products
     
-    async def parse_product_card(self, soup, product_div):
-        """Парсинг одной карточки товара"""
-        try:
-            # Название товара
-            title_element = product_div.find('p', class_='set-card__title')
-            if title_element:
-                name_link = title_element.find('a', class_='di_b c_b')
-                if name_link:
-                    product_name = name_link.get_text(strip=True)
-                else:
-                    product_name = title_element.get_text(strip=True)
+    @staticmethod
+    def time_left(deadline):
+        """Секунд до срока задачи (None - срока нет)"""
+        if deadline is None:
+            return None
+        return max(0.0, deadline - asyncio.get_running_loop().time())
+    
+    async def parse_multiple_pages(self, session, base_url, start_page, end_page, job=None, dedup=None,
+                                   checkpoint=None, detail_queue=None, deadline=None, plan=None):
+        """Парсинг нескольких страниц
+        
+        Возвращает (товары, пропущенные страницы). Страницы из контрольной
+        точки не загружаются повторно; при остановке сервера или по сроку
+        deadline (время цикла событий) оставшиеся страницы пропускаются,
+        как и не загрузившиеся.
+        С detail_queue новые товары сразу уходят на этап карточек, а
+        каталог продолжает загружаться параллельно с ним.
+        """
+        all_products = ProductStore()
+        skipped = []
+        pending = []
+        
+        for page_num in range(start_page, end_page + 1):
+            if checkpoint and checkpoint.done(page_num):
+                products = checkpoint.products(page_num)
+            elif self.draining or self.time_left(deadline) == 0:
+                skipped.append(page_num)
+                continue
             else:
-                product_name = "Без названия"
+                print(f"Парсинг страницы {page_num}...")
+                try:
+                    products = await asyncio.wait_for(
+                        self.parse_catalog_page(session, page_url(base_url, page_num),
+                                                links=detail_queue is not None, plan=plan),
+                        self.time_left(deadline)
+                    )
+                except asyncio.TimeoutError:
+                    print(f"Страница {page_num} отменена: истек срок задачи")
+                    skipped.append(page_num)
+                    continue
+                if products is None:
+                    # Не загрузилась - не в контрольную точку, resume ее повторит
+                    print(f"Страница {page_num} пропущена: ошибка загрузки")
+                    skipped.append(page_num)
+                elif checkpoint:
+                    checkpoint.record(page_num, products)
+                
+                # Небольшая задержка между запросами (не дольше срока задачи);
+                # при воспроизведении из архива сайт не нагружается
+                if not (self.archive and self.archive.replaying):
+                    left = self.time_left(deadline)
+                    await asyncio.sleep(1 if left is None else min(1, left))
+                if products is None:
+                    if job:
+                        job.progress(0)
+                    continue
             
-            # Цена товара
-            price_element = product_div.find('span', class_='set-card__price')
-            price = 0
-            if price_element:
-                price_text = price_element.get_text(strip=True)
-                price_match = re.search(r'[\d\s]+(?=\s*₽)', price_text)
-                if price_match:
-                    price_str = price_match.group().replace(' ', '')
-                    try:
-                        price = int(price_str)
-                    except:
-                        price = 0
-            
-            # Артикул/метка
-            label_element = product_div.find('span', class_='set-card__label')
-            label = label_element.get_text(strip=True) if label_element else ""
-            
-            return {
-                'name': product_name,
-                'price': price,
-                'label': label
-            }
+            if job:
+                job.progress(len(products))
+            if dedup:
+                products = dedup.filter(products)
+            if detail_queue is None:
+                all_products.extend(products)
+                continue
+            # Очередь ограничена: если карточки отстают, каталог ждет
+            try:
+                for product in products:
+                    await asyncio.wait_for(detail_queue.put(product), self.time_left(deadline))
+            except asyncio.TimeoutError:
+                pass
+            pending.append(products)
+        
+        if detail_queue is not None:
+            try:
+                await asyncio.wait_for(detail_queue.join(), self.time_left(deadline))
+            except asyncio.TimeoutError:
+                print("Этап карточек не завершен к сроку задачи")
+            for products in pending:
+                all_products.extend(products)
+        
+        return all_products, skipped
+    
+    async def detail_worker(self, session, detail_queue):
+        """Этап карточек: дополнение товара полями со страницы товара"""
+        while True:
+            product = await detail_queue.get()
+            try:
+                if product.get('url'):
+                    async with self.detail_slots:
+                        html = await self.fetch_page(session, product['url'])
+                    if html:
+                        product.update(parse_detail(html))
+            except Exception as e:
+                print(f"Ошибка парсинга карточки товара: {e}")
+            finally:
+                detail_queue.task_done()
+    
+    async def run_job(self, job, data):
+        """Выполнение задачи парсинга с отметкой ошибки в job"""
+        try:
+            if 'batch' in data:
+                return await self.crawl_batch(job, data)
+            if parse_mode(data):
+                return await self.crawl_estimate(job, data)
+            return await self.crawl(job, data)
         except Exception as e:
-            print(f"Ошибка парсинга карточки: {e}")
+            job.fail(e)
+            raise
+    
+    async def crawl(self, job, data):
+        """Парсинг диапазона страниц и сохранение результатов"""
+        url = data.get('url', 'https://dental-first.ru/catalog')
+        start_page = data.get('start_page', 1)
+        end_page = data.get('end_page', 3)
+        
+        # Страницы каталога сдвигаются во время обхода - убираем повторы
+        pages_total = int(end_page) - int(start_page) + 1
+        dedup = Deduplicator.for_pages(pages_total) if data.get('dedup', True) else None
+        checkpoint = Checkpoint('async', job.key, resume=data.get('resume', False))
+        resumed_pages = len(checkpoint.pages)
+        plan = request_plan(data, self.plan)
+        
+        print(f"Запуск парсинга: {url}")
+        print(f"Страницы: {start_page}-{end_page}")
+        
+        job.start(end_page - start_page + 1)
+        start_time = time.time()
+        deadline = self.job_deadline(job, data)
+        
+        async with aiohttp.ClientSession() as session:
+            detail_queue = None
+            workers = []
+            if data.get('details'):
+                detail_queue = asyncio.Queue(maxsize=DETAIL_QUEUE_SIZE)
+                workers = [
+                    asyncio.create_task(self.detail_worker(session, detail_queue))
+                    for _ in range(detail_workers(data))
+                ]
+            try:
+                all_products, skipped = await self.parse_multiple_pages(
+                    session, url, start_page, end_page, job, dedup, checkpoint, detail_queue, deadline, plan
+                )
+            finally:
+                for worker in workers:
+                    worker.cancel()
+        
+        if skipped and self.draining:
+            raise RuntimeError(
+                f"Обход прерван остановкой сервера, не обработано страниц: {len(skipped)}. "
+                "Повторите запрос с \"resume\": true"
+            )
+        if not skipped:
+            checkpoint.remove()
+        
+        end_time = time.time()
+        execution_time = end_time - start_time
+        
+        # Считаем общую стоимость
+        total_price = all_products.total_price()
+        
+        # Полный список товаров - отдельным файлом, в сводке только первые 100
+        products_file = products_path('async', job.id, self.products_format)
+        write_products(products_file, all_products)
+        # Блокировка общего файла истории и запись - не в цикле событий
+        await asyncio.get_running_loop().run_in_executor(None, self.record_history, all_products, start_time)
+        
+        # Сохраняем результаты
+        result_data = {
+            'job_id': job.id,
+            'timestamp': datetime.now().isoformat(),
+            'url': url,
+            'pages_parsed': f"{start_page}-{end_page}",
+            'total_products': len(all_products),
+            'total_price': total_price,
+            'execution_time': round(execution_time, 2),
+            'duplicates_removed': dedup.duplicates if dedup else 0,
+            'resumed_pages': resumed_pages,
+            'details_fetched': count_details(all_products),
+            'partial': bool(skipped),
+            'pages_completed': [p for p in range(start_page, end_page + 1) if p not in skipped],
+            'pages_skipped': skipped,
+            'products_file': products_file,
+            'products': all_products[:100]  # Первые 100 товаров
+        }
+        
+        write_json_atomic('async_results.json', result_data)
+        
+        print(f"Парсинг завершен: {len(all_products)} товаров")
+        if dedup and dedup.duplicates:
+            print(f"Удалено повторов: {dedup.duplicates}")
+        print(f"Время: {execution_time:.2f} сек")
+        print(f"Сумма: {total_price:,} руб".replace(',', ' '))
+        
+        summary = {k: v for k, v in result_data.items() if k != 'products'}
+        summary['results_file'] = 'async_results.json'
+        if not skipped:
+            # Неполный результат (срок, ошибки загрузки) не кэшируем
+            self.cache.put(job.key, summary)
+        job.finish(summary)
+        return summary
+    
+    def job_deadline(self, job, data):
+        """Срок задачи во времени цикла событий по "deadline_ms"
+        
+        Отсчитывается от поступления запроса, так что ожидание в очереди
+        допуска тоже входит в бюджет.
+        """
+        deadline_ms = data.get('deadline_ms')
+        if deadline_ms is None:
             return None
+        elapsed = time.time() - job.created
+        return asyncio.get_running_loop().time() + float(deadline_ms) / 1000 - elapsed
     
-    async def parse_catalog_page(self, session, page_url):
-        """Парсинг страницы каталога"""
-        html = await self.fetch_page(session, page_url)
-        if not html:
-            return []
+    async def crawl_batch(self, job, data):
+        """Пакетный обход нескольких разделов одним планировщиком
+        
+        Страницы всех разделов идут через общий пул соединений с лимитом
+        на хост; порядок задает batch.BatchScheduler.
+        """
+        entries = batch.parse_batch(data)
+        scheduler = batch.BatchScheduler(entries)
+        workers = max(1, min(int(data.get('concurrency', 8)), self.max_pages))
+        pages = [[] for _ in entries]
+        plan = request_plan(data, self.plan)
         
-        soup = BeautifulSoup(html, 'html.parser')
-        products = []
+        print(f"Запуск пакетного парсинга: разделов {len(entries)}, страниц {scheduler.total}")
+        job.start(scheduler.total)
+        start_time = time.time()
+        deadline = self.job_deadline(job, data)
         
-        # Находим все карточки товаров
-        product_cards = soup.find_all('div', class_='set-card block')
+        async def worker(session):
+            while not self.draining and self.time_left(deadline) != 0:
+                task = scheduler.next()
+                if task is None:
+                    return
+                try:
+                    products = await asyncio.wait_for(
+                        self.parse_catalog_page(session, task.url, plan=plan), self.time_left(deadline)
+                    )
+                except asyncio.TimeoutError:
+                    return
+                if products is None:
+                    continue  # не загрузилась - попадет в pages_skipped раздела
+                pages[task.entry].append((task.page, products))
+                job.progress(len(products))
         
-        for card in product_cards:
-            product_data = await self.parse_product_card(soup, card)
-            if product_data:
-                products.append(product_data)
+        connector = aiohttp.TCPConnector(limit_per_host=batch.per_host_limit(data))
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(worker(session) for _ in range(workers)))
         
+        if self.draining:
+            raise RuntimeError("Пакетный обход прерван остановкой сервера")
+        
+        all_products, categories = batch.group_results(entries, pages, data.get('dedup', True))
+        partial = any(c['pages_skipped'] for c in categories)
+        execution_time = time.time() - start_time
+        total_price = all_products.total_price()
+        
+        products_file = products_path('async', job.id, self.products_format)
+        write_products(products_file, all_products)
+        # Блокировка общего файла истории и запись - не в цикле событий
+        await asyncio.get_running_loop().run_in_executor(None, self.record_history, all_products, start_time)
+        
+        result_data = {
+            'job_id': job.id,
+            'timestamp': datetime.now().isoformat(),
+            'url': entries[0]['url'],
+            'pages_parsed': f"{scheduler.total} стр. в {len(entries)} разделах",
+            'total_products': len(all_products),
+            'total_price': total_price,
+            'execution_time': round(execution_time, 2),
+            'duplicates_removed': sum(c['duplicates_removed'] for c in categories),
+            'partial': partial,
+            'categories': categories,
+            'products_file': products_file,
+            'products': all_products[:100]  # Первые 100 товаров
+        }
+        
+        write_json_atomic('async_results.json', result_data)
+        
+        print(f"Пакетный парсинг завершен: {len(all_products)} товаров")
+        print(f"Время: {execution_time:.2f} сек")
+        
+        summary = {k: v for k, v in result_data.items() if k != 'products'}
+        summary['results_file'] = 'async_results.json'
+        if not partial:
+            self.cache.put(job.key, summary)
+        job.finish(summary)
+        return summary
+    
+    def record_history(self, products, when):
+        """Цены обхода в историю; ошибка истории не прерывает задачу"""
+        if self.history is None:
+            return
+        try:
+            stats = self.history.record(products, when)
+            print(f"История цен: новых товаров {stats['new_products']}, "
+                  f"изменений цен {stats['price_changes']}, записано {stats['bytes_written']} байт")
+        except Exception as e:
+            print(f"Ошибка записи истории цен: {e}")
+    
+    async def fetch_sample_page(self, session, url, plan):
+        """Товары страницы выборки; None - страница не загрузилась"""
+        async with self.page_slots:
+            html = await self.fetch_page(session, url)
+        if html is None:
+            return None
+        products = parse_catalog_html(html, url, plan=plan)
+        self.search.add(products)
         return products
     
-    async def parse_multiple_pages(self, session, base_url, start_page, end_page):
-        """Парсинг нескольких страниц"""
-        all_products = []
+    async def crawl_estimate(self, job, data):
+        """Приблизительный обход ("mode": "estimate") по выборке страниц
         
-        for page_num in range(start_page, end_page + 1):
-            if page_num == 1:
-                page_url = base_url
-            else:
-                page_url = f"{base_url}?PAGEN_1={page_num}"
+        Раунды выборки идут, пока интервал не сузится до "target_error", не
+        наступит срок "deadline_ms" или не кончатся страницы. С "discover"
+        последняя страница берется из пагинации первой.
+        """
+        params = parse_mode(data)
+        url = data.get('url', 'https://dental-first.ru/catalog')
+        start_page = int(data.get('start_page', 1))
+        end_page = int(data.get('end_page', 3))
+        plan = request_plan(data, self.plan)
+        deadline = self.job_deadline(job, data)
+        start_time = time.time()
+        sampled = ProductStore()
+        
+        async with aiohttp.ClientSession() as session:
+            known = {}
+            if params['discover']:
+                first_url = page_url(url, start_page)
+                async with self.page_slots:
+                    html = await self.fetch_page(session, first_url)
+                if html is None:
+                    raise RuntimeError(f"Страница {start_page} недоступна, последняя страница не найдена")
+                end_page = last_page(html, start_page)
+                known[start_page] = parse_catalog_html(html, first_url, plan=plan)
+                self.search.add(known[start_page])
             
-            print(f"Парсинг страницы {page_num}...")
-            products = await self.parse_catalog_page(session, page_url)
-            all_products.extend(products)
+            sample = SampleEstimate(start_page, end_page, params['strata'], params['confidence'],
+                                    params['seed'], known)
+            print(f"Оценка по выборке: {url}, страницы {start_page}-{end_page}, блоков {len(sample.strata)}")
+            job.start(sample.pages_total)
+            for products in known.values():
+                job.progress(len(products))
+                sampled.extend(products)
             
-            # Небольшая задержка между запросами
-            await asyncio.sleep(1)
+            while True:
+                pages = sample.next_round(params['round_size'])
+                if not pages:
+                    reason = 'exhausted'
+                    break
+                tasks = {asyncio.ensure_future(self.fetch_sample_page(session, page_url(url, page), plan)): page
+                         for page in pages}
+                done, pending = await asyncio.wait(tasks, timeout=self.time_left(deadline))
+                for task in pending:
+                    task.cancel()
+                for task in done:
+                    products = None if task.exception() else task.result()
+                    sample.record(tasks[task], products)
+                    job.progress(len(products or ()))
+                    sampled.extend(products or ())
+                if pending or self.time_left(deadline) == 0:
+                    reason = 'deadline'
+                elif self.draining:
+                    reason = 'draining'
+                else:
+                    reason = sample.stop_reason(params['target_error'], params['max_sample'])
+                if reason:
+                    break
+        
+        report = sample.report()
+        report['stop_reason'] = reason
+        execution_time = time.time() - start_time
+        
+        # В файл товаров идут только товары страниц выборки
+        products_file = products_path('async', job.id, self.products_format)
+        write_products(products_file, sampled)
+        
+        result_data = {
+            'job_id': job.id,
+            'timestamp': datetime.now().isoformat(),
+            'url': url,
+            'mode': 'estimate',
+            'pages_parsed': f"{report['pages_sampled']} стр. из {start_page}-{end_page}",
+            'total_products': report['total_products'],
+            'total_price': report['total_price'],
+            'execution_time': round(execution_time, 2),
+            'duplicates_removed': 0,
+            'estimate': report,
+            'products_file': products_file,
+            'products': sampled[:100]  # Первые 100 товаров выборки
+        }
+        
+        write_json_atomic('async_results.json', result_data)
+        
+        error = report['relative_error']
+        print(f"Оценка завершена ({reason}): страниц {report['pages_sampled']} из {report['pages_in_range']}")
+        print(f"Товаров: ~{report['total_products']}")
+        print(f"Сумма: ~{report['total_price']:,} руб".replace(',', ' ')
+              + (f" (±{error:.1%})" if error is not None else ''))
+        
+        summary = {k: v for k, v in result_data.items() if k != 'products'}
+        summary['results_file'] = 'async_results.json'
+        if reason not in ('deadline', 'draining'):
+            self.cache.put(job.key, summary)
+        job.finish(summary)
+        return summary
+    
+    async def run_job_in_background(self, job, data):
+        """Фоновая задача: ждет допуска, ошибки уже записаны в job"""
+        try:
+            if job.ticket:
+                await job.ticket.wait_async()
+                if job.ticket.cancelled:
+                    job.fail('Сервер останавливается, задача не начата')
+                    return
+            await self.run_job(job, data)
+        except Exception as e:
+            print(f"Ошибка при парсинге: {e}")
+        finally:
+            if job.ticket:
+                self.admission.release(job.ticket)
+    
+    def start_job(self, data):
+        """Задача для запроса: из кэша, общая с идущей или новая
+        
+        Одинаковые одновременные запросы присоединяются к одному обходу
+        (single-flight), свежие завершенные берутся из кэша.
+        """
+        if 'batch' in data:
+            batch.parse_batch(data)  # ValueError -> 400 до постановки задачи
+        request_plan(data, self.plan)  # ошибка в "schema" - тоже 400
+        parse_mode(data)  # и в "mode" с параметрами оценки
+        if data.get('deadline_ms') is not None and float(data['deadline_ms']) <= 0:
+            raise ValueError('"deadline_ms" должен быть положительным')
+        key = request_key(data)
         
-        return all_products
+        if not data.get('no_cache'):
+            cached = self.cache.get(key, data.get('max_age'))
+            if cached:
+                job = self.jobs.create(data, key)
+                job.finish(cached)
+                return job
+        
+        job, created = self.jobs.get_or_create(data, key, admit=self.admission.enqueue)
+        if created:
+            task = asyncio.create_task(self.run_job_in_background(job, data))
+            # Держим ссылку, чтобы задачу не собрал GC
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        else:
+            print(f"Запрос присоединен к идущей задаче {job.id}")
+        return job
     
     async def handle_parse(self, request):
-        """Обработчик запроса на парсинг"""
+        """Обработчик запроса на парсинг
+        
+        По умолчанию отвечает после завершения парсинга. С "background": true
+        сразу возвращает 202 и job_id для /jobs/{id}. Параметры кэша:
+        "max_age" (сек) - допустимый возраст результата, "no_cache" - не
+        брать результат из кэша. "schema" - поля карточки поверх схемы
+        сервера (extraction.merge_schema). "mode": "estimate" - оценка
+        итогов по выборке страниц (estimate.SampleEstimate).
+        """
         try:
             # Получаем данные запроса
             data = await request.json()
-            url = data.get('url', 'https://dental-first.ru/catalog')
-            start_page = data.get('start_page', 1)
-            end_page = data.get('end_page', 3)
-            
-            print(f"Запуск парсинга: {url}")
-            print(f"Страницы: {start_page}-{end_page}")
-            
-            start_time = time.time()
-            
-            async with aiohttp.ClientSession() as session:
-                all_products = await self.parse_multiple_pages(
-                    session, url, start_page, end_page
-                )
+            job = self.start_job(data)
             
-            end_time = time.time()
-            execution_time = end_time - start_time
+            if data.get('background'):
+                return self.respond(request, {
+                    'status': 'processing',
+                    'message': 'Парсинг запущен в фоновом режиме',
+                    'job_id': job.id,
+                    'wait_url': f'/jobs/{job.id}?wait=30',
+                    'events_url': f'/jobs/{job.id}/events'
+                }, status=202)
             
-            # Считаем общую стоимость
-            total_price = sum(p['price'] for p in all_products)
+            snapshot = await job.wait_async()
+            if snapshot['status'] == 'error':
+                raise RuntimeError(snapshot['error'])
+            summary = snapshot['result']
             
-            # Сохраняем результаты
-            result_data = {
-                'timestamp': datetime.now().isoformat(),
-                'url': url,
-                'pages_parsed': f"{start_page}-{end_page}",
-                'total_products': len(all_products),
-                'total_price': total_price,
-                'execution_time': round(execution_time, 2),
-                'products': all_products[:100]  # Первые 100 товаров
-            }
-            
-            with open('async_results.json', 'w', encoding='utf-8') as f:
-                json.dump(result_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"Парсинг завершен: {len(all_products)} товаров")
-            print(f"Время: {execution_time:.2f} сек")
-            print(f"Сумма: {total_price:,} руб".replace(',', ' '))
-            
-            return web.json_response({
+            return self.respond(request, {
                 'status': 'success',
-                'message': f'Парсинг завершен. Найдено {len(all_products)} товаров.',
-                'total_products': len(all_products),
-                'total_price': total_price,
-                'execution_time': round(execution_time, 2),
+                'message': (f'Оценка по выборке: ~{summary["total_products"]} товаров.'
+                            if summary.get('mode') == 'estimate' else
+                            f'Парсинг завершен. Найдено {summary["total_products"]} товаров.'),
+                'job_id': job.id,
+                'total_products': summary['total_products'],
+                'total_price': summary['total_price'],
+                'execution_time': summary['execution_time'],
+                'duplicates_removed': summary['duplicates_removed'],
+                'cached': summary.get('cached', False),
+                'categories': summary.get('categories'),
+                'partial': summary.get('partial', False),
+                'pages_completed': summary.get('pages_completed'),
+                'pages_skipped': summary.get('pages_skipped'),
+                'estimate': summary.get('estimate'),
+                'memory': snapshot['memory'],
                 'results_file': 'async_results.json'
             })
             
+        except Overloaded as e:
+            return self.respond(request, {
+                'status': 'draining' if e.draining else 'overloaded',
+                'message': str(e),
+                'retry_after': e.retry_after
+            }, status=503 if e.draining else 429, headers={'Retry-After': str(e.retry_after)})
+        
         except json.JSONDecodeError:
-            return web.json_response({
+            return self.respond(request, {
                 'status': 'error',
                 'message': 'Неверный JSON в теле запроса'
             }, status=400)
+        
+        except (ValueError, TypeError) as e:
+            return self.respond(request, {
+                'status': 'error',
+                'message': f'Неверные параметры запроса: {e}'
+            }, status=400)
             
         except Exception as e:
             print(f"Ошибка при парсинге: {e}")
-            return web.json_response({
+            return self.respond(request, {
                 'status': 'error',
                 'message': str(e)
             }, status=500)
     
+    async def handle_job(self, request):
+        """Состояние задачи; ?wait=N - ждать завершения до N секунд"""
+        job = self.jobs.get(request.match_info['job_id'])
+        if not job:
+            return self.respond(request, {
+                'status': 'error',
+                'message': 'Задача не найдена'
+            }, status=404)
+        
+        try:
+            wait = min(float(request.query.get('wait', 0)), 300)
+        except ValueError:
+            wait = 0
+        
+        if wait > 0 and not job.finished:
+            snapshot = await job.wait_async(wait)
+        else:
+            snapshot = job.snapshot()
+        return self.respond(request, snapshot)
+    
+    async def handle_job_events(self, request):
+        """Поток прогресса задачи в формате Server-Sent Events"""
+        job = self.jobs.get(request.match_info['job_id'])
+        if not job:
+            return self.respond(request, {
+                'status': 'error',
+                'message': 'Задача не найдена'
+            }, status=404)
+        
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache'
+        })
+        await response.prepare(request)
+        
+        version = None
+        snapshot = job.snapshot()
+        while True:
+            if version != snapshot['version']:
+                version = snapshot['version']
+                event = 'done' if job.finished else 'progress'
+                await response.write(sse_event(event, json.dumps(snapshot, ensure_ascii=False)))
+                if job.finished:
+                    break
+            else:
+                # Комментарий-пинг, чтобы прокси не закрыли соединение
+                await response.write(b': keepalive\n\n')
+            snapshot = await job.wait_async(15, since_version=version)
+        
+        await response.write_eof()
+        return response
+    
+    def job_results(self, job_id):
+        """Сводка задачи: из реестра или из последнего файла результатов"""
+        if job_id:
+            job = self.jobs.get(job_id)
+            return job.result if job else None
+        if os.path.exists('async_results.json'):
+            return read_summary('async_results.json')
+        return None
+    
+    async def handle_export(self, request):
+        """Экспорт всех товаров задачи в CSV, Parquet или Arrow IPC"""
+        fmt = request.query.get('format', 'csv')
+        if fmt not in export.FORMATS:
+            return self.respond(request, {
+                'status': 'error',
+                'message': f"Неизвестный формат: {fmt}"
+            }, status=400)
+        
+        results = self.job_results(request.query.get('job'))
+        if not results:
+            return self.respond(request, {
+                'status': 'error',
+                'message': 'Результаты не найдены'
+            }, status=404)
+        
+        suffix, content_type = export.FORMATS[fmt]
+        fd, output = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            # Экспорт блокирующий - выполняем в пуле потоков
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, export.export_data, results, fmt, output)
+            
+            response = web.StreamResponse(headers={
+                'Content-Type': content_type,
+                'Content-Disposition': f'attachment; filename="async_{results.get("job_id", "results")}{suffix}"'
+            })
+            response.content_length = os.path.getsize(output)
+            await response.prepare(request)
+            with open(output, 'rb') as f:
+                while True:
+                    chunk = f.read(64 * 1024)
+                    if not chunk:
+                        break
+                    await response.write(chunk)
+            await response.write_eof()
+            return response
+        except RuntimeError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=501)
+        finally:
+            os.remove(output)
+    
+    async def handle_stats(self, request):
+        """Статистика цен по всем товарам задачи"""
+        try:
+            params = analytics.parse_stats_params(request.query.get)
+        except ValueError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=400)
+        
+        results = self.job_results(request.query.get('job'))
+        if not results:
+            return self.respond(request, {
+                'status': 'error',
+                'message': 'Результаты не найдены'
+            }, status=404)
+        
+        try:
+            # Загрузка и расчет не должны блокировать цикл событий
+            loop = asyncio.get_running_loop()
+            stats = await loop.run_in_executor(
+                None, analytics.job_stats, self.stores, results, params
+            )
+        except RuntimeError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=501)
+        return self.respond(request, stats)
+    
+    async def handle_history(self, request):
+        """История цен товаров по обходам"""
+        if self.history is None:
+            return self.respond(request, {
+                'status': 'error',
+                'message': 'История цен выключена (--no-history)'
+            }, status=404)
+        try:
+            params = parse_history_params(request.query.get)
+        except ValueError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=400)
+        
+        # Дочитывание журнала - файловый ввод-вывод, не в цикле событий
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(None, history_report, self.history, params)
+        return self.respond(request, report)
+    
+    async def handle_search(self, request):
+        """Поиск товаров по названию и метке"""
+        try:
+            params = parse_search_params(request.query.get)
+        except ValueError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=400)
+        # Запрос - доли миллисекунды, в пул потоков не отдается
+        return self.respond(request, self.search.search(**params))
+    
+    async def handle_results(self, request):
+        """Сводка задачи и срез товаров без чтения всего файла"""
+        try:
+            offset, limit = parse_page_params(request.query.get)
+        except ValueError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=400)
+        
+        job_id = request.match_info['job_id']
+        results = self.job_results(None if job_id == 'latest' else job_id)
+        if not results or 'error' in results:
+            return self.respond(request, {
+                'status': 'error',
+                'message': 'Результаты не найдены'
+            }, status=404)
+        
+        return self.respond(request, results_page(results, offset, limit))
+    
+    async def handle_debug_memory(self, request):
+        """Снимок tracemalloc и разница с предыдущим запросом"""
+        try:
+            params = parse_debug_params(request.query.get)
+            # Снимок и сравнение занимают время - вне цикла событий
+            loop = asyncio.get_running_loop()
+            report = await loop.run_in_executor(
+                None, lambda: self.memory_snapshots.report(**params))
+        except ValueError as e:
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=400)
+        
+        report['process'] = self.memory.process_memory()
+        report['jobs'] = {job.id: job.snapshot()['memory'] for job in self.jobs.active()}
+        return self.respond(request, report)
+    
     async def run(self):
         """Запуск сервера"""
+        self.page_slots = asyncio.Semaphore(self.max_pages)
+        self.detail_slots = asyncio.Semaphore(self.max_details)
         runner = web.AppRunner(self.app)
         await runner.setup()
         site = web.TCPSite(runner, self.host, self.port)
         await site.start()
-        
+        if self.history is not None:
+            # Поиск по товарам прошлых обходов загружается в фоне
+            asyncio.get_running_loop().run_in_executor(None, self.search.add_history, self.history)
+
         print("="*60)
         print("АСИНХРОННЫЙ СЕРВЕР ЗАПУЩЕН")
         print("="*60)
@@ -226,8 +888,39 @@ class AsyncParserServer:
         print('  -d \'{"url":"https://dental-first.ru/catalog","start_page":1,"end_page":2}\'')
         print("="*60)
         
-        # Бесконечное ожидание
-        await asyncio.Event().wait()
+        # Ожидание сигнала остановки (SIGTERM от лаунчера или Ctrl+C)
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остается KeyboardInterrupt
+                pass
+        
+        await stop_event.wait()
+        await self.shutdown(runner)
+    
+    async def shutdown(self, runner):
+        """Плавная остановка: без новых задач, текущие завершаются или
+        сохраняют контрольную точку в пределах drain_timeout"""
+        print(f"\nОстановка сервера: ожидание задач до {self.drain_timeout:.0f} сек...")
+        self.draining = True
+        cancelled = self.admission.close()
+        if cancelled:
+            print(f"Отменено задач в очереди: {cancelled}")
+        
+        tasks = set(self.background_tasks)
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                print(f"Прервано задач по таймауту: {len(pending)}")
+                await asyncio.wait(pending, timeout=1)
+        
+        await runner.cleanup()
+        print("Сервер остановлен")
 
 def main():
     """Точка входа"""
@@ -236,11 +929,40 @@ def main():
     parser = argparse.ArgumentParser(description='Асинхронный сервер парсинга')
     parser.add_argument('--port', type=int, default=8080, help='Порт сервера')
     parser.add_argument('--host', default='localhost', help='Хост сервера')
+    parser.add_argument('--max-jobs', type=int, default=4, help='Одновременных задач парсинга')
+    parser.add_argument('--max-queue', type=int, default=8, help='Задач в очереди ожидания')
+    parser.add_argument('--max-pages', type=int, default=16, help='Одновременно загружаемых страниц')
+    parser.add_argument('--max-details', type=int, default=8,
+                        help='Одновременно загружаемых страниц товаров')
+    parser.add_argument('--products-format', choices=['jsonl', 'msgpack'], default='jsonl',
+                        help='Формат файлов results/ с полным списком товаров')
+    parser.add_argument('--record', metavar='ARCHIVE', help='Записывать загруженные страницы в zip-архив')
+    parser.add_argument('--replay', metavar='ARCHIVE', help='Отдавать страницы из архива, без сети')
+    parser.add_argument('--replay-latency', action='store_true',
+                        help='При воспроизведении выдерживать записанное время загрузки')
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help='Сколько секунд ждать текущие задачи при остановке')
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='FRAMES',
+                        help='Включить tracemalloc с глубиной стека FRAMES (0 - выключен)')
+    parser.add_argument('--schema', metavar='FILE',
+                        help='JSON-схема полей карточки (по умолчанию name, price, label)')
+    parser.add_argument('--history', metavar='FILE', default=history_path('async'),
+                        help='Файл истории цен (по умолчанию %(default)s; серверы пула пишут в общий)')
+    parser.add_argument('--no-history', action='store_true', help='Не вести историю цен')
     
     args = parser.parse_args()
     
     try:
-        server = AsyncParserServer(host=args.host, port=args.port)
+        start_tracing(args.tracemalloc)
+        server = AsyncParserServer(
+            host=args.host, port=args.port,
+            max_jobs=args.max_jobs, max_queue=args.max_queue, max_pages=args.max_pages,
+            max_details=args.max_details, drain_timeout=args.drain_timeout,
+            products_format=args.products_format,
+            archive=open_archive(args.record, args.replay, args.replay_latency),
+            plan=load_schema(args.schema) if args.schema else None,
+            history=None if args.no_history else PriceHistory(args.history)
+        )
         asyncio.run(server.run())
     except KeyboardInterrupt:
         print("\n\nСервер остановлен пользователем")
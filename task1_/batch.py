@@ -0,0 +1,135 @@
+# Пакетный обход нескольких разделов каталога одной задачей
+import threading
+from collections import OrderedDict, deque, namedtuple
+from urllib.parse import urlsplit
+
+from crawler import page_url
+from dedup import Deduplicator
+from product_store import ProductStore
+
+# Не больше стольких разделов в одном пакете
+MAX_BATCH = 50
+
+# Одновременных загрузок с одного хоста по умолчанию
+PER_HOST = 4
+
+PageTask = namedtuple('PageTask', 'entry page url')
+
+def parse_batch(data):
+    """Проверка поля "batch" запроса
+
+    Возвращает список разделов {'url', 'start_page', 'end_page', 'priority'};
+    ValueError при ошибке в параметрах.
+    """
+    entries = data.get('batch')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('"batch" должен быть непустым списком разделов')
+    if len(entries) > MAX_BATCH:
+        raise ValueError(f'в пакете больше {MAX_BATCH} разделов')
+
+    result = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('url'):
+            raise ValueError(f'раздел {i}: нужен объект с полем "url"')
+        start_page = int(entry.get('start_page', 1))
+        end_page = int(entry.get('end_page', start_page))
+        if start_page < 1 or end_page < start_page:
+            raise ValueError(f'раздел {i}: неверный диапазон страниц {start_page}-{end_page}')
+        result.append({
+            'url': str(entry['url']).strip(),
+            'start_page': start_page,
+            'end_page': end_page,
+            'priority': int(entry.get('priority', 0)),
+        })
+    return result
+
+def per_host_limit(data):
+    """Одновременных загрузок с одного хоста из параметров запроса"""
+    return max(1, min(int(data.get('per_host', PER_HOST)), 16))
+
+class BatchScheduler:
+    """Общий порядок страниц всех разделов пакета
+
+    Хосты обслуживаются по кругу, чтобы один большой сайт не занимал
+    все соединения. Внутри хоста сначала разделы с большим priority,
+    разделы одного приоритета чередуются постранично. Потокобезопасен:
+    next() вызывают и корутины, и рабочие потоки.
+    """
+
+    def __init__(self, entries):
+        self.lock = threading.Lock()
+        self.hosts = OrderedDict()
+        self.total = 0
+
+        for index, entry in enumerate(entries):
+            tasks = deque(
+                PageTask(index, page, page_url(entry['url'], page))
+                for page in range(entry['start_page'], entry['end_page'] + 1)
+            )
+            self.total += len(tasks)
+            host = urlsplit(entry['url']).netloc
+            levels = self.hosts.setdefault(host, {})
+            levels.setdefault(entry['priority'], deque()).append(tasks)
+
+    def next(self):
+        """Следующая страница или None, если страниц не осталось"""
+        with self.lock:
+            if not self.hosts:
+                return None
+            host, levels = next(iter(self.hosts.items()))
+            # Хост уходит в конец круга
+            self.hosts.move_to_end(host)
+
+            priority = max(levels)
+            categories = levels[priority]
+            tasks = categories.popleft()
+            task = tasks.popleft()
+            if tasks:
+                categories.append(tasks)
+            if not categories:
+                del levels[priority]
+            if not levels:
+                del self.hosts[host]
+            return task
+
+    def __iter__(self):
+        while True:
+            task = self.next()
+            if task is None:
+                return
+            yield task
+
+def group_results(entries, pages, dedup=True):
+    """Товары пакета, сгруппированные по разделам
+
+    pages[i] - список (номер страницы, товары) раздела i в любом порядке;
+    страницы без результата попадают в pages_skipped раздела. Возвращает
+    (общее хранилище, сводки разделов); товары раздела идут в хранилище
+    подряд, начиная с offset из его сводки.
+    """
+    all_products = ProductStore()
+    categories = []
+    for entry, entry_pages in zip(entries, pages):
+        pages_total = entry['end_page'] - entry['start_page'] + 1
+        dedup_filter = Deduplicator.for_pages(pages_total) if dedup else None
+        store = ProductStore()
+        for _, products in sorted(entry_pages, key=lambda item: item[0]):
+            if dedup_filter:
+                products = dedup_filter.filter(products)
+            store.extend(products)
+
+        done = {page for page, _ in entry_pages}
+        categories.append({
+            'url': entry['url'],
+            'pages_parsed': f"{entry['start_page']}-{entry['end_page']}",
+            'pages_completed': sorted(done),
+            'pages_skipped': [page for page in range(entry['start_page'], entry['end_page'] + 1)
+                              if page not in done],
+            'priority': entry['priority'],
+            'offset': len(all_products),
+            'total_products': len(store),
+            'total_price': store.total_price(),
+            'duplicates_removed': dedup_filter.duplicates if dedup_filter else 0,
+        })
+        all_products.extend(store)
+    return all_products, categories
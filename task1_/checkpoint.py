@@ -0,0 +1,65 @@
+# Контрольные точки обхода для продолжения после перезапуска
+import hashlib
+import json
+import os
+import threading
+
+CHECKPOINT_DIR = 'checkpoints'
+
+def checkpoint_path(server, key):
+    """Файл контрольной точки по ключу запроса"""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CHECKPOINT_DIR, f"{server}_{digest}.jsonl")
+
+class Checkpoint:
+    """Журнал завершенных страниц задачи (JSON Lines, дозапись)
+
+    Каждая строка - {"page": N, "products": [...]}, пишется сразу после
+    обработки страницы. Обрезанная последняя строка (аварийная остановка)
+    при загрузке пропускается.
+    """
+
+    def __init__(self, server, key, resume=False):
+        self.path = checkpoint_path(server, key)
+        self.pages = {}
+        self.lock = threading.Lock()
+
+        if resume:
+            self.load()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        """Чтение ранее завершенных страниц"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.pages[entry['page']] = entry['products']
+        if self.pages:
+            print(f"Продолжение по контрольной точке: готово страниц {len(self.pages)}")
+
+    def done(self, page):
+        return page in self.pages
+
+    def products(self, page):
+        return self.pages[page]
+
+    def record(self, page, products):
+        """Запись завершенной страницы"""
+        line = json.dumps({'page': page, 'products': list(products)}, ensure_ascii=False)
+        with self.lock:
+            self.pages[page] = products
+            os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def remove(self):
+        """Удаление после успешного завершения задачи"""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,228 @@
+# Общее ядро обхода каталога: загрузка, разбор карточек и модели выполнения
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from extraction import DEFAULT_PLAN
+
+# Одни и те же заголовки для всех моделей, чтобы сравнение было честным
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+}
+
+TIMEOUT = 30
+
+# Движок разбора HTML по умолчанию (встроенный, без зависимостей)
+PARSER = 'html.parser'
+
+def page_url(base_url, page_num):
+    """URL страницы каталога в пагинации Bitrix"""
+    return base_url if page_num == 1 else f"{base_url}?PAGEN_1={page_num}"
+
+def parse_catalog_html(html, page_url=None, links=False, features=PARSER, plan=None):
+    """Товары страницы каталога; links - сохранять ссылки на товары
+
+    plan - скомпилированная схема полей (extraction.compile_schema), по
+    умолчанию extraction.DEFAULT_SCHEMA. features - движок разбора
+    ('html.parser', 'html5lib' через BeautifulSoup, 'lxml' - напрямую).
+    """
+    return (plan or DEFAULT_PLAN).parse(html, page_url, links, features)
+
+def from_archive(archive, url):
+    """HTML из архива воспроизведения и записанное время загрузки"""
+    entry = archive.lookup(url)
+    if entry is None:
+        print(f"Нет в архиве: {url}")
+        return None, 0
+    status, body, elapsed = entry
+    return (body if status == 200 else None), elapsed
+
+def fetch_sync(url, session=None, timeout=TIMEOUT, archive=None):
+    """Синхронное получение HTML страницы (requests); None при ошибке
+
+    С архивом в режиме replay сеть не используется, в режиме record
+    каждый ответ сохраняется в архив.
+    """
+    if archive is not None and archive.replaying:
+        html, elapsed = from_archive(archive, url)
+        if archive.latency:
+            time.sleep(elapsed)
+        return html
+
+    # requests импортируется при первом запросе, чтобы не замедлять старт
+    import requests
+    try:
+        start = time.perf_counter()
+        response = (session or requests).get(url, headers=HEADERS, timeout=timeout)
+        if archive is not None:
+            archive.record(url, response.status_code, response.headers, response.text,
+                           time.perf_counter() - start)
+        if response.status_code == 200:
+            return response.text
+        print(f"Ошибка {response.status_code} для {url}")
+        return None
+    except Exception as e:
+        print(f"Ошибка получения {url}: {e}")
+        return None
+
+async def fetch_async(session, url, timeout=TIMEOUT, archive=None):
+    """Асинхронное получение HTML страницы (aiohttp); None при ошибке"""
+    if archive is not None and archive.replaying:
+        html, elapsed = from_archive(archive, url)
+        if archive.latency:
+            await asyncio.sleep(elapsed)
+        return html
+
+    try:
+        start = time.perf_counter()
+        async with session.get(url, headers=HEADERS, timeout=timeout) as response:
+            text = await response.text()
+            if archive is not None:
+                # Сжатие страницы для архива - не в цикле событий
+                await asyncio.get_running_loop().run_in_executor(
+                    None, archive.record, url, response.status, dict(response.headers), text,
+                    time.perf_counter() - start)
+            if response.status == 200:
+                return text
+            print(f"Ошибка {response.status} для {url}")
+            return None
+    except Exception as e:
+        print(f"Ошибка получения {url}: {e}")
+        return None
+
+def fetch_and_parse(url, links=False, archive=None):
+    """Загрузка и разбор одной страницы (верхний уровень - для процессов)"""
+    return parse_catalog_html(fetch_sync(url, archive=archive), url, links)
+
+# Состояние процесса пула ProcessBackend: флаг ссылок и архив
+_worker = {}
+
+def init_worker(links, replay):
+    """Инициализация процесса пула; replay - (путь, latency) архива или None
+
+    Передается путь, а не объект: при fork открытый zip делил бы позицию
+    файла между процессами.
+    """
+    from http_archive import HttpArchive
+    _worker['links'] = links
+    _worker['archive'] = HttpArchive(replay[0], 'replay', replay[1]) if replay else None
+
+def worker_fetch_and_parse(url):
+    """Задача процесса пула: только URL, остальное - из init_worker"""
+    return fetch_and_parse(url, _worker['links'], _worker['archive'])
+
+# Модели выполнения - только для замера (benchmark, python crawler.py).
+# Серверы берут отсюда общие функции выше (fetch_*, parse_catalog_html,
+# page_url), а очереди, контрольные точки, сроки и этап карточек у них свои.
+class AsyncioBackend:
+    """Один поток, цикл событий, aiohttp; разбор в том же потоке"""
+
+    name = 'asyncio'
+
+    def crawl(self, urls, workers=8, links=False, archive=None):
+        return asyncio.run(self.crawl_async(urls, workers, links, archive))
+
+    async def crawl_async(self, urls, workers=8, links=False, archive=None):
+        import aiohttp
+        slots = asyncio.Semaphore(workers)
+
+        async def one(session, url):
+            async with slots:
+                html = await fetch_async(session, url, archive=archive)
+            return parse_catalog_html(html, url, links)
+
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.gather(*(one(session, url) for url in urls))
+
+class ThreadBackend:
+    """Пул потоков, requests; разбор под GIL в тех же потоках"""
+
+    name = 'thread'
+
+    def crawl(self, urls, workers=8, links=False, archive=None):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fetch_and_parse, urls, [links] * len(urls), [archive] * len(urls)))
+
+class ProcessBackend:
+    """Пул процессов: загрузка и разбор параллельно без GIL"""
+
+    name = 'process'
+
+    def crawl(self, urls, workers=8, links=False, archive=None):
+        # Архив открывается по пути один раз в каждом процессе пула, задачам
+        # передаются только URL - иначе архив с индексом распаковывался бы
+        # на каждую страницу и замер был бы нечестным к этой модели
+        if archive is not None and not archive.replaying:
+            raise TypeError('Архив записи нельзя передать в другой процесс')
+        replay = (archive.path, archive.latency) if archive is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(links, replay)) as pool:
+            return list(pool.map(worker_fetch_and_parse, urls))
+
+BACKENDS = {
+    'asyncio': AsyncioBackend,
+    'thread': ThreadBackend,
+    'process': ProcessBackend,
+}
+
+def get_backend(name):
+    """Модель выполнения по имени"""
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестная модель: {name}. Доступны: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+def benchmark(base_url, start_page, end_page, workers=8, names=None, repeat=1, archive=None):
+    """Время обхода одних и тех же страниц каждой моделью
+
+    С архивом воспроизведения замер не зависит от сети и повторяем.
+    """
+    urls = [page_url(base_url, page) for page in range(start_page, end_page + 1)]
+    report = []
+    for name in names or BACKENDS:
+        backend = get_backend(name)
+        best = float('inf')
+        products = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pages = backend.crawl(urls, workers, archive=archive)
+            best = min(best, time.perf_counter() - start)
+            products = sum(len(page) for page in pages)
+        report.append({
+            'backend': name,
+            'pages': len(urls),
+            'products': products,
+            'seconds': round(best, 3),
+            'pages_per_sec': round(len(urls) / best, 1) if best else None,
+        })
+    return report
+
+def main():
+    """Сравнение моделей выполнения на одном и том же ядре обхода"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Замер моделей обхода: asyncio, потоки, процессы')
+    parser.add_argument('--url', default='https://dental-first.ru/catalog', help='URL каталога')
+    parser.add_argument('--start-page', type=int, default=1, help='Первая страница')
+    parser.add_argument('--end-page', type=int, default=10, help='Последняя страница')
+    parser.add_argument('--workers', type=int, default=8, help='Параллельных загрузок')
+    parser.add_argument('--backend', action='append', choices=list(BACKENDS),
+                        help='Модель (можно несколько; по умолчанию все)')
+    parser.add_argument('--repeat', type=int, default=1, help='Повторов, берется лучший')
+    parser.add_argument('--replay', help='Брать страницы из архива (http_archive) вместо сети')
+    parser.add_argument('--latency', action='store_true', help='Выдерживать записанное время загрузки')
+    args = parser.parse_args()
+
+    archive = None
+    if args.replay:
+        from http_archive import HttpArchive
+        archive = HttpArchive(args.replay, 'replay', args.latency)
+
+    print(f"{'Модель':<10}{'Страниц':>9}{'Товаров':>9}{'Время, с':>10}{'Стр/с':>8}")
+    for row in benchmark(args.url, args.start_page, args.end_page, args.workers,
+                         args.backend, args.repeat, archive):
+        print(f"{row['backend']:<10}{row['pages']:>9}{row['products']:>9}"
+              f"{row['seconds']:>10}{row['pages_per_sec']:>8}")
+
+if __name__ == '__main__':
+    main()
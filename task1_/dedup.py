@@ -0,0 +1,100 @@
+# Удаление повторяющихся товаров между страницами каталога
+import math
+import re
+import hashlib
+
+_spaces = re.compile(r'\s+')
+
+def normalize(text):
+    """Нормализация строки для сравнения: регистр, ё, пробелы"""
+    text = (text or '').replace('\xa0', ' ').lower().replace('ё', 'е')
+    return _spaces.sub(' ', text).strip()
+
+def product_key(product):
+    """64-битный ключ товара по нормализованным названию и метке"""
+    raw = f"{normalize(product.get('name'))}\x1f{normalize(product.get('label'))}"
+    digest = hashlib.blake2b(raw.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+class BloomFilter:
+    """Фильтр Блума по 64-битным ключам (двойное хеширование)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self.bits = bytearray((bits + 7) // 8)
+
+    def positions(self, key):
+        h1 = key & 0xFFFFFFFF
+        h2 = (key >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Добавление ключа; True, если он (вероятно) уже был
+
+        Проверка и установка битов за один проход.
+        """
+        bits = self.bits
+        present = True
+        for pos in self.positions(key):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                present = False
+                bits[pos >> 3] |= mask
+        return present
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(key))
+
+# Карточек на странице каталога (с запасом) - для оценки размера фильтра
+PAGE_PRODUCTS = 40
+
+class Deduplicator:
+    """Фильтр повторов: Блум спереди, точное множество ключей за ним
+
+    Ключ, которого нет в фильтре Блума, точно новый - множество не
+    проверяется. Фильтр рассчитан на capacity ключей (for_pages - по
+    диапазону страниц), точное множество хранит не больше capacity
+    64-битных ключей. После его заполнения положительный ответ Блума для
+    неизвестного ключа считается повтором; пока товаров не больше
+    capacity, ошибка не выше error_rate.
+    """
+
+    def __init__(self, capacity=10_000, error_rate=0.001):
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.exact = set()
+        self.exact_limit = capacity
+        self.duplicates = 0
+
+    @classmethod
+    def for_pages(cls, pages):
+        """Фильтр под обход pages страниц каталога"""
+        return cls(capacity=max(1, pages) * PAGE_PRODUCTS)
+
+    def is_new(self, product):
+        """Проверка и запоминание одного товара"""
+        key = product_key(product)
+
+        if not self.bloom.add(key):
+            if len(self.exact) < self.exact_limit:
+                self.exact.add(key)
+            return True
+
+        if key in self.exact:
+            self.duplicates += 1
+            return False
+
+        if len(self.exact) < self.exact_limit:
+            # Ложное срабатывание Блума - товар на самом деле новый
+            self.exact.add(key)
+            return True
+
+        self.duplicates += 1
+        return False
+
+    def filter(self, products):
+        """Только новые товары из списка страницы"""
+        return [p for p in products if self.is_new(p)]
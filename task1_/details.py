@@ -0,0 +1,35 @@
+# Второй этап обхода: карточки товаров по ссылкам из каталога
+
+# Поля, которые есть только на странице товара
+DETAIL_FIELDS = ('title', 'description', 'sku', 'brand', 'availability')
+
+# Очередь между этапами: каталог ждет, если этап карточек отстает
+DETAIL_QUEUE_SIZE = 64
+
+def _text(element):
+    return element.get_text(' ', strip=True) if element else ''
+
+def parse_detail(html):
+    """Поля страницы товара; отсутствующие - пустые строки"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    description = soup.find('meta', attrs={'name': 'description'})
+    availability = (soup.find(class_='availability')
+                    or soup.find(attrs={'itemprop': 'availability'}))
+
+    return {
+        'title': _text(soup.find('h1')),
+        'description': description.get('content', '').strip() if description else '',
+        'sku': _text(soup.find(attrs={'itemprop': 'sku'})),
+        'brand': _text(soup.find(attrs={'itemprop': 'brand'})),
+        'availability': _text(availability),
+    }
+
+def detail_workers(data, default=4, limit=16):
+    """Число обработчиков этапа карточек из параметров запроса"""
+    return max(1, min(int(data.get('detail_workers', default)), limit))
+
+def count_details(store):
+    """Сколько товаров хранилища дополнены данными страницы товара"""
+    return sum(1 for extra in store.extras or () if extra and 'title' in extra)
@@ -0,0 +1,307 @@
+# Приблизительный обход: стратифицированная выборка страниц и оценка итогов
+import math
+import random
+import re
+
+_page_link = re.compile(r'PAGEN_\d+=(\d+)')
+
+# Больше стольких блоков выборка не делится
+MAX_STRATA = 10
+
+# Страниц из блока в первом раунде: по двум дисперсия слишком шумная
+FIRST_ROUND = 3
+
+# Сколько раз повторять не загрузившуюся крайнюю страницу: замены ей нет
+EDGE_RETRIES = 2
+
+def parse_mode(data):
+    """Параметры "mode": "estimate" или None для полного обхода
+
+    ValueError - неверный режим или параметры оценки.
+    """
+    mode = data.get('mode', 'full')
+    if mode == 'full':
+        return None
+    if mode != 'estimate':
+        raise ValueError('"mode" должен быть "full" или "estimate"')
+    if 'batch' in data:
+        raise ValueError('"mode": "estimate" не поддерживается для "batch"')
+
+    params = {
+        'target_error': float(data.get('target_error', 0.05)),
+        'confidence': float(data.get('confidence', 0.95)),
+        'strata': data.get('strata'),
+        'max_sample': data.get('max_sample'),
+        'round_size': data.get('round_size'),
+        'seed': data.get('seed'),
+        'discover': bool(data.get('discover', False)),
+    }
+    if not 0 < params['target_error'] < 1:
+        raise ValueError('"target_error" - доля от 0 до 1 (0.05 = ±5%)')
+    if not 0.5 <= params['confidence'] < 1:
+        raise ValueError('"confidence" - от 0.5 до 1 (0.95 = 95%)')
+    for name in ('strata', 'max_sample', 'round_size'):
+        if params[name] is not None:
+            params[name] = int(params[name])
+            if params[name] < 1:
+                raise ValueError(f'"{name}" должен быть положительным')
+    if data.get('deadline_ms') is not None and float(data['deadline_ms']) <= 0:
+        raise ValueError('"deadline_ms" должен быть положительным')
+    return params
+
+def last_page(html, default):
+    """Последняя страница по ссылкам пагинации Bitrix (PAGEN_1=N)"""
+    return max([int(n) for n in _page_link.findall(html or '')] + [default])
+
+def normal_quantile(p):
+    """Квантиль стандартного нормального распределения (бисекция по erf;
+    statistics.NormalDist есть только с Python 3.8)"""
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        mid = (low + high) / 2
+        if (1 + math.erf(mid / math.sqrt(2))) / 2 < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+def t_quantile(z, df):
+    """Квантиль распределения Стьюдента по квантилю нормального
+    (разложение Корниша-Фишера; точность ~1% уже при df >= 3)"""
+    if df <= 0:
+        return None
+    z3, z5, z7 = z ** 3, z ** 5, z ** 7
+    return (z + (z3 + z) / (4 * df) + (5 * z5 + 16 * z3 + 3 * z) / (96 * df ** 2)
+            + (3 * z7 + 19 * z5 + 17 * z3 - 15 * z) / (384 * df ** 3))
+
+def variance(values):
+    """Выборочная дисперсия (None - меньше двух значений)"""
+    n = len(values)
+    if n < 2:
+        return None
+    mean = sum(values) / n
+    return sum((v - mean) ** 2 for v in values) / (n - 1)
+
+class Stratum:
+    """Блок подряд идущих страниц и выборка из него без возвращения"""
+
+    def __init__(self, pages, rng):
+        self.size = len(pages)
+        self.left = list(pages)
+        rng.shuffle(self.left)
+        self.counts = []
+        self.prices = []
+        self.failures = 0
+
+    @property
+    def missing(self):
+        """Ни одна страница блока не загрузилась и выбирать больше нечего"""
+        return not self.counts and not self.left
+
+    def take(self, k):
+        taken, self.left = self.left[:k], self.left[k:]
+        return taken
+
+    def record(self, products):
+        self.counts.append(len(products))
+        self.prices.append(sum(int(p.get('price', 0)) for p in products))
+
+    def total(self, values):
+        """(оценка итога блока, ее дисперсия или None)"""
+        n = len(values)
+        if not n:
+            return 0.0, None
+        estimate = self.size * sum(values) / n
+        if n == self.size:
+            return estimate, 0.0
+        s2 = variance(values)
+        if s2 is None:
+            return estimate, None
+        # Поправка на конечную совокупность: выбранные страницы известны точно
+        return estimate, self.size ** 2 * (1 - n / self.size) * s2 / n
+
+class SampleEstimate:
+    """Оценка числа товаров и суммы цен диапазона по выборке страниц
+
+    Диапазон делится на блоки подряд идущих страниц, в каждом блоке
+    страницы выбираются случайно. Итог - сумма по блокам размера блока
+    на среднее выборки, интервал - нормальный с поправкой на конечную
+    совокупность. Первая и последняя (обычно неполная) страницы диапазона
+    загружаются всегда и входят в итог точно; если такая страница не
+    загрузилась и после EDGE_RETRIES повторов, оценка и интервалы
+    считаются для диапазона без нее (pages_missing). Первый раунд берет по
+    FIRST_ROUND страниц из блока, следующие добирают страницы во все
+    блоки поровну.
+    """
+
+    def __init__(self, start_page, end_page, strata=None, confidence=0.95, seed=None, known=None):
+        self.rng = random.Random(seed)
+        self.start_page = start_page
+        self.end_page = end_page
+        self.confidence = confidence
+        self.z = normal_quantile(0.5 + confidence / 2)
+        self.observed_products = 0
+        self.observed_price = 0
+        self.failed = 0
+        self.by_page = {}
+        self.strata = []
+        self.first_round = True
+
+        # Крайние страницы - отдельные блоки из одной страницы; уже
+        # загруженные (первая при поиске последней) сразу учитываются
+        known = known or {}
+        edges = sorted({start_page, end_page})
+        for page in edges:
+            stratum = self.add_stratum([page])
+            if page in known:
+                stratum.take(1)
+                self.record_to(stratum, known[page])
+
+        pages = list(range(start_page + 1, end_page))
+        if pages:
+            count = strata or max(1, min(MAX_STRATA, round(math.sqrt(len(pages)) / 2)))
+            count = min(count, len(pages))
+            bounds = [round(i * len(pages) / count) for i in range(count + 1)]
+            for i in range(count):
+                self.add_stratum(pages[bounds[i]:bounds[i + 1]])
+
+    def add_stratum(self, pages):
+        stratum = Stratum(pages, self.rng)
+        self.strata.append(stratum)
+        for page in pages:
+            self.by_page[page] = stratum
+        return stratum
+
+    @property
+    def pages_total(self):
+        return self.end_page - self.start_page + 1
+
+    @property
+    def pages_sampled(self):
+        return sum(len(s.counts) for s in self.strata)
+
+    @property
+    def pages_left(self):
+        return sum(len(s.left) for s in self.strata)
+
+    def next_round(self, size=None):
+        """Номера страниц следующего раунда ([] - страниц не осталось)"""
+        if self.first_round:
+            self.first_round = False
+            pages = [page for stratum in self.strata for page in stratum.take(FIRST_ROUND)]
+            if pages:
+                return pages
+        size = size or max(2, len(self.strata))
+        # Пропорционально размеру: страница уходит блоку с наименьшей долей
+        # выбранного. Распределение по наблюдаемому разбросу (Нейман) здесь
+        # хуже - блоки, где разброс случайно занижен, недобираются, и
+        # интервал выходит уже настоящего.
+        planned = [s.size - len(s.left) for s in self.strata]
+        taken = [0] * len(self.strata)
+        for _ in range(size):
+            best = None
+            for i, stratum in enumerate(self.strata):
+                if taken[i] >= len(stratum.left):
+                    continue
+                share = (planned[i] + taken[i]) / stratum.size
+                if best is None or share < best[0]:
+                    best = (share, i)
+            if best is None:
+                break
+            taken[best[1]] += 1
+        return [page for stratum, k in zip(self.strata, taken) for page in stratum.take(k)]
+
+    def record_to(self, stratum, products):
+        stratum.record(products)
+        self.observed_products += len(products)
+        self.observed_price += stratum.prices[-1]
+
+    def record(self, page, products):
+        """Итог загруженной страницы выборки; None - страница не загрузилась"""
+        stratum = self.by_page[page]
+        if products is None:
+            # Вместо недоступной страницы блок доберет другую, а у крайней
+            # замены нет - ее загрузка повторится в следующем раунде
+            self.failed += 1
+            stratum.failures += 1
+            if stratum.size == 1 and stratum.failures <= EDGE_RETRIES:
+                stratum.left.append(page)
+            return
+        self.record_to(stratum, products)
+
+    @property
+    def pages_missing(self):
+        """Страницы блоков, не давших ни одной загрузки; в оценку не входят"""
+        return sorted(page for page, stratum in self.by_page.items() if stratum.missing)
+
+    def interval(self, attr, observed):
+        """(оценка, нижняя граница, верхняя граница или None)"""
+        estimate = 0.0
+        total_variance = 0.0
+        for stratum in self.strata:
+            if stratum.missing:
+                # Оценка условна: итог по диапазону без этих страниц
+                continue
+            value, var = stratum.total(getattr(stratum, attr))
+            estimate += value
+            if var is None:
+                total_variance = None
+            elif total_variance is not None:
+                total_variance += var
+        if total_variance is None:
+            return estimate, None, None
+        # Степени свободы - случайные страницы минус число блоков выборки
+        sampled = [s for s in self.strata if s.size > 1 and not s.missing]
+        df = sum(len(s.counts) for s in sampled) - len(sampled)
+        quantile = t_quantile(self.z, df) if sampled else self.z
+        if quantile is None:
+            return estimate, None, None
+        half = quantile * math.sqrt(total_variance)
+        # Меньше уже увиденного в выборке итог быть не может
+        return estimate, max(observed, estimate - half), estimate + half
+
+    def relative_error(self):
+        """Наибольшая полуширина интервала в долях оценки (None - неизвестна)"""
+        errors = []
+        for attr, observed in (('counts', self.observed_products), ('prices', self.observed_price)):
+            estimate, low, high = self.interval(attr, observed)
+            if low is None:
+                return None
+            errors.append((high - estimate) / estimate if estimate else 0.0)
+        return max(errors)
+
+    def stop_reason(self, target_error, max_sample=None):
+        """Почему выборку можно закончить; None - нужно продолжать"""
+        if not self.pages_left:
+            return 'exhausted'
+        error = self.relative_error()
+        if error is not None and error <= target_error:
+            return 'target'
+        if max_sample and self.pages_sampled + self.failed >= max_sample:
+            return 'max_sample'
+        return None
+
+    def report(self):
+        """Оценки с интервалами для сводки задачи"""
+        products, products_low, products_high = self.interval('counts', self.observed_products)
+        price, price_low, price_high = self.interval('prices', self.observed_price)
+
+        def bounds(low, high):
+            return None if low is None else [round(low), round(high)]
+
+        error = self.relative_error()
+        return {
+            'total_products': round(products),
+            'total_products_interval': bounds(products_low, products_high),
+            'total_price': round(price),
+            'total_price_interval': bounds(price_low, price_high),
+            'confidence': self.confidence,
+            'relative_error': None if error is None else round(error, 4),
+            'exact': not self.pages_left and not self.failed,
+            'pages_in_range': self.pages_total,
+            'pages_sampled': self.pages_sampled,
+            'pages_failed': self.failed,
+            'pages_missing': self.pages_missing,
+            'sample_fraction': round(self.pages_sampled / self.pages_total, 3),
+            'strata': len(self.strata),
+        }
@@ -0,0 +1,184 @@
+# Экспорт полных результатов парсинга в CSV, Parquet и Arrow IPC
+import csv
+import os
+import sys
+import argparse
+
+from results_io import iter_product_batches, read_summary
+
+FORMATS = {
+    'csv': ('.csv', 'text/csv; charset=utf-8'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrows', 'application/vnd.apache.arrow.stream'),
+}
+
+CSV_HEADER = ['Название', 'Цена (руб)', 'Артикул']
+
+def iter_batches(results, batch_size):
+    """Пачки товаров задачи
+
+    Берется полный файл products_file; для старых файлов результатов
+    без него - сохраненные в сводке первые товары.
+    """
+    products_file = results.get('products_file')
+    if products_file and os.path.exists(products_file):
+        yield from iter_product_batches(products_file, batch_size)
+        return
+
+    products = results.get('products', [])
+    for i in range(0, len(products), batch_size):
+        yield products[i:i + batch_size]
+
+def export_csv(results, output, batch_size):
+    """Экспорт в CSV пачками через writerows"""
+    count = 0
+    with open(output, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for batch in iter_batches(results, batch_size):
+            writer.writerows(
+                (p.get('name', ''), p.get('price', 0), p.get('label', ''))
+                for p in batch
+            )
+            count += len(batch)
+    return count
+
+class LabelDictionary:
+    """Растущий словарь меток для dictionary-кодирования колонки label
+
+    Словарь только дополняется, поэтому Arrow-писатель передает
+    между пачками лишь дельты.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, labels):
+        codes = []
+        for label in labels:
+            code = self.codes.get(label)
+            if code is None:
+                code = len(self.values)
+                self.codes[label] = code
+                self.values.append(label)
+            codes.append(code)
+        return codes
+
+def arrow_schema(pa, results):
+    """Схема Arrow; время и источник задачи - в метаданных, а не в строках"""
+    metadata = {
+        'timestamp': str(results.get('timestamp', '')),
+        'url': str(results.get('url', '')),
+        'job_id': str(results.get('job_id', '')),
+    }
+    return pa.schema([
+        pa.field('name', pa.string()),
+        pa.field('price', pa.int64()),
+        pa.field('label', pa.dictionary(pa.int32(), pa.string())),
+    ], metadata=metadata)
+
+def iter_record_batches(pa, schema, results, batch_size):
+    """Преобразование пачек товаров в RecordBatch"""
+    labels = LabelDictionary()
+    for batch in iter_batches(results, batch_size):
+        codes = labels.encode(p.get('label', '') for p in batch)
+        label_array = pa.DictionaryArray.from_arrays(
+            pa.array(codes, type=pa.int32()),
+            pa.array(labels.values, type=pa.string())
+        )
+        yield pa.RecordBatch.from_arrays([
+            pa.array([p.get('name', '') for p in batch], type=pa.string()),
+            pa.array([p.get('price', 0) for p in batch], type=pa.int64()),
+            label_array,
+        ], schema=schema)
+
+def import_pyarrow():
+    """pyarrow нужен только для Parquet и Arrow"""
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise RuntimeError("Для форматов parquet и arrow установите pyarrow: pip install pyarrow")
+
+def export_parquet(results, output, batch_size):
+    """Экспорт в Parquet: одна группа строк на пачку"""
+    pa = import_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(pa, results)
+    count = 0
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for batch in iter_record_batches(pa, schema, results, batch_size):
+            writer.write_table(pa.Table.from_batches([batch], schema=schema))
+            count += batch.num_rows
+    return count
+
+def export_arrow(results, output, batch_size):
+    """Экспорт в потоковый формат Arrow IPC с дельтами словаря"""
+    pa = import_pyarrow()
+
+    schema = arrow_schema(pa, results)
+    options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+    count = 0
+    with pa.OSFile(output, 'wb') as sink:
+        with pa.ipc.new_stream(sink, schema, options=options) as writer:
+            for batch in iter_record_batches(pa, schema, results, batch_size):
+                writer.write_batch(batch)
+                count += batch.num_rows
+    return count
+
+EXPORTERS = {
+    'csv': export_csv,
+    'parquet': export_parquet,
+    'arrow': export_arrow,
+}
+
+def export_data(results, fmt, output, batch_size=10000):
+    """Экспорт задачи по сводке results; возвращает количество товаров"""
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Неизвестный формат: {fmt}. Доступны: {', '.join(FORMATS)}")
+
+    # Пишем во временный файл, чтобы не оставлять обрезанный экспорт
+    tmp_output = f"{output}.tmp"
+    try:
+        count = EXPORTERS[fmt](results, tmp_output, batch_size)
+    except Exception:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise
+    os.replace(tmp_output, output)
+    return count
+
+def export_results(results_file, fmt='csv', output=None, batch_size=10000):
+    """Экспорт задачи из сводного файла результатов
+
+    Возвращает (путь к файлу, количество товаров).
+    """
+    results = read_summary(results_file)
+    if output is None:
+        output = os.path.splitext(results_file)[0] + FORMATS.get(fmt, ('',))[0]
+
+    count = export_data(results, fmt, output, batch_size)
+    return output, count
+
+def main():
+    """Точка входа"""
+    parser = argparse.ArgumentParser(description='Экспорт результатов парсинга')
+    parser.add_argument('results', nargs='?', default='async_results.json',
+                        help='Сводный файл результатов (async_results.json или threaded_results.json)')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Формат экспорта')
+    parser.add_argument('--output', default=None, help='Имя выходного файла')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Товаров в одной пачке')
+
+    args = parser.parse_args()
+
+    try:
+        output, count = export_results(args.results, args.format, args.output, args.batch_size)
+        print(f"{count} товаров -> {output}")
+    except Exception as e:
+        print(f"Ошибка экспорта: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+# Декларативная схема полей карточки и ее компиляция в план разбора
+import functools
+import json
+import re
+from collections import namedtuple
+from urllib.parse import urljoin
+
+from product_store import CORE_FIELDS
+
+_price = re.compile(r'[\d\s]+(?=\s*₽)')
+_spaces = re.compile(r'\s+')
+_number = re.compile(r'-?\d+')
+
+def parse_price(text):
+    """Цена в рублях из текста вида '12 345 ₽' (пробелы любые, в т.ч. &nbsp;)"""
+    match = _price.search(text)
+    if not match:
+        return 0
+    try:
+        return int(_spaces.sub('', match.group()))
+    except ValueError:
+        return 0
+
+def parse_int(text):
+    """Первое целое число в тексте (пробелы между разрядами убираются)"""
+    match = _number.search(_spaces.sub('', text))
+    return int(match.group()) if match else 0
+
+# Постобработка значения поля: (строка, URL страницы) -> значение
+PROCESSORS = {
+    'text': lambda value, base: value,
+    'collapse': lambda value, base: _spaces.sub(' ', value).strip(),
+    'lower': lambda value, base: value.lower(),
+    'price': lambda value, base: parse_price(value),
+    'int': lambda value, base: parse_int(value),
+    'url': lambda value, base: urljoin(base, value) if base else value,
+}
+
+# Обработчики, после которых значение - число (цена хранится целым)
+NUMERIC = ('price', 'int')
+
+# Схема карточек каталога dental-first.ru. class="..." в селекторе -
+# точное значение атрибута, как class_='set-card block' в bs4.
+DEFAULT_SCHEMA = {
+    'card': 'div[class="set-card block"]',
+    'fields': {
+        'name': {'selector': ['p.set-card__title a[class="di_b c_b"]', 'p.set-card__title'],
+                 'default': 'Без названия'},
+        'price': {'selector': 'span.set-card__price', 'process': 'price', 'default': 0},
+        'label': {'selector': 'span.set-card__label', 'default': ''},
+    },
+    # Ссылка на страницу товара извлекается только при links=True
+    'link': {'selector': ['p.set-card__title a[href]', 'a[href]'], 'attr': 'href',
+             'process': 'url', 'default': None},
+}
+
+# Шаг селектора: комбинатор перед ним (' ' или '>'), тег, классы, атрибуты
+Step = namedtuple('Step', 'combinator tag classes attrs')
+
+_step = re.compile(r'''
+    (?P<tag>[a-zA-Z][\w-]*|\*)?
+    (?P<quals>(?:\.[\w-]+|\#[\w-]+|\[\s*[\w-]+\s*(?:~?=\s*(?:"[^"]*"|'[^']*'|[\w-]+)\s*)?\])*)
+''', re.X)
+_qual = re.compile(r'''
+    \.(?P<cls>[\w-]+)
+    |\#(?P<id>[\w-]+)
+    |\[\s*(?P<attr>[\w-]+)\s*(?:(?P<op>~?=)\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<bare>[\w-]+))\s*)?\]
+''', re.X)
+_combinator = re.compile(r'\s*>\s*|\s+')
+
+def parse_selector(selector):
+    """Шаги CSS-селектора: тег, .класс, #id, [attr], [attr=v], [attr~=v],
+    потомок (пробел) и дочерний элемент (>)"""
+    if not isinstance(selector, str) or not selector.strip():
+        raise ValueError(f"пустой селектор: {selector!r}")
+    text = selector.strip()
+    steps = []
+    combinator = None
+    pos = 0
+    while True:
+        match = _step.match(text, pos)
+        if not match.group('tag') and not match.group('quals'):
+            raise ValueError(f"неверный селектор {selector!r} (позиция {pos})")
+        classes = []
+        attrs = []
+        for qual in _qual.finditer(match.group('quals')):
+            if qual.group('cls'):
+                classes.append(qual.group('cls'))
+            elif qual.group('id'):
+                attrs.append(('id', '=', qual.group('id')))
+            else:
+                value = next((v for v in qual.group('dq', 'sq', 'bare') if v is not None), None)
+                attrs.append((qual.group('attr').lower(), qual.group('op'), value))
+        tag = match.group('tag')
+        steps.append(Step(combinator, None if tag in (None, '*') else tag.lower(),
+                          frozenset(classes), tuple(attrs)))
+        pos = match.end()
+        if pos == len(text):
+            return tuple(steps)
+        separator = _combinator.match(text, pos)
+        if separator is None:
+            raise ValueError(f"неверный селектор {selector!r} (позиция {pos})")
+        combinator = '>' if '>' in separator.group() else ' '
+        pos = separator.end()
+
+def _literal(value):
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    raise ValueError(f"значение с обоими видами кавычек: {value!r}")
+
+def to_xpath(steps):
+    """XPath для шагов селектора (поиск от корня документа)"""
+    parts = []
+    for step in steps:
+        conditions = [f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')"
+                      for cls in sorted(step.classes)]
+        for name, op, value in step.attrs:
+            if op is None:
+                conditions.append(f"@{name}")
+            elif op == '~=':
+                conditions.append(f"contains(concat(' ', normalize-space(@{name}), ' '), ' {value} ')")
+            elif name == 'class':
+                conditions.append(f"normalize-space(@class)={_literal(value)}")
+            else:
+                conditions.append(f"@{name}={_literal(value)}")
+        axis = '/' if step.combinator == '>' else '//'
+        parts.append(axis + (step.tag or '*') + ''.join(f'[{c}]' for c in conditions))
+    return ''.join(parts)
+
+class SoupTree:
+    """Доступ к дереву BeautifulSoup для плана"""
+
+    @staticmethod
+    def parse(html, features):
+        # bs4 импортируется при первом парсинге, чтобы не замедлять старт серверов
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html, features)
+
+    @staticmethod
+    def tag(node):
+        return node.name  # у текстовых узлов None
+
+    @staticmethod
+    def parent(node):
+        return node.parent
+
+    @staticmethod
+    def classes(node):
+        return node.get('class') or ()
+
+    @staticmethod
+    def attr(node, name):
+        value = node.get(name)
+        # class и другие многозначные атрибуты bs4 хранит списком
+        return ' '.join(value) if isinstance(value, list) else value
+
+    @staticmethod
+    def text(node):
+        return node.get_text(strip=True)
+
+    @staticmethod
+    def descendants(node):
+        return node.descendants
+
+    @staticmethod
+    def find_cards(root, plan):
+        return [node for node in root.find_all(plan.card[-1].tag or True)
+                if plan.matches(plan.card, node, None, SoupTree)]
+
+class LxmlTree:
+    """Доступ к дереву lxml.html: карточки ищутся скомпилированным XPath"""
+
+    @staticmethod
+    def parse(html, features):
+        import lxml.html
+        return lxml.html.document_fromstring(html)
+
+    @staticmethod
+    def tag(node):
+        tag = node.tag
+        return tag if isinstance(tag, str) else None  # комментарии и PI
+
+    @staticmethod
+    def parent(node):
+        return node.getparent()
+
+    @staticmethod
+    def classes(node):
+        return (node.get('class') or '').split()
+
+    @staticmethod
+    def attr(node, name):
+        value = node.get(name)
+        if name == 'class' and value is not None:
+            return ' '.join(value.split())
+        return value
+
+    @staticmethod
+    def text(node):
+        return ''.join(text.strip() for text in node.itertext())
+
+    @staticmethod
+    def descendants(node):
+        return node.iterdescendants()
+
+    @staticmethod
+    def find_cards(root, plan):
+        return plan.card_xpath(root)
+
+def tree_for(features):
+    """Дерево для движка: 'lxml' - напрямую lxml.html, остальные через bs4"""
+    if features == 'lxml':
+        try:
+            import lxml.html  # noqa: F401
+            return LxmlTree
+        except ImportError:
+            pass
+    return SoupTree
+
+class Field:
+    """Поле схемы: селекторы по убыванию приоритета, атрибут, обработка"""
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.selectors = [parse_selector(s) for s in spec['selector']]
+        self.attr = spec['attr']
+        self.process = [PROCESSORS[p] for p in spec['process']]
+        self.default = spec['default']
+
+    def value(self, node, tree, page_url):
+        if node is None:
+            return self.default
+        value = tree.text(node) if self.attr == 'text' else tree.attr(node, self.attr)
+        if value is None:
+            return self.default
+        for process in self.process:
+            value = process(value, page_url)
+        return value
+
+def normalize_field(name, spec):
+    """Полная форма описания поля; ValueError при ошибке"""
+    if isinstance(spec, (str, list)):
+        spec = {'selector': spec}
+    if not isinstance(spec, dict):
+        raise ValueError(f"поле {name}: ожидается селектор или объект")
+    unknown = set(spec) - {'selector', 'attr', 'process', 'default'}
+    if unknown:
+        raise ValueError(f"поле {name}: неизвестные ключи {', '.join(sorted(unknown))}")
+    selectors = spec.get('selector')
+    selectors = [selectors] if isinstance(selectors, str) else list(selectors or ())
+    if not selectors:
+        raise ValueError(f"поле {name}: нет селектора")
+    process = spec.get('process', [])
+    process = [process] if isinstance(process, str) else list(process)
+    for item in process:
+        if item not in PROCESSORS:
+            raise ValueError(f"поле {name}: неизвестная обработка {item!r} "
+                             f"(есть: {', '.join(PROCESSORS)})")
+    numeric = bool(process) and process[-1] in NUMERIC
+    if name == 'price' and not numeric:
+        raise ValueError('поле price должно заканчиваться обработкой price или int')
+    default = spec.get('default', 0 if numeric else '')
+    return {'selector': selectors, 'attr': str(spec.get('attr', 'text')).lower(),
+            'process': process, 'default': default}
+
+def check_core_field(name, field):
+    """Основные поля хранятся в колонках ProductStore: name и label -
+    строки, price - целое; значение и default другого типа - ValueError"""
+    numeric = bool(field['process']) and field['process'][-1] in NUMERIC
+    if name == 'price':
+        if not isinstance(field['default'], int) or isinstance(field['default'], bool):
+            raise ValueError('поле price: default должен быть целым числом')
+        return
+    if numeric:
+        raise ValueError(f"поле {name} - строка, обработка не может заканчиваться "
+                         f"{field['process'][-1]}")
+    if not isinstance(field['default'], str):
+        raise ValueError(f'поле {name}: default должен быть строкой')
+
+def merge_schema(schema, base=None):
+    """Схема поверх базовой (по умолчанию DEFAULT_SCHEMA)
+
+    Поля схемы заменяют одноименные поля базы или добавляются к ним,
+    null удаляет поле (кроме name, price, label). Типы name, price, label
+    проверяются по check_core_field.
+    """
+    if not isinstance(schema, dict):
+        raise ValueError('схема должна быть объектом')
+    unknown = set(schema) - {'card', 'fields', 'link'}
+    if unknown:
+        raise ValueError(f"неизвестные ключи схемы: {', '.join(sorted(unknown))}")
+    base = base or DEFAULT_SCHEMA
+    fields = {name: normalize_field(name, spec) for name, spec in base['fields'].items()}
+    overrides = schema.get('fields') or {}
+    if not isinstance(overrides, dict):
+        raise ValueError('"fields" должен быть объектом {имя: описание}')
+    for name, spec in overrides.items():
+        if name == 'url':
+            raise ValueError('ссылка на товар задается ключом "link", а не полем url')
+        if spec is not None:
+            fields[name] = normalize_field(name, spec)
+        elif name in CORE_FIELDS:
+            raise ValueError(f"поле {name} нельзя удалить")
+        else:
+            fields.pop(name, None)
+    for name in CORE_FIELDS:
+        check_core_field(name, fields[name])
+    return {
+        'card': schema.get('card', base['card']),
+        'fields': fields,
+        'link': normalize_field('url', schema.get('link', base['link'])),
+    }
+
+class ExtractionPlan:
+    """Скомпилированная схема: разбор карточки за один проход
+
+    Селекторы всех полей разложены по тегу последнего шага, так что
+    каждый элемент карточки проверяется только селекторами своего тега.
+    Совпадение проверяется вверх по предкам в пределах карточки. Поле
+    берет первый в порядке документа элемент своего самого приоритетного
+    селектора; проход кончается, когда у всех полей найден первый выбор.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.card = parse_selector(schema['card'])
+        self._card_xpath = None
+        self.fields = [Field(name, spec) for name, spec in schema['fields'].items()]
+        self.link_fields = self.fields + [Field('url', schema['link'])]
+        self.index = self.build_index(self.fields)
+        self.link_index = self.build_index(self.link_fields)
+
+    @staticmethod
+    def build_index(fields):
+        """{тег: [(номер поля, приоритет, шаги)]}; ключ None - для любого тега"""
+        by_tag = {}
+        for number, field in enumerate(fields):
+            for priority, steps in enumerate(field.selectors):
+                by_tag.setdefault(steps[-1].tag, []).append((number, priority, steps))
+        anywhere = by_tag.pop(None, [])
+        index = {tag: sorted(entries + anywhere, key=lambda e: e[:2]) for tag, entries in by_tag.items()}
+        index[None] = anywhere
+        return index
+
+    @property
+    def card_xpath(self):
+        """XPath поиска карточек, компилируется при первом разборе через lxml"""
+        if self._card_xpath is None:
+            from lxml import etree
+            self._card_xpath = etree.XPath(to_xpath(self.card))
+        return self._card_xpath
+
+    @staticmethod
+    def step_matches(step, node, tree):
+        if step.tag is not None and tree.tag(node) != step.tag:
+            return False
+        if step.classes and not step.classes.issubset(tree.classes(node)):
+            return False
+        for name, op, value in step.attrs:
+            actual = tree.attr(node, name)
+            if actual is None:
+                return False
+            if op == '=' and actual != value:
+                return False
+            if op == '~=' and value not in actual.split():
+                return False
+        return True
+
+    def matches(self, steps, node, root, tree, last=None):
+        """Подходит ли node под шаги селектора; предки - не выше root"""
+        last = len(steps) - 1 if last is None else last
+        step = steps[last]
+        if not self.step_matches(step, node, tree):
+            return False
+        if last == 0:
+            return True
+        ancestor = None if node is root else tree.parent(node)
+        while ancestor is not None:
+            if self.matches(steps, ancestor, root, tree, last - 1):
+                return True
+            if step.combinator == '>' or ancestor is root:
+                return False
+            ancestor = tree.parent(ancestor)
+        return False
+
+    def extract(self, card, page_url=None, links=False, tree=SoupTree):
+        """Поля одной карточки (url - только при links)"""
+        fields = self.link_fields if links else self.fields
+        index = self.link_index if links else self.index
+        anywhere = index[None]
+        found = [None] * len(fields)
+        remaining = len(fields)
+        tag_of = tree.tag
+        for node in tree.descendants(card):
+            tag = tag_of(node)
+            if tag is None:
+                continue
+            for number, priority, steps in index.get(tag, anywhere):
+                best = found[number]
+                if best is not None and best[0] <= priority:
+                    continue
+                if self.matches(steps, node, card, tree):
+                    found[number] = (priority, node)
+                    if priority == 0:
+                        remaining -= 1
+            if not remaining:
+                break
+        return {field.name: field.value(best and best[1], tree, page_url)
+                for field, best in zip(fields, found)}
+
+    def find_cards(self, root, tree=SoupTree):
+        return tree.find_cards(root, self)
+
+    def parse(self, html, page_url=None, links=False, features='html.parser'):
+        """Товары страницы каталога по плану"""
+        if not html:
+            return []
+        tree = tree_for(features)
+        root = tree.parse(html, features)
+        links = bool(links and page_url)
+        products = []
+        for card in tree.find_cards(root, self):
+            try:
+                products.append(self.extract(card, page_url, links, tree))
+            except Exception as e:
+                print(f"Ошибка парсинга карточки: {e}")
+        return products
+
+@functools.lru_cache(maxsize=32)
+def _compile(key):
+    return ExtractionPlan(json.loads(key))
+
+def compile_schema(schema=None, base=None):
+    """План для схемы поверх базовой; одинаковые схемы компилируются один раз
+
+    ValueError - ошибка в схеме или селекторе.
+    """
+    if isinstance(schema, ExtractionPlan):
+        return schema
+    merged = merge_schema(schema or {}, base)
+    return _compile(json.dumps(merged, ensure_ascii=False))
+
+def load_schema(path):
+    """План из JSON-файла схемы (--schema)"""
+    with open(path, encoding='utf-8') as f:
+        return compile_schema(json.load(f))
+
+def request_plan(data, default=None):
+    """План для запроса /parse: "schema" запроса поверх плана сервера"""
+    default = default or DEFAULT_PLAN
+    schema = data.get('schema')
+    if schema is None:
+        return default
+    return compile_schema(schema, default.schema)
+
+DEFAULT_PLAN = compile_schema()
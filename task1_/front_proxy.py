@@ -0,0 +1,419 @@
+# Фронт-прокси: один /parse поверх пула серверов парсинга
+import asyncio
+import aiohttp
+from aiohttp import web
+import json
+import signal
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from serialization import negotiate, get_codec
+from results_io import write_json_atomic, write_products, products_path, MAX_PAGE_LIMIT
+from product_store import ProductStore
+from dedup import Deduplicator
+
+# Страниц в одном шарде по умолчанию
+SHARD_PAGES = 5
+
+# Сколько раз шард переотправляется после сбоя сервера
+MAX_ATTEMPTS = 3
+
+# Предельное время одного шарда, включая ожидание свободного сервера
+SHARD_TIMEOUT = 300
+
+# Параметры запроса, которые прокси не передает серверам пула
+FRONT_PARAMS = ('shard_pages', 'background')
+
+class Busy(Exception):
+    """Сервер пула перегружен (429) - шард отправляется другому без штрафа"""
+
+class InvalidRequest(Exception):
+    """Сервер пула отклонил параметры запроса (4xx) - повтор не поможет"""
+
+class Backend:
+    """Сервер пула: адрес, здоровье, загрузка и выданные ему шарды"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.kind = None
+        self.healthy = False
+        self.load = 0  # задачи в работе и в очереди по /status сервера
+        self.inflight = 0  # шарды, отправленные этим прокси и не завершенные
+        self.completed = 0
+        self.failures = 0
+
+    def score(self):
+        """Чем меньше, тем свободнее сервер"""
+        return self.inflight + self.load
+
+    def info(self):
+        return {
+            'url': self.url,
+            'server': self.kind,
+            'healthy': self.healthy,
+            'load': self.load,
+            'inflight': self.inflight,
+            'completed': self.completed,
+            'failures': self.failures
+        }
+
+def make_shards(start_page, end_page, shard_pages):
+    """Разбиение диапазона страниц на шарды [(start, end), ...]"""
+    return [(first, min(first + shard_pages - 1, end_page))
+            for first in range(start_page, end_page + 1, shard_pages)]
+
+class FrontProxy:
+    def __init__(self, backends, host='localhost', port=8090, shard_pages=SHARD_PAGES,
+                 max_attempts=MAX_ATTEMPTS, health_interval=2.0):
+        self.host = host
+        self.port = port
+        self.backends = [Backend(url) for url in backends]
+        self.shard_pages = shard_pages
+        self.max_attempts = max_attempts
+        self.health_interval = health_interval
+        self.session = None
+        # Товары забираются у серверов пула в MessagePack, если он установлен
+        try:
+            self.codec = get_codec('msgpack')
+        except ImportError:
+            self.codec = get_codec()
+        self.app = web.Application()
+        self.app.router.add_post('/parse', self.handle_parse)
+        self.app.router.add_get('/', self.handle_root)
+        self.app.router.add_get('/status', self.handle_status)
+        self.app.router.add_get('/ready', self.handle_ready)
+
+    def respond(self, request, data, status=200):
+        """Ответ в формате по заголовку Accept: JSON (orjson) или MessagePack"""
+        codec = negotiate(request.headers.get('Accept'))
+        response = web.Response(body=codec.dumps(data), status=status)
+        response.headers['Content-Type'] = codec.content_type
+        response.headers['Vary'] = 'Accept'
+        return response
+
+    async def handle_root(self, request):
+        """Корневой эндпоинт"""
+        return web.Response(
+            text="Фронт-прокси парсинга Dental-First\n\n"
+                 "Используйте:\n"
+                 "POST /parse - парсинг через пул серверов\n"
+                 "GET /status - состояние серверов пула\n"
+                 f"\nПорт: {self.port}, серверов в пуле: {len(self.backends)}",
+            content_type='text/plain'
+        )
+
+    async def handle_status(self, request):
+        """Состояние прокси и серверов пула"""
+        return self.respond(request, {
+            'status': 'running',
+            'server': 'front',
+            'port': self.port,
+            'shard_pages': self.shard_pages,
+            'backends': [backend.info() for backend in self.backends]
+        })
+
+    async def handle_ready(self, request):
+        """Готов, если жив хотя бы один сервер пула"""
+        ready = any(backend.healthy for backend in self.backends)
+        return self.respond(request, {'ready': ready, 'server': 'front', 'port': self.port},
+                            status=200 if ready else 503)
+
+    async def check_backend(self, backend):
+        """Проверка здоровья и загрузки сервера через /status"""
+        try:
+            async with self.session.get(f"{backend.url}/status",
+                                        timeout=aiohttp.ClientTimeout(total=2)) as response:
+                status = await response.json()
+            load = status.get('load', {})
+            backend.kind = status.get('server')
+            backend.load = load.get('active_jobs', 0) + load.get('queued_jobs', 0)
+            # Останавливающийся сервер (closed) новых задач не примет
+            healthy = not load.get('closed', False)
+            if healthy and not backend.healthy:
+                print(f"Сервер пула доступен: {backend.url} ({backend.kind})")
+            backend.healthy = healthy
+        except Exception:
+            if backend.healthy:
+                print(f"Сервер пула недоступен: {backend.url}")
+            backend.healthy = False
+
+    async def health_loop(self):
+        """Периодическая проверка всех серверов пула"""
+        while True:
+            await asyncio.gather(*(self.check_backend(b) for b in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    def pick(self, tried):
+        """Наименее загруженный здоровый сервер, которому шард еще не отправлялся"""
+        candidates = [b for b in self.backends if b.healthy and b not in tried]
+        if not candidates:
+            return None
+        return min(candidates, key=Backend.score)
+
+    @staticmethod
+    async def error_message(response):
+        """Сообщение об ошибке из ответа сервера пула (JSON или текст)"""
+        try:
+            return (await response.json(content_type=None))['message']
+        except Exception:
+            return f"HTTP {response.status}"
+
+    async def call_backend(self, backend, payload):
+        """Шард на сервере пула: фоновая задача, ожидание, все товары
+
+        Оба типа серверов поддерживают "background": ответ 202 с job_id,
+        итог - через long-poll /jobs/{id}, товары - страницами /results.
+        """
+        async with self.session.post(f"{backend.url}/parse",
+                                     json=dict(payload, background=True)) as response:
+            if response.status == 429:
+                raise Busy()
+            if 400 <= response.status < 500:
+                raise InvalidRequest(await self.error_message(response))
+            if response.status not in (200, 202):
+                raise RuntimeError(f"HTTP {response.status}")
+            job_id = (await response.json())['job_id']
+
+        deadline = time.monotonic() + SHARD_TIMEOUT
+        while True:
+            wait = max(1, min(30, int(deadline - time.monotonic())))
+            async with self.session.get(f"{backend.url}/jobs/{job_id}", params={'wait': wait},
+                                        timeout=aiohttp.ClientTimeout(total=wait + 5)) as response:
+                response.raise_for_status()
+                job = await response.json()
+            if job['status'] == 'error':
+                if job.get('invalid_request'):
+                    raise InvalidRequest(job['error'])
+                raise RuntimeError(job['error'])
+            if job['status'] == 'done':
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"задача {job_id} не завершилась за {SHARD_TIMEOUT} сек")
+
+        products = []
+        while True:
+            params = {'offset': len(products), 'limit': MAX_PAGE_LIMIT}
+            async with self.session.get(f"{backend.url}/results/{job_id}", params=params,
+                                        headers={'Accept': self.codec.content_type}) as response:
+                response.raise_for_status()
+                page = self.codec.loads(await response.read())
+            products.extend(page['products'])
+            if not page['products'] or len(products) >= page['total']:
+                break
+        return job['result'], products
+
+    async def run_shard(self, payload):
+        """Шард с повтором на другом сервере при сбое
+
+        Сбой (обрыв соединения, 5xx, ошибка задачи) помечает сервер
+        нездоровым до следующей успешной проверки; перегрузка (429) -
+        только пропуск этого сервера. Отказ в параметрах запроса (прочие
+        4xx, ошибка задачи из-за параметров) не повторяется: InvalidRequest
+        уходит клиенту как 400.
+        """
+        failures = []
+        tried = set()
+        deadline = time.monotonic() + SHARD_TIMEOUT
+        pages = f"{payload['start_page']}-{payload['end_page']}"
+
+        while len(failures) < self.max_attempts and time.monotonic() < deadline:
+            backend = self.pick(tried)
+            if backend is None:
+                # Все заняты или недоступны - ждем освобождения или проверки здоровья
+                tried.clear()
+                await asyncio.sleep(0.5)
+                continue
+
+            backend.inflight += 1
+            started = time.monotonic()
+            try:
+                summary, products = await self.call_backend(backend, payload)
+            except Busy:
+                tried.add(backend)
+                continue
+            except InvalidRequest:
+                # Ошибка клиента: сервер здоров, на других будет та же
+                raise
+            except Exception as e:
+                print(f"Шард {pages}: сбой на {backend.url}: {e!r}")
+                backend.healthy = False
+                backend.failures += 1
+                failures.append(f"{backend.url}: {e!r}")
+                tried.add(backend)
+                continue
+            finally:
+                backend.inflight -= 1
+
+            backend.completed += 1
+            return {
+                'pages': pages,
+                'backend': backend.url,
+                'server': backend.kind,
+                'attempts': len(failures) + 1,
+                'time': round(time.monotonic() - started, 2),
+                'duplicates_removed': summary.get('duplicates_removed', 0),
+                'pages_skipped': summary.get('pages_skipped', []),
+                'products': products
+            }
+
+        reason = '; '.join(failures) or 'нет доступных серверов'
+        raise RuntimeError(f"Шард {pages} не выполнен: {reason}")
+
+    async def handle_parse(self, request):
+        """Парсинг диапазона страниц шардами на серверах пула
+
+        Диапазон режется на шарды по "shard_pages" страниц (по умолчанию
+        --shard-pages), шарды выполняются параллельно, товары сливаются в
+        порядке страниц с удалением повторов на стыках шардов.
+        """
+        try:
+            data = await request.json()
+            if 'batch' in data:
+                raise ValueError('"batch" через прокси не поддерживается')
+            if data.get('mode', 'full') != 'full':
+                # Выборку по шардам не сложить без интервалов каждого шарда
+                raise ValueError('"mode": "estimate" через прокси не поддерживается')
+            url = data.get('url', 'https://dental-first.ru/catalog')
+            start_page = int(data.get('start_page', 1))
+            end_page = int(data.get('end_page', 3))
+            shard_pages = int(data.get('shard_pages', self.shard_pages))
+            if start_page < 1 or end_page < start_page or shard_pages < 1:
+                raise ValueError('нужно 1 <= start_page <= end_page и shard_pages >= 1')
+        except json.JSONDecodeError:
+            return self.respond(request, {'status': 'error', 'message': 'Неверный JSON в теле запроса'},
+                                status=400)
+        except (ValueError, TypeError) as e:
+            return self.respond(request, {'status': 'error', 'message': f'Неверные параметры запроса: {e}'},
+                                status=400)
+
+        job_id = uuid.uuid4().hex[:12]
+        shards = make_shards(start_page, end_page, shard_pages)
+        base = {k: v for k, v in data.items() if k not in FRONT_PARAMS}
+        print(f"Задача {job_id}: страницы {start_page}-{end_page}, шардов {len(shards)}")
+
+        start_time = time.time()
+        tasks = [asyncio.ensure_future(self.run_shard(dict(base, url=url, start_page=first, end_page=last)))
+                 for first, last in shards]
+        try:
+            # Сбой одного шарда проваливает задачу - остальные шарды отменяются
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            results = [task.result() for task in tasks]
+        except InvalidRequest as e:
+            print(f"Задача {job_id} отклонена сервером пула: {e}")
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=400)
+        except Exception as e:
+            print(f"Ошибка задачи {job_id}: {e}")
+            return self.respond(request, {'status': 'error', 'message': str(e)}, status=502)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # Слияние в порядке страниц; повторы на стыках шардов убираются здесь
+        dedup = Deduplicator.for_pages(end_page - start_page + 1) if data.get('dedup', True) else None
+        all_products = ProductStore()
+        for shard in results:
+            products = shard.pop('products')
+            shard['products'] = len(products)
+            all_products.extend(dedup.filter(products) if dedup else products)
+
+        execution_time = time.time() - start_time
+        products_file = products_path('front', job_id)
+        write_products(products_file, all_products)
+
+        duplicates = sum(shard['duplicates_removed'] for shard in results)
+        skipped = [page for shard in results for page in shard['pages_skipped']]
+        if dedup:
+            duplicates += dedup.duplicates
+        result_data = {
+            'job_id': job_id,
+            'timestamp': datetime.now().isoformat(),
+            'url': url,
+            'pages_parsed': f"{start_page}-{end_page}",
+            'total_products': len(all_products),
+            'total_price': all_products.total_price(),
+            'execution_time': round(execution_time, 2),
+            'duplicates_removed': duplicates,
+            'partial': bool(skipped),
+            'pages_skipped': skipped,
+            'shards': results,
+            'retries': sum(shard['attempts'] - 1 for shard in results),
+            'products_file': products_file,
+            'products': all_products[:100]
+        }
+        write_json_atomic('front_results.json', result_data)
+        print(f"Задача {job_id}: {len(all_products)} товаров за {execution_time:.2f} сек")
+
+        summary = {k: v for k, v in result_data.items() if k != 'products'}
+        return self.respond(request, dict(
+            summary,
+            status='success',
+            message=f'Парсинг завершен. Найдено {len(all_products)} товаров.',
+            results_file='front_results.json'
+        ))
+
+    async def run(self):
+        """Запуск прокси"""
+        self.session = aiohttp.ClientSession()
+        # Первая проверка до приема запросов, дальше - в фоне
+        await asyncio.gather(*(self.check_backend(b) for b in self.backends))
+        health = asyncio.create_task(self.health_loop())
+
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+
+        print("="*60)
+        print("ФРОНТ-ПРОКСИ ЗАПУЩЕН")
+        print("="*60)
+        print(f"Адрес: http://{self.host}:{self.port}")
+        print(f"Серверов в пуле: {len(self.backends)}, страниц в шарде: {self.shard_pages}")
+        print("="*60)
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        try:
+            await stop_event.wait()
+        finally:
+            health.cancel()
+            await runner.cleanup()
+            await self.session.close()
+            print("Прокси остановлен")
+
+def main():
+    """Точка входа"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Фронт-прокси над пулом серверов парсинга')
+    parser.add_argument('--port', type=int, default=8090, help='Порт прокси')
+    parser.add_argument('--host', default='localhost', help='Хост прокси')
+    parser.add_argument('--backend', action='append', required=True,
+                        help='Адрес сервера пула, например http://localhost:8100 (можно несколько)')
+    parser.add_argument('--shard-pages', type=int, default=SHARD_PAGES, help='Страниц в шарде')
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help='Сбоев на шард до отказа')
+    parser.add_argument('--health-interval', type=float, default=2.0,
+                        help='Период проверки серверов пула, сек')
+    args = parser.parse_args()
+
+    try:
+        proxy = FrontProxy(args.backend, args.host, args.port, args.shard_pages,
+                           args.max_attempts, args.health_interval)
+        asyncio.run(proxy.run())
+    except KeyboardInterrupt:
+        print("\n\nПрокси остановлен пользователем")
+    except Exception as e:
+        print(f"\nОшибка запуска прокси: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+# Архив HTTP-ответов: запись обхода и воспроизведение без сети
+import atexit
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zipfile
+import zlib
+
+# Центральный каталог zip пишется только при закрытии, поэтому архив
+# записи закрывается и открывается заново каждые FLUSH_PAGES страниц или
+# FLUSH_INTERVAL секунд - при сбое процесса теряются только последние
+FLUSH_PAGES = 50
+FLUSH_INTERVAL = 5.0
+
+# Локальный заголовок записи zip (сигнатура PK\3\4 и поля до имени файла)
+_local_header = struct.Struct('<4sHHHHHIIIHH')
+
+def recover(path):
+    """Восстановление архива без целого центрального каталога
+
+    Сбой между сбросами оставляет записи без каталога (а дозапись поверх
+    старого каталога портит и его). Записи читаются подряд по локальным
+    заголовкам, до первой недописанной. Возвращает число записей.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    entries = []
+    pos = 0
+    while pos + _local_header.size <= len(data):
+        (signature, _, flags, method, mtime, mdate, crc, size, _,
+         name_len, extra_len) = _local_header.unpack_from(data, pos)
+        if signature != b'PK\x03\x04' or flags & 0x08:
+            break
+        start = pos + _local_header.size + name_len + extra_len
+        raw = data[start:start + size]
+        if len(raw) < size:
+            break
+        try:
+            body = zlib.decompress(raw, -15) if method == zipfile.ZIP_DEFLATED else raw
+        except zlib.error:
+            break
+        if zlib.crc32(body) != crc:
+            break
+        name = data[pos + _local_header.size:pos + _local_header.size + name_len].decode('utf-8')
+        date_time = ((mdate >> 9) + 1980, (mdate >> 5) & 0xF, mdate & 0x1F,
+                     mtime >> 11, (mtime >> 5) & 0x3F, (mtime & 0x1F) * 2)
+        entries.append((zipfile.ZipInfo(name, date_time), body))
+        pos = start + size
+
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as fixed:
+        for info, body in entries:
+            info.compress_type = zipfile.ZIP_DEFLATED
+            fixed.writestr(info, body)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+def check_archive(path):
+    """Восстановление поврежденного архива перед открытием
+
+    Проверка нужна и для записи: режим 'a' молча дописывает новый архив в
+    конец файла, который не читается как zip, и старые записи теряются.
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        zipfile.ZipFile(path, 'r').close()
+    except zipfile.BadZipFile:
+        count = recover(path)
+        print(f"Архив {path} не был закрыт после сбоя, восстановлено записей: {count}")
+
+class HttpArchive:
+    """Сжатый zip-архив загруженных страниц с индексом по URL
+
+    Для каждой страницы две записи: pages/<ключ>.html - тело ответа и
+    meta/<ключ>.json - URL, статус, заголовки, время загрузки. Центральный
+    каталог zip дает доступ к любой странице без распаковки остальных.
+
+    mode='record' - дописывать ответы, mode='replay' - отдавать из архива;
+    latency=True при воспроизведении выдерживает записанное время загрузки.
+    """
+
+    def __init__(self, path, mode='replay', latency=False):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Неизвестный режим архива: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.index = {}
+        self.unflushed = 0
+        self.flushed_at = time.monotonic()
+
+        check_archive(path)
+        if mode == 'record':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.zip = zipfile.ZipFile(path, 'a', compression=zipfile.ZIP_DEFLATED)
+            # Центральный каталог пишется при закрытии и периодически в flush
+            atexit.register(self.close)
+        else:
+            self.zip = zipfile.ZipFile(path, 'r')
+        self.load_index()
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def load_index(self):
+        """Метаданные всех страниц архива (маленькие json-записи)"""
+        for name in self.zip.namelist():
+            if name.startswith('meta/'):
+                meta = json.loads(self.zip.read(name))
+                self.index[meta['url']] = meta
+        if self.replaying:
+            print(f"Архив {self.path}: страниц {len(self.index)}")
+
+    def record(self, url, status, headers, body, elapsed):
+        """Сохранение ответа; повторная загрузка того же URL не пишется
+
+        Сжатие идет под блокировкой архива, поэтому асинхронный сервер
+        вызывает запись в пуле потоков, а не в цикле событий.
+        """
+        if self.mode != 'record':
+            return
+        key = self.key(url)
+        meta = {
+            'url': url,
+            'status': status,
+            'headers': dict(headers or {}),
+            'elapsed': round(elapsed, 4),
+            'fetched_at': time.time(),
+            'page': f"pages/{key}.html",
+        }
+        with self.lock:
+            if url in self.index or self.zip.fp is None:
+                return
+            self.zip.writestr(meta['page'], body or '')
+            self.zip.writestr(f"meta/{key}.json", json.dumps(meta, ensure_ascii=False))
+            self.index[url] = meta
+            self.unflushed += 1
+            if (self.unflushed >= FLUSH_PAGES
+                    or time.monotonic() - self.flushed_at >= FLUSH_INTERVAL):
+                self.flush()
+
+    def flush(self):
+        """Запись центрального каталога: закрыть и открыть архив заново
+        (вызывается под self.lock)"""
+        self.zip.close()
+        self.zip = zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED)
+        self.unflushed = 0
+        self.flushed_at = time.monotonic()
+
+    def lookup(self, url):
+        """(статус, тело, записанное время) или None, если URL нет в архиве"""
+        meta = self.index.get(url)
+        if meta is None:
+            return None
+        with self.lock:
+            body = self.zip.read(meta['page']).decode('utf-8')
+        return meta['status'], body, meta['elapsed']
+
+    def close(self):
+        with self.lock:
+            if self.zip.fp is not None:
+                self.zip.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    # Пул процессов получает архив воспроизведения по пути и открывает заново
+    def __getstate__(self):
+        if self.mode != 'replay':
+            raise TypeError('Архив записи нельзя передать в другой процесс')
+        return {'path': self.path, 'latency': self.latency}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], 'replay', state['latency'])
+
+def open_archive(record=None, replay=None, latency=False):
+    """Архив по параметрам командной строки серверов (или None)"""
+    if record and replay:
+        raise ValueError('--record и --replay нельзя указывать вместе')
+    if record:
+        print(f"Запись загруженных страниц в архив {record}")
+        return HttpArchive(record, 'record')
+    if replay:
+        return HttpArchive(replay, 'replay', latency)
+    return None
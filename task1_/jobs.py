@@ -0,0 +1,213 @@
+# Реестр задач парсинга с уведомлением о завершении
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Состояния задачи
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+class Job:
+    """Задача парсинга: прогресс, итог и ожидание изменений
+
+    Каждое изменение увеличивает version и будит ожидающих: потоки
+    через Condition, корутины через слушателей (call_soon_threadsafe).
+    """
+
+    def __init__(self, job_id, params, key=None, monitor=None):
+        self.id = job_id
+        self.params = params
+        self.key = key
+        self.status = PENDING
+        self.created = time.time()
+        self.finished_at = None
+        self.pages_total = 0
+        self.pages_done = 0
+        self.products_found = 0
+        self.result = None
+        self.error = None
+        self.invalid = False  # ошибка в параметрах запроса, а не в работе сервера
+        self.version = 0
+        self.ticket = None
+        self.monitor = monitor  # memory.MemoryMonitor или None
+        self.memory = None
+        self.cond = threading.Condition()
+        self.listeners = []
+
+    @property
+    def finished(self):
+        return self.status in (DONE, ERROR)
+
+    def start(self, pages_total):
+        """Отметка начала парсинга (и учета памяти)"""
+        if self.monitor and self.memory is None:
+            self.memory = self.monitor.track()
+        with self.cond:
+            self.status = RUNNING
+            self.pages_total = pages_total
+            self.changed()
+
+    def progress(self, products_found):
+        """Отметка обработанной страницы"""
+        with self.cond:
+            self.pages_done += 1
+            self.products_found += products_found
+            self.changed()
+
+    def finish(self, result):
+        """Успешное завершение; result - сводка без списка товаров"""
+        self.stop_memory()
+        with self.cond:
+            self.status = DONE
+            self.result = result
+            self.finished_at = time.time()
+            self.changed()
+
+    def fail(self, error):
+        """Завершение с ошибкой"""
+        self.stop_memory()
+        with self.cond:
+            self.status = ERROR
+            self.error = str(error)
+            self.invalid = isinstance(error, ValueError)
+            self.finished_at = time.time()
+            self.changed()
+
+    def stop_memory(self):
+        if self.memory and self.memory.running:
+            self.monitor.release(self.memory)
+
+    def changed(self):
+        """Вызывается под self.cond после каждого изменения"""
+        self.version += 1
+        self.cond.notify_all()
+        for callback in list(self.listeners):
+            callback()
+
+    def snapshot(self):
+        """Текущее состояние задачи для ответа клиенту"""
+        with self.cond:
+            end = self.finished_at or time.time()
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'version': self.version,
+                'pages_total': self.pages_total,
+                'pages_done': self.pages_done,
+                'products_found': self.products_found,
+                'elapsed': round(end - self.created, 2),
+                'memory': self.memory.report() if self.memory else None,
+                'result': self.result,
+                'error': self.error,
+                'invalid_request': self.invalid
+            }
+
+    def ready(self, since_version):
+        """Есть ли что сообщить ожидающему клиенту"""
+        if since_version is None:
+            return self.finished
+        return self.version > since_version or self.finished
+
+    def wait(self, timeout=None, since_version=None):
+        """Блокирующее ожидание завершения (или новой версии)"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.ready(since_version), timeout=timeout)
+        return self.snapshot()
+
+    async def wait_async(self, timeout=None, since_version=None):
+        """То же ожидание для asyncio без занятия потока"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(event.set)
+
+        with self.cond:
+            self.listeners.append(notify)
+        try:
+            deadline = None if timeout is None else loop.time() + timeout
+            while not self.ready(since_version):
+                remaining = None if deadline is None else deadline - loop.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            with self.cond:
+                self.listeners.remove(notify)
+
+        return self.snapshot()
+
+class JobRegistry:
+    """Ограниченный реестр последних задач"""
+
+    def __init__(self, max_jobs=100, monitor=None):
+        self.max_jobs = max_jobs
+        self.monitor = monitor
+        self.jobs = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def create(self, params, key=None):
+        """Регистрация новой задачи"""
+        job = Job(uuid.uuid4().hex[:12], params, key, self.monitor)
+        with self.lock:
+            self.add(job)
+        return job
+
+    def get_or_create(self, params, key, admit=None):
+        """Single-flight: присоединение к идущей задаче с тем же ключом
+
+        Возвращает (job, created). Для новой задачи вызывается admit()
+        (допуск по нагрузке); если он бросает исключение, задача не
+        регистрируется. Завершенные задачи из inflight убираются лениво.
+        """
+        with self.lock:
+            job = self.inflight.get(key)
+            if job is not None and not job.finished:
+                return job, False
+            ticket = admit() if admit else None
+            job = Job(uuid.uuid4().hex[:12], params, key, self.monitor)
+            job.ticket = ticket
+            self.inflight[key] = job
+            self.add(job)
+            return job, True
+
+    def add(self, job):
+        """Добавление задачи в реестр (под self.lock)"""
+        self.jobs[job.id] = job
+        # Вытесняем самые старые завершенные задачи
+        while len(self.jobs) > self.max_jobs:
+            oldest_id = next(
+                (jid for jid, j in self.jobs.items() if j.finished), None
+            )
+            if oldest_id is None:
+                break
+            oldest = self.jobs.pop(oldest_id)
+            if self.inflight.get(oldest.key) is oldest:
+                del self.inflight[oldest.key]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def active(self):
+        """Незавершенные задачи"""
+        with self.lock:
+            return [job for job in self.jobs.values() if not job.finished]
+
+    def latest(self):
+        """Последняя созданная задача"""
+        with self.lock:
+            return next(reversed(self.jobs.values()), None)
+
+def sse_event(event, data_json):
+    """Кадр Server-Sent Events"""
+    return f"event: {event}\ndata: {data_json}\n\n".encode('utf-8')
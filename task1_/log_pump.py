@@ -0,0 +1,187 @@
+# Мультиплексор вывода дочерних процессов серверов
+import os
+import sys
+import threading
+import selectors
+import logging
+import logging.handlers
+from collections import deque
+from datetime import datetime
+
+class LogPump:
+    """Один поток читает stdout и stderr всех процессов через selectors.
+
+    Строки помечаются именем сервера, попадают в кольцевой буфер
+    ограниченного размера и, если задан log_dir, в ротируемые файлы.
+    """
+
+    def __init__(self, buffer_size=500, echo=True, log_dir=None,
+                 max_bytes=1024 * 1024, backup_count=3):
+        self.buffer = deque(maxlen=buffer_size)
+        self.echo = echo
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.loggers = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+        # На Windows select не работает с пайпами - читаем потоками
+        self.use_selector = sys.platform != 'win32'
+        if self.use_selector:
+            self.selector = selectors.DefaultSelector()
+            self.pending = deque()
+            self.wakeup_r, self.wakeup_w = os.pipe()
+            os.set_blocking(self.wakeup_r, False)
+            self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+    def add(self, name, process, log_name=None):
+        """Подключение stdout/stderr процесса (Popen в бинарном режиме)"""
+        if self.log_dir and log_name:
+            self.loggers[name] = self.make_file_logger(log_name)
+
+        streams = [(process.stdout, 'stdout'), (process.stderr, 'stderr')]
+        streams = [(stream, kind) for stream, kind in streams if stream is not None]
+
+        if not self.use_selector:
+            for stream, kind in streams:
+                threading.Thread(
+                    target=self.read_blocking,
+                    args=(stream, name, kind),
+                    daemon=True
+                ).start()
+            return
+
+        # Регистрацию выполняет поток насоса - selector не потокобезопасен
+        with self.lock:
+            for stream, kind in streams:
+                self.pending.append((stream, name, kind))
+        os.write(self.wakeup_w, b'\0')
+        self.start()
+
+    def start(self):
+        """Запуск потока насоса"""
+        if self.use_selector and not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self.loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Остановка потока насоса"""
+        if not self.running:
+            return
+        self.running = False
+        os.write(self.wakeup_w, b'\0')
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def loop(self):
+        """Цикл мультиплексирования"""
+        while self.running:
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    self.drain_wakeup()
+                    continue
+                self.read_ready(key)
+
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self.unregister(key)
+
+    def drain_wakeup(self):
+        """Регистрация новых потоков после пробуждения"""
+        try:
+            os.read(self.wakeup_r, 4096)
+        except BlockingIOError:
+            pass
+
+        with self.lock:
+            while self.pending:
+                stream, name, kind = self.pending.popleft()
+                fd = stream.fileno()
+                os.set_blocking(fd, False)
+                # data: [поток, имя, вид, недочитанный хвост]
+                self.selector.register(fd, selectors.EVENT_READ, [stream, name, kind, b''])
+
+    def read_ready(self, key):
+        """Чтение всего доступного из готового дескриптора"""
+        state = key.data
+        try:
+            chunk = os.read(key.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+
+        if not chunk:
+            if state[3]:
+                self.emit(state[1], state[2], state[3])
+            self.unregister(key)
+            return
+
+        lines = (state[3] + chunk).split(b'\n')
+        state[3] = lines.pop()
+        for line in lines:
+            self.emit(state[1], state[2], line)
+
+    def unregister(self, key):
+        """Отключение закрытого потока"""
+        self.selector.unregister(key.fd)
+        try:
+            key.data[0].close()
+        except Exception:
+            pass
+
+    def read_blocking(self, stream, name, kind):
+        """Запасной вариант для Windows: блокирующее чтение без пауз"""
+        try:
+            for line in iter(stream.readline, b''):
+                self.emit(name, kind, line)
+        except Exception:
+            pass
+
+    def emit(self, name, kind, raw):
+        """Обработка одной строки"""
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        if not line.strip():
+            return
+
+        tag = name if kind == 'stdout' else f"{name}:stderr"
+        entry = (datetime.now().strftime('%H:%M:%S'), tag, line)
+        with self.lock:
+            self.buffer.append(entry)
+
+        logger = self.loggers.get(name)
+        if logger:
+            logger.info(line, extra={'stream': kind})
+
+        if self.echo:
+            print(f"[{tag}] {line}")
+
+    def recent(self, count=50, name=None):
+        """Последние строки из кольцевого буфера"""
+        with self.lock:
+            entries = list(self.buffer)
+        if name:
+            entries = [e for e in entries if e[1].split(':')[0] == name]
+        return entries[-count:]
+
+    def make_file_logger(self, log_name):
+        """Логгер с ротацией файла для одного сервера"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        logger = logging.getLogger(f"log_pump.{log_name}")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        if not logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(self.log_dir, f"{log_name}.log"),
+                maxBytes=self.max_bytes,
+                backupCount=self.backup_count,
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(asctime)s [%(stream)s] %(message)s'))
+            logger.addHandler(handler)
+
+        return logger
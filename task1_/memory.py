@@ -0,0 +1,208 @@
+# Учет памяти задач (psutil, tracemalloc) и снимки для /debug/memory
+import gc
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import psutil
+except ImportError:  # без psutil RSS не замеряется, остальное работает
+    psutil = None
+
+MB = 1024 * 1024
+
+# Служебные выделения, которые не интересны в отчете
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+GROUPS = ('lineno', 'filename', 'traceback')
+
+def to_mb(value):
+    return None if value is None else round(value / MB, 2)
+
+def start_tracing(frames=1):
+    """Включение tracemalloc (frames - глубина стека у каждого выделения)"""
+    if frames and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        print(f"tracemalloc включен, кадров стека: {frames}")
+
+class JobMemory:
+    """Память процесса за время одной задачи
+
+    RSS и память Python (tracemalloc, если включен) замеряются при старте,
+    периодически фоновым потоком и при завершении. Значения общие для
+    процесса: у задач, идущих одновременно, в пик попадают и соседние.
+    """
+
+    def __init__(self, rss, traced):
+        self.rss_start = self.rss_peak = self.rss_end = rss
+        self.traced_start = self.traced_peak = self.traced_end = traced
+        self.running = True
+
+    def update(self, rss, traced):
+        if rss is not None and self.rss_start is not None:
+            self.rss_peak = max(self.rss_peak, rss)
+            self.rss_end = rss
+        if traced is not None and self.traced_start is not None:
+            self.traced_peak = max(self.traced_peak, traced)
+            self.traced_end = traced
+
+    def report(self):
+        """Итог для снимка задачи; байты Python - только если tracemalloc
+        был включен при старте задачи (по умолчанию он выключен)"""
+        rss = self.rss_start is not None
+        report = {
+            'running': self.running,
+            'rss_start_mb': to_mb(self.rss_start),
+            'rss_peak_delta_mb': to_mb(self.rss_peak - self.rss_start) if rss else None,
+            'rss_end_delta_mb': to_mb(self.rss_end - self.rss_start) if rss else None,
+        }
+        if self.traced_start is not None:
+            report['py_peak_bytes'] = self.traced_peak - self.traced_start
+            report['py_retained_bytes'] = self.traced_end - self.traced_start
+        return report
+
+class MemoryMonitor:
+    """Фоновый замер памяти, пока идет хотя бы одна задача"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process() if psutil else None
+        self.active = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        """(RSS, байт Python под tracemalloc); None - если не замеряется"""
+        rss = self.process.memory_info().rss if self.process else None
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        return rss, traced
+
+    def track(self):
+        """Начало учета памяти задачи"""
+        usage = JobMemory(*self.sample())
+        with self.lock:
+            self.active.add(usage)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='memory-monitor', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return usage
+
+    def release(self, usage):
+        """Завершение учета: последний замер"""
+        usage.update(*self.sample())
+        usage.running = False
+        with self.lock:
+            self.active.discard(usage)
+
+    def run(self):
+        while True:
+            with self.lock:
+                active = list(self.active)
+            if not active:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            rss, traced = self.sample()
+            for usage in active:
+                usage.update(rss, traced)
+            time.sleep(self.interval)
+
+    def process_memory(self):
+        """Текущая память процесса для /status"""
+        rss, traced = self.sample()
+        return {
+            'rss_mb': to_mb(rss),
+            'tracing': tracemalloc.is_tracing(),
+            'traced_mb': to_mb(traced),
+        }
+
+class SnapshotTracker:
+    """Снимки tracemalloc для /debug/memory
+
+    Каждый запрос делает снимок и сравнивает его с предыдущим: что
+    выросло между двумя запросами, то и подозревается в утечке.
+    """
+
+    def __init__(self):
+        self.previous = None
+        self.previous_at = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def format_stat(stat, group, diff=False):
+        frames = [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+        row = {
+            'where': frames if group == 'traceback' else frames[0],
+            'size_kb': round(stat.size / 1024, 1),
+            'count': stat.count,
+        }
+        if diff:
+            row['size_diff_kb'] = round(stat.size_diff / 1024, 1)
+            row['count_diff'] = stat.count_diff
+        return row
+
+    def report(self, top=20, group='lineno', start=0, stop=False):
+        """Топ мест выделения и разница с предыдущим снимком
+
+        start=N включает tracemalloc с N кадрами стека, stop - выключает
+        и забывает предыдущий снимок.
+        """
+        if group not in GROUPS:
+            raise ValueError(f"group должен быть одним из: {', '.join(GROUPS)}")
+        if top <= 0:
+            raise ValueError('top должен быть положительным')
+
+        with self.lock:
+            if stop:
+                tracemalloc.stop()
+                self.previous = self.previous_at = None
+            elif start:
+                start_tracing(start)
+
+            info = {
+                'tracing': tracemalloc.is_tracing(),
+                'pid': os.getpid(),
+                'gc_counts': gc.get_count(),
+            }
+            if not tracemalloc.is_tracing():
+                info['message'] = 'tracemalloc выключен: ?start=1 или запуск сервера с --tracemalloc 1'
+                return info
+
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+            now = time.time()
+            info.update({
+                'frames': tracemalloc.get_traceback_limit(),
+                'traced_mb': to_mb(current),
+                'traced_peak_mb': to_mb(peak),
+                'group': group,
+                'top': [self.format_stat(stat, group)
+                        for stat in snapshot.statistics(group)[:top]],
+                'diff': None,
+                'diff_seconds': None,
+            })
+            if self.previous is not None:
+                changes = snapshot.compare_to(self.previous, group)
+                info['diff'] = [self.format_stat(stat, group, diff=True)
+                                for stat in changes[:top] if stat.size_diff or stat.count_diff]
+                info['diff_seconds'] = round(now - self.previous_at, 1)
+            self.previous = snapshot
+            self.previous_at = now
+            return info
+
+def parse_debug_params(get):
+    """Параметры /debug/memory; get(name) -> строка или None"""
+    return {
+        'top': int(get('top') or 20),
+        'group': get('group') or 'lineno',
+        'start': int(get('start') or 0),
+        'stop': get('stop') in ('1', 'true'),
+    }
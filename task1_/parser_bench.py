@@ -0,0 +1,228 @@
+# Микробенчмарк разбора карточек на сохраненном корпусе страниц каталога
+import gc
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from crawler import parse_catalog_html
+from extraction import DEFAULT_PLAN, load_schema, tree_for
+
+# Страницы корпуса хранятся рядом с модулем
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_corpus')
+
+# Рост памяти меньше этого (байт на карточку) считается шумом замера
+ALLOC_NOISE = 512
+
+# Имя -> (файл, повторов блока карточек). Огромная страница собирается из
+# типичной: блок между <!--cards--> и <!--/cards--> повторяется.
+CORPUS = {
+    'small': ('small.html', 1),
+    'typical': ('typical.html', 1),
+    'huge': ('typical.html', 60),
+    'malformed': ('malformed.html', 1),
+}
+
+ENGINES = ('html.parser', 'lxml', 'html5lib')
+
+BASELINE_FILE = 'parser_baseline.json'
+
+def load_page(name):
+    """HTML страницы корпуса по имени"""
+    filename, repeat = CORPUS[name]
+    with open(os.path.join(CORPUS_DIR, filename), encoding='utf-8') as f:
+        html = f.read()
+    if repeat > 1:
+        head, rest = html.split('<!--cards-->', 1)
+        cards, tail = rest.split('<!--/cards-->', 1)
+        html = head + cards * repeat + tail
+    return html
+
+def available_engines(names=None):
+    """Установленные движки BeautifulSoup из списка"""
+    from bs4 import BeautifulSoup, FeatureNotFound
+    engines = []
+    for name in names or ENGINES:
+        try:
+            BeautifulSoup('', name)
+            engines.append(name)
+        except FeatureNotFound:
+            print(f"Движок {name} не установлен, пропуск")
+    return engines
+
+def memory_use(func, repeat=3):
+    """(пик байт, выделенных блоков в результате) при вызове func -
+    минимальные из repeat
+
+    tracemalloc включается заново на каждый повтор (reset_peak есть только
+    с Python 3.9), поэтому учитываются только выделения внутри func. Блоки
+    считаются по снимку после вызова, пока результат жив: это выделения,
+    оставшиеся в разобранных карточках.
+    """
+    best_peak = best_blocks = None
+    for _ in range(repeat):
+        # Деревья BeautifulSoup циклические: мусор прошлых вызовов
+        # собирается заранее, иначе он попадает в пик случайно
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+            # Мусор дерева этого вызова - не часть результата
+            gc.collect()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        del result
+        blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+        best_peak = peak if best_peak is None else min(best_peak, peak)
+        best_blocks = blocks if best_blocks is None else min(best_blocks, blocks)
+    return best_peak, best_blocks
+
+def best_time(func, repeat):
+    """Лучшее время одного вызова; маленькие страницы гоняются в цикле
+    не короче 0.2 с, чтобы замер не тонул в шуме таймера"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def measure(html, engine, repeat=5, plan=None):
+    """Скорость и память разбора одной страницы одним движком
+
+    Замеряются полный разбор (построение дерева и карточки) и отдельно
+    извлечение полей планом схемы из уже найденных карточек.
+    """
+    plan = plan or DEFAULT_PLAN
+    tree = tree_for(engine)
+    cards = plan.find_cards(tree.parse(html, engine), tree)
+    products = parse_catalog_html(html, features=engine, plan=plan)
+
+    def parse():
+        return parse_catalog_html(html, features=engine, plan=plan)
+
+    def extract():
+        return [plan.extract(card, tree=tree) for card in cards]
+
+    parse_time = best_time(parse, repeat)
+    extract_time = best_time(extract, repeat)
+    parse_peak, parse_blocks = memory_use(parse)
+    extract_peak, extract_blocks = memory_use(extract)
+
+    count = max(len(cards), 1)
+    return {
+        'cards': len(cards),
+        'products': len(products),
+        'total_price': sum(p['price'] for p in products),
+        'cards_per_sec': round(len(cards) / parse_time, 1) if parse_time else None,
+        'extract_cards_per_sec': round(len(cards) / extract_time, 1) if extract_time else None,
+        # bytes_* - пик памяти, allocs_* - блоки, оставшиеся в товарах
+        'bytes_per_card': round(parse_peak / count),
+        'extract_bytes_per_card': round(extract_peak / count),
+        'allocs_per_card': round(parse_blocks / count, 1),
+        'extract_allocs_per_card': round(extract_blocks / count, 1),
+    }
+
+def run(pages=None, engines=None, repeat=5, plan=None):
+    """Замер всех страниц корпуса всеми доступными движками"""
+    report = []
+    engines = available_engines(engines)
+    for page in pages or CORPUS:
+        html = load_page(page)
+        for engine in engines:
+            row = {'page': page, 'engine': engine, 'html_kb': round(len(html.encode('utf-8')) / 1024, 1)}
+            row.update(measure(html, engine, repeat, plan))
+            report.append(row)
+    return report
+
+def save_baseline(report, path=BASELINE_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'python': sys.version.split()[0], 'report': report}, f, ensure_ascii=False, indent=2)
+    print(f"Базовый замер сохранен в {path}")
+
+def load_baseline(path=BASELINE_FILE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['report']
+
+def compare(report, baseline, max_slowdown=0.2, max_alloc_growth=0.25):
+    """Регрессии относительно базового замера (список строк)
+
+    Замедление больше max_slowdown (доля) или рост памяти на карточку
+    больше max_alloc_growth - регрессия. Изменение числа товаров или
+    суммы цен - ошибка извлечения, а не скорости.
+    """
+    base = {(row['page'], row['engine']): row for row in baseline}
+    failures = []
+    for row in report:
+        old = base.get((row['page'], row['engine']))
+        if old is None:
+            continue
+        where = f"{row['page']}/{row['engine']}"
+        for field in ('products', 'total_price'):
+            if row[field] != old[field]:
+                failures.append(f"{where}: {field} {old[field]} -> {row[field]}")
+        for field in ('cards_per_sec', 'extract_cards_per_sec'):
+            if old[field] and row[field] is not None:
+                slowdown = 1 - row[field] / old[field]
+                if slowdown > max_slowdown:
+                    failures.append(f"{where}: {field} {old[field]} -> {row[field]} "
+                                    f"(медленнее на {slowdown:.0%})")
+        for field in ('bytes_per_card', 'extract_bytes_per_card'):
+            growth = row[field] - old[field]
+            if old[field] and growth > ALLOC_NOISE and growth / old[field] > max_alloc_growth:
+                failures.append(f"{where}: {field} {old[field]} -> {row[field]}")
+        for field in ('allocs_per_card', 'extract_allocs_per_card'):
+            # В старых базовых замерах числа блоков нет
+            if old.get(field) and (row[field] - old[field]) / old[field] > max_alloc_growth:
+                failures.append(f"{where}: {field} {old[field]} -> {row[field]}")
+    return failures
+
+def main():
+    """Замер разбора карточек и проверка на регрессию"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Микробенчмарк разбора карточек каталога')
+    parser.add_argument('--page', action='append', choices=list(CORPUS),
+                        help='Страница корпуса (можно несколько; по умолчанию все)')
+    parser.add_argument('--engine', action='append', choices=list(ENGINES),
+                        help='Движок BeautifulSoup (можно несколько; по умолчанию установленные)')
+    parser.add_argument('--schema', help='JSON-файл схемы полей (по умолчанию extraction.DEFAULT_SCHEMA)')
+    parser.add_argument('--repeat', type=int, default=5, help='Повторов замера, берется лучший')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Файл базового замера')
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить замер как базовый')
+    parser.add_argument('--check', action='store_true',
+                        help='Сравнить с базовым замером; код выхода 1 при регрессии')
+    parser.add_argument('--max-slowdown', type=float, default=0.2,
+                        help='Допустимое замедление, доля (0.2 = 20%%)')
+    parser.add_argument('--max-alloc-growth', type=float, default=0.25,
+                        help='Допустимый рост памяти на карточку, доля')
+    args = parser.parse_args()
+
+    plan = load_schema(args.schema) if args.schema else None
+    report = run(args.page, args.engine, args.repeat, plan)
+    print(f"{'Страница':<11}{'Движок':<13}{'HTML, КБ':>9}{'Карточек':>10}{'Карт/с':>10}"
+          f"{'Извл./с':>10}{'Пик Б/карт':>11}{'Пик Б/извл':>11}{'Блоков/карт':>12}{'Блоков/извл':>12}")
+    for row in report:
+        print(f"{row['page']:<11}{row['engine']:<13}{row['html_kb']:>9}{row['cards']:>10}"
+              f"{row['cards_per_sec']:>10.0f}{row['extract_cards_per_sec']:>10.0f}"
+              f"{row['bytes_per_card']:>11}{row['extract_bytes_per_card']:>11}"
+              f"{row['allocs_per_card']:>12}{row['extract_allocs_per_card']:>12}")
+    print("Пик Б - пик памяти на карточку при разборе; блоки - выделения (tracemalloc), "
+          "оставшиеся в товарах")
+
+    if args.save_baseline:
+        save_baseline(report, args.baseline)
+    if args.check:
+        try:
+            baseline = load_baseline(args.baseline)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Нет базового замера {args.baseline}: {e}")
+            sys.exit(2)
+        failures = compare(report, baseline, args.max_slowdown, args.max_alloc_growth)
+        for failure in failures:
+            print(f"РЕГРЕССИЯ {failure}")
+        if failures:
+            sys.exit(1)
+        print("Регрессий нет")
+
+if __name__ == '__main__':
+    main()
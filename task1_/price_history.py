@@ -0,0 +1,338 @@
+# История цен между обходами: компактный журнал изменений цен
+import os
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: журнал пишет один процесс, хватает threading.Lock
+    fcntl = None
+
+from dedup import normalize, product_key
+
+HISTORY_DIR = 'history'
+
+MAGIC = b'PRICEHIST1\n'
+
+# Типы записей журнала: словарь новых товаров и итог одного обхода
+KEYS = 0x4B    # 'K'
+CRAWL = 0x43   # 'C'
+
+MAX_HISTORY_LIMIT = 200
+
+def history_path(server):
+    """Файл истории цен сервера"""
+    return os.path.join(HISTORY_DIR, f"{server}.hist")
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos):
+    """(значение, позиция после него); IndexError - запись обрезана"""
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def zigzag(value):
+    """Знаковое число в беззнаковое: маленькие по модулю - короткие"""
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+def unzigzag(value):
+    return -((value + 1) >> 1) if value & 1 else value >> 1
+
+def write_text(out, text):
+    data = text.encode('utf-8')
+    write_varint(out, len(data))
+    out += data
+
+def read_text(data, pos):
+    length, pos = read_varint(data, pos)
+    return data[pos:pos + length].decode('utf-8'), pos + length
+
+def frame(kind, payload):
+    """Запись журнала: тип, длина, содержимое"""
+    out = bytearray([kind])
+    write_varint(out, len(payload))
+    out += payload
+    return out
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+def parse_time(value):
+    """Время из параметра запроса: unix-секунды или ISO-дата; None - не задано"""
+    if not value:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+def parse_history_params(get):
+    """Параметры /history; get(name) -> строка или None"""
+    limit = int(get('limit') or 20)
+    if not 1 <= limit <= MAX_HISTORY_LIMIT:
+        raise ValueError(f'limit должен быть 1..{MAX_HISTORY_LIMIT}')
+    params = {
+        'name': get('name'),
+        'label': get('label'),
+        'since': parse_time(get('since')),
+        'until': parse_time(get('until')),
+        'limit': limit,
+    }
+    if params['since'] is not None and params['until'] is not None and params['since'] > params['until']:
+        raise ValueError('since должен быть не позже until')
+    return params
+
+class PriceHistory:
+    """Журнал цен товаров по обходам
+
+    Файл - последовательность записей. K добавляет товары в словарь
+    (номер товара - порядок появления, хранятся название и метка). C -
+    обход: время разницей с предыдущим обходом и только изменившиеся
+    цены - номера товаров по возрастанию разницами, цена разницей с
+    прошлой ценой товара; все числа - varint. Поэтому файл растет с
+    числом изменений цен, а не с числом обходов на размер каталога.
+
+    Несколько процессов (серверы пула) дописывают один файл: запись идет
+    под блокировкой файла, перед ней дочитываются чужие записи, так что
+    номера товаров и прошлые цены у всех процессов совпадают.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offset = 0           # прочитано байт файла
+        self.ids = {}             # ключ товара (dedup.product_key) -> номер
+        self.keys = array('Q')
+        self.names = []
+        self.labels = []
+        self.search_names = []    # нормализованные названия для поиска
+        self.points = []          # по номеру товара: array пар (время, цена)
+        self.crawls = array('q')  # время каждого обхода
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.locked() as f:
+            self.catch_up(f)
+
+    @contextmanager
+    def locked(self):
+        """Файл журнала под блокировкой потоков и процессов"""
+        with self.lock, open(self.path, 'a+b') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def catch_up(self, f):
+        """Чтение записей, добавленных после прошлого чтения (в т.ч. другими процессами)"""
+        f.seek(self.offset)
+        data = f.read()
+        pos = 0
+        if self.offset == 0:
+            if not data:
+                f.write(MAGIC)
+                f.flush()
+                self.offset = len(MAGIC)
+                return
+            if not data.startswith(MAGIC):
+                raise ValueError(f"{self.path}: не файл истории цен")
+            pos = len(MAGIC)
+
+        while pos < len(data):
+            try:
+                length, start = read_varint(data, pos + 1)
+            except IndexError:
+                break
+            if start + length > len(data):
+                break
+            self.apply(data[pos], data[start:start + length])
+            pos = start + length
+        self.offset += pos
+        if pos < len(data):
+            # Под блокировкой никто не пишет: хвост - обрыв записи при сбое
+            print(f"История цен: отброшена неполная запись ({len(data) - pos} байт)")
+            f.truncate(self.offset)
+
+    def add_product(self, key, name, label):
+        self.ids[key] = len(self.names)
+        self.keys.append(key)
+        self.names.append(name)
+        self.labels.append(label)
+        self.search_names.append(normalize(name))
+        self.points.append(array('q'))
+
+    def apply(self, kind, payload):
+        """Применение одной записи журнала к памяти"""
+        pos = 0
+        if kind == KEYS:
+            while pos < len(payload):
+                name, pos = read_text(payload, pos)
+                label, pos = read_text(payload, pos)
+                self.add_product(product_key({'name': name, 'label': label}), name, label)
+        elif kind == CRAWL:
+            delta, pos = read_varint(payload, pos)
+            when = (self.crawls[-1] if self.crawls else 0) + unzigzag(delta)
+            count, pos = read_varint(payload, pos)
+            number = 0
+            for _ in range(count):
+                step, pos = read_varint(payload, pos)
+                number += step
+                change, pos = read_varint(payload, pos)
+                points = self.points[number]
+                points.extend((when, (points[-1] if points else 0) + unzigzag(change)))
+            self.crawls.append(when)
+
+    def record(self, products, when):
+        """Цены одного обхода; пишутся только новые товары и изменения
+
+        when - время обхода (unix-секунды). Возвращает сводку записи.
+        """
+        when = int(when)
+        latest = {}
+        for product in products:
+            latest[product_key(product)] = product  # повтор в обходе - берется последний
+
+        with self.locked() as f:
+            self.catch_up(f)
+            new_keys = bytearray()
+            new_products = []
+            changes = []
+            for key, product in latest.items():
+                price = int(product.get('price', 0))
+                number = self.ids.get(key)
+                if number is None:
+                    number = len(self.names) + len(new_products)
+                    name, label = product.get('name', ''), product.get('label', '')
+                    write_text(new_keys, name)
+                    write_text(new_keys, label)
+                    new_products.append((key, name, label))
+                    changes.append((number, price, 0))
+                    continue
+                points = self.points[number]
+                last = points[-1] if points else 0
+                if not points or last != price:
+                    changes.append((number, price, last))
+            changes.sort()
+
+            payload = bytearray()
+            write_varint(payload, zigzag(when - (self.crawls[-1] if self.crawls else 0)))
+            write_varint(payload, len(changes))
+            previous = 0
+            for number, price, last in changes:
+                write_varint(payload, number - previous)
+                write_varint(payload, zigzag(price - last))
+                previous = number
+
+            out = (frame(KEYS, new_keys) if new_products else bytearray()) + frame(CRAWL, payload)
+            f.write(out)
+            f.flush()
+            self.offset += len(out)
+
+            for key, name, label in new_products:
+                self.add_product(key, name, label)
+            for number, price, _ in changes:
+                self.points[number].extend((when, price))
+            self.crawls.append(when)
+
+        return {
+            'products': len(latest),
+            'new_products': len(new_products),
+            'price_changes': len(changes) - len(new_products),
+            'bytes_written': len(out),
+        }
+
+    def summary(self):
+        """Размер истории"""
+        with self.locked() as f:
+            self.catch_up(f)
+            points = sum(len(p) for p in self.points) // 2
+            return {
+                'file': self.path,
+                'file_bytes': self.offset,
+                'products': len(self.names),
+                'crawls': len(self.crawls),
+                'price_points': points,
+                'first_crawl': iso(self.crawls[0]) if self.crawls else None,
+                'last_crawl': iso(self.crawls[-1]) if self.crawls else None,
+                'bytes_per_crawl': round(self.offset / len(self.crawls), 1) if self.crawls else None,
+            }
+
+    def product_history(self, number, since=None, until=None):
+        points = self.points[number]
+        history = []
+        price_before = None
+        for i in range(0, len(points), 2):
+            when, price = points[i], points[i + 1]
+            if since is not None and when < since:
+                price_before = price
+                continue
+            if until is not None and when > until:
+                break
+            history.append({'time': iso(when), 'price': price})
+        return {
+            'name': self.names[number],
+            'label': self.labels[number],
+            'key': f"{self.keys[number]:016x}",
+            'first_seen': iso(points[0]),
+            'price': points[-1],
+            'changes': len(points) // 2 - 1,
+            'price_before': price_before,  # цена на начало периода since
+            'history': history,
+        }
+
+    def query(self, name=None, label=None, since=None, until=None, limit=20):
+        """Товары, в названии которых есть name (и с меткой label), и их цены за период"""
+        with self.locked() as f:
+            self.catch_up(f)
+            needle = normalize(name)
+            label = normalize(label) if label else None
+            matches = [number for number, text in enumerate(self.search_names)
+                       if needle in text and self.points[number]
+                       and (label is None or normalize(self.labels[number]) == label)]
+            return {
+                'total': len(matches),
+                'products': [self.product_history(number, since, until) for number in matches[:limit]],
+            }
+
+def history_report(history, params):
+    """Ответ /history: размер истории и, если задан товар, его цены"""
+    report = {'summary': history.summary()}
+    if params['name'] or params['label']:
+        report.update(history.query(**params))
+    return report
+
+def main():
+    """Просмотр файла истории цен"""
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='История цен по обходам')
+    parser.add_argument('--file', default=history_path('async'), help='Файл истории')
+    parser.add_argument('--name', help='Часть названия товара')
+    parser.add_argument('--label', help='Метка (артикул) товара')
+    parser.add_argument('--since', help='Начало периода (ISO-дата или unix-время)')
+    parser.add_argument('--until', help='Конец периода')
+    parser.add_argument('--limit', type=int, default=20, help='Товаров в ответе')
+    args = parser.parse_args()
+
+    history = PriceHistory(args.file)
+    print(json.dumps(history.summary(), ensure_ascii=False, indent=2))
+    if args.name or args.label:
+        result = history.query(args.name, args.label, parse_time(args.since), parse_time(args.until), args.limit)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# Компактное колоночное хранилище товаров
+import sys
+from array import array
+
+_numpy = None
+
+def get_numpy():
+    """Ленивый импорт numpy; None, если не установлен"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+CORE_FIELDS = ('name', 'price', 'label')
+
+class ProductStore:
+    """Товары в колонках вместо словаря на каждую карточку
+
+    Цены - типизированный массив int64, названия интернируются,
+    метки хранятся кодами словаря. Снаружи ведет себя как список
+    словарей {'name', 'price', 'label'}: len, индексы, срезы, итерация.
+    Прочие поля (ссылка и данные страницы товара) - в колонке extras,
+    которая появляется только при первом таком товаре.
+    """
+
+    __slots__ = ('names', 'prices', 'label_codes', 'label_values', 'label_index', 'extras')
+
+    def __init__(self, products=None):
+        self.names = []
+        self.prices = array('q')
+        self.label_codes = array('i')
+        self.label_values = []
+        self.label_index = {}
+        self.extras = None
+        if products:
+            self.extend(products)
+
+    @classmethod
+    def load(cls, path, batch_size=10000):
+        """Загрузка полного списка товаров задачи из JSON Lines"""
+        from results_io import iter_product_batches
+        store = cls()
+        for batch in iter_product_batches(path, batch_size):
+            store.extend(batch)
+        return store
+
+    def label_code(self, label):
+        """Код метки в словаре (добавляет новую метку)"""
+        code = self.label_index.get(label)
+        if code is None:
+            code = len(self.label_values)
+            self.label_index[label] = code
+            self.label_values.append(label)
+        return code
+
+    def append(self, product):
+        """Добавление одного товара-словаря"""
+        self.names.append(sys.intern(product.get('name', '')))
+        self.prices.append(int(product.get('price', 0)))
+        self.label_codes.append(self.label_code(product.get('label', '')))
+
+        extra = {k: v for k, v in product.items() if k not in CORE_FIELDS}
+        if extra and self.extras is None:
+            self.extras = [None] * (len(self) - 1)
+        if self.extras is not None:
+            self.extras.append(extra or None)
+
+    def extend(self, products):
+        """Добавление товаров из списка словарей или другого хранилища"""
+        if isinstance(products, ProductStore):
+            codes = [self.label_code(label) for label in products.label_values]
+            if products.extras is not None and self.extras is None:
+                self.extras = [None] * len(self)
+            if self.extras is not None:
+                self.extras.extend(products.extras or [None] * len(products))
+            self.names.extend(products.names)
+            self.prices.extend(products.prices)
+            self.label_codes.extend(codes[c] for c in products.label_codes)
+            return
+        for product in products:
+            self.append(product)
+
+    def product(self, i):
+        """Товар i в виде словаря"""
+        product = {
+            'name': self.names[i],
+            'price': self.prices[i],
+            'label': self.label_values[self.label_codes[i]]
+        }
+        if self.extras is not None and self.extras[i]:
+            product.update(self.extras[i])
+        return product
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.product(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('индекс товара вне диапазона')
+        return self.product(index)
+
+    def __iter__(self):
+        if self.extras is not None:
+            for i in range(len(self)):
+                yield self.product(i)
+            return
+        labels = self.label_values
+        for name, price, code in zip(self.names, self.prices, self.label_codes):
+            yield {'name': name, 'price': price, 'label': labels[code]}
+
+    def to_list(self):
+        """Список словарей, как раньше возвращали серверы"""
+        return list(self)
+
+    def price_array(self):
+        """Цены как numpy-массив без копирования (или None без numpy)"""
+        np = get_numpy()
+        if np is None:
+            return None
+        return np.frombuffer(self.prices, dtype=np.int64) if len(self) else np.zeros(0, dtype=np.int64)
+
+    def label_code_array(self):
+        """Коды меток как numpy-массив без копирования"""
+        np = get_numpy()
+        if np is None:
+            return None
+        return np.frombuffer(self.label_codes, dtype=np.int32) if len(self) else np.zeros(0, dtype=np.int32)
+
+    def total_price(self):
+        """Сумма цен одним проходом по массиву"""
+        prices = self.price_array()
+        if prices is not None:
+            return int(prices.sum())
+        return sum(self.prices)
+
+    def label_counts(self):
+        """Количество товаров по меткам"""
+        np = get_numpy()
+        if np is not None:
+            counts = np.bincount(self.label_code_array(), minlength=len(self.label_values))
+            return dict(zip(self.label_values, counts.tolist()))
+        counts = [0] * len(self.label_values)
+        for code in self.label_codes:
+            counts[code] += 1
+        return dict(zip(self.label_values, counts))
+
+    def memory_bytes(self):
+        """Оценка занимаемой колонками памяти"""
+        return (sys.getsizeof(self.names)
+                + self.prices.buffer_info()[1] * self.prices.itemsize
+                + self.label_codes.buffer_info()[1] * self.label_codes.itemsize
+                + sum(sys.getsizeof(v) for v in self.label_values)
+                + (sys.getsizeof(self.extras) if self.extras is not None else 0))
@@ -0,0 +1,161 @@
+# Замер ресурсов процессов серверов во время теста (psutil)
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # без psutil сравнение идет только по товарам и времени
+    psutil = None
+
+MB = 1024 * 1024
+
+def pid_for_port(port):
+    """PID процесса, слушающего порт на этой машине (или None)"""
+    if psutil is None:
+        return None
+    try:
+        for conn in psutil.net_connections(kind='tcp'):
+            if (conn.laddr and conn.laddr.port == port and conn.pid
+                    and conn.status == psutil.CONN_LISTEN):
+                return conn.pid
+    except (psutil.Error, OSError):
+        # macOS без прав не отдает чужие соединения
+        pass
+    return None
+
+class ProcessSampler:
+    """Фоновый замер процесса сервера на время теста
+
+    CPU и переключения контекста считаются разницей между началом и
+    концом, RSS, потоки, сокеты и дескрипторы - максимумом по замерам
+    каждые interval секунд.
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.process = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.usage = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if psutil is None or self.pid is None:
+            return
+        try:
+            self.process = psutil.Process(self.pid)
+            self.cpu_start = self.process.cpu_times()
+            self.ctx_start = self.process.num_ctx_switches()
+            self.rss_start = self.process.memory_info().rss
+        except psutil.Error as e:
+            print(f"   Замер ресурсов недоступен: {e}")
+            self.process = None
+            return
+        self.started = time.perf_counter()
+        self.rss_peak = self.rss_start
+        self.threads_peak = self.fds_peak = self.sockets_peak = 0
+        self.samples = 0
+        self.sample()
+        self.thread = threading.Thread(target=self.run, name='resource-sampler', daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        process = self.process
+        with process.oneshot():
+            rss = process.memory_info().rss
+            threads = process.num_threads()
+            # На Windows вместо файловых дескрипторов - handles
+            fds = process.num_fds() if hasattr(process, 'num_fds') else process.num_handles()
+        connections = getattr(process, 'net_connections', None) or process.connections
+        sockets = len(connections(kind='inet'))
+        self.rss_peak = max(self.rss_peak, rss)
+        self.threads_peak = max(self.threads_peak, threads)
+        self.fds_peak = max(self.fds_peak, fds)
+        self.sockets_peak = max(self.sockets_peak, sockets)
+        self.samples += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except psutil.Error:
+                break
+
+    def stop(self):
+        """Остановка замера; итог в self.usage"""
+        if self.process is None or self.usage is not None:
+            return self.usage
+        self.stopped.set()
+        self.thread.join()
+        try:
+            self.sample()
+            cpu = self.process.cpu_times()
+            ctx = self.process.num_ctx_switches()
+        except psutil.Error as e:
+            print(f"   Замер ресурсов прерван: {e}")
+            return None
+        self.usage = {
+            'pid': self.pid,
+            'wall_time': round(time.perf_counter() - self.started, 2),
+            'cpu_user': round(cpu.user - self.cpu_start.user, 3),
+            'cpu_system': round(cpu.system - self.cpu_start.system, 3),
+            'rss_start_mb': round(self.rss_start / MB, 1),
+            'rss_peak_mb': round(self.rss_peak / MB, 1),
+            'threads_peak': self.threads_peak,
+            'sockets_peak': self.sockets_peak,
+            'fds_peak': self.fds_peak,
+            'ctx_switches_voluntary': ctx.voluntary - self.ctx_start.voluntary,
+            'ctx_switches_involuntary': ctx.involuntary - self.ctx_start.involuntary,
+            'samples': self.samples,
+        }
+        return self.usage
+
+def efficiency(usage, pages, products):
+    """Производные показатели: страниц на секунду CPU и МБ на 1000 товаров
+
+    Память - прирост пикового RSS за время теста.
+    """
+    if not usage:
+        return {}
+    cpu = usage['cpu_user'] + usage['cpu_system']
+    rss_delta = usage['rss_peak_mb'] - usage['rss_start_mb']
+    return {
+        'cpu_seconds': round(cpu, 3),
+        'pages_per_cpu_second': round(pages / cpu, 2) if cpu else None,
+        'mb_per_1k_products': round(rss_delta / products * 1000, 3) if products else None,
+    }
+
+# (подпись, ключ, источник) строк таблицы сравнения ресурсов
+USAGE_ROWS = (
+    ('CPU user (сек)', 'cpu_user', 'usage'),
+    ('CPU system (сек)', 'cpu_system', 'usage'),
+    ('Пик RSS (МБ)', 'rss_peak_mb', 'usage'),
+    ('Потоков (макс.)', 'threads_peak', 'usage'),
+    ('Сокетов (макс.)', 'sockets_peak', 'usage'),
+    ('Дескрипторов (макс.)', 'fds_peak', 'usage'),
+    ('Перекл. добровольн.', 'ctx_switches_voluntary', 'usage'),
+    ('Перекл. принудит.', 'ctx_switches_involuntary', 'usage'),
+    ('Страниц на сек CPU', 'pages_per_cpu_second', 'efficiency'),
+    ('МБ на 1000 товаров', 'mb_per_1k_products', 'efficiency'),
+)
+
+def usage_rows(async_side, threaded_side):
+    """Строки (подпись, асинхронный, многопоточный) для таблицы сравнения
+
+    *_side - словарь {'usage': ..., 'efficiency': ...}; '-' - нет данных.
+    """
+    rows = []
+    for label, key, source in USAGE_ROWS:
+        values = []
+        for side in (async_side, threaded_side):
+            value = (side.get(source) or {}).get(key)
+            values.append('-' if value is None else value)
+        rows.append((label, *values))
+    return rows
@@ -0,0 +1,58 @@
+# Кэш результатов /parse с ограниченным временем жизни
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Параметры запроса, которые не влияют на набор товаров (настройки выполнения).
+# От ключа зависит и файл контрольной точки, поэтому повтор с другим сроком
+# "deadline_ms" продолжает тот же обход; обрезанный по сроку итог не кэшируется.
+IGNORED_PARAMS = {'threads', 'detail_workers', 'concurrency', 'per_host', 'background', 'max_age', 'no_cache',
+                  'resume', 'deadline_ms'}
+
+def request_key(data):
+    """Нормализованный ключ запроса на парсинг
+
+    URL без завершающего слеша, страницы числами, остальные значимые
+    параметры - в отсортированном JSON.
+    """
+    url = str(data.get('url', 'https://dental-first.ru/catalog')).strip().rstrip('/')
+    start_page = int(data.get('start_page', 1))
+    end_page = int(data.get('end_page', 3))
+    extra = {k: v for k, v in data.items()
+             if k not in IGNORED_PARAMS and k not in ('url', 'start_page', 'end_page')}
+    return f"{url}|{start_page}|{end_page}|{json.dumps(extra, sort_keys=True, ensure_ascii=False)}"
+
+class ResultCache:
+    """LRU-кэш сводок завершенных задач с TTL"""
+
+    def __init__(self, max_items=64, ttl=300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, max_age=None):
+        """Сводка не старше min(ttl, max_age) секунд или None"""
+        limit = self.ttl if max_age is None else min(self.ttl, float(max_age))
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            stored_at, summary = item
+            age = time.time() - stored_at
+            if age > self.ttl:
+                del self.items[key]
+                return None
+            if age > limit:
+                return None
+            self.items.move_to_end(key)
+            return dict(summary, cached=True, cache_age=round(age, 2))
+
+    def put(self, key, summary):
+        """Сохранение сводки завершенной задачи"""
+        with self.lock:
+            self.items[key] = (time.time(), summary)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
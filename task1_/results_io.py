@@ -0,0 +1,237 @@
+# Запись и чтение файлов результатов
+import mmap
+import os
+import threading
+from array import array
+
+from serialization import get_codec
+
+# Каталог с полными списками товаров по задачам
+RESULTS_DIR = 'results'
+
+# Сколько файлов товаров хранится на сервер (префикс имени файла): более
+# старые удаляются при записи нового. Столько же задач помнит JobRegistry
+KEEP_PRODUCT_FILES = 100
+
+# Расширение файла товаров -> кодек
+PRODUCT_FORMATS = {
+    '.jsonl': None,  # быстрый доступный JSON
+    '.msgpack': 'msgpack',
+}
+
+def write_json_atomic(path, data):
+    """Запись JSON через временный файл и os.replace
+
+    Читатель видит либо старый, либо полностью записанный файл.
+    Кодирует самый быстрый доступный JSON-кодек, без отступов.
+    Временный файл уникален: одновременные задачи пишут один и тот же
+    файл результатов, побеждает последняя.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(get_codec().dumps(data))
+    os.replace(tmp_path, path)
+
+def products_codec(path):
+    """Кодек файла товаров по его расширению"""
+    return get_codec(PRODUCT_FORMATS.get(os.path.splitext(path)[1]))
+
+def products_path(server, job_id, fmt='jsonl'):
+    """Путь к полному списку товаров задачи (fmt - 'jsonl' или 'msgpack')"""
+    if f".{fmt}" not in PRODUCT_FORMATS:
+        raise ValueError(f"Неизвестный формат файла товаров: {fmt}")
+    return os.path.join(RESULTS_DIR, f"{server}_{job_id}.{fmt}")
+
+def index_path(path):
+    """Файл смещений товаров рядом с файлом товаров"""
+    return f"{path}.idx"
+
+def write_products(path, products):
+    """Запись всех товаров: JSON Lines или подряд идущие объекты MessagePack
+
+    Рядом пишется индекс - смещения начала каждого товара и конца файла
+    (uint64), чтобы читать любой срез без разбора всего файла.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    codec = products_codec(path)
+    dumps = codec.dumps
+    offsets = array('Q', [0])
+    position = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for product in products:
+            data = dumps(product)
+            if codec.text:
+                data += b'\n'
+            f.write(data)
+            position += len(data)
+            offsets.append(position)
+
+    tmp_index = f"{index_path(path)}.tmp"
+    with open(tmp_index, 'wb') as f:
+        offsets.tofile(f)
+    os.replace(tmp_index, index_path(path))
+    os.replace(tmp_path, path)
+    prune_products(path)
+
+def prune_products(path, keep=KEEP_PRODUCT_FILES):
+    """Удаление старых файлов товаров того же сервера, кроме keep новейших
+
+    Сервер - часть имени до первого "_" (async, threaded, front); файлы
+    других серверов в том же каталоге не трогаются.
+    """
+    directory = os.path.dirname(path) or '.'
+    prefix = os.path.basename(path).split('_', 1)[0] + '_'
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.startswith(prefix) and os.path.splitext(entry.name)[1] in PRODUCT_FORMATS:
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+    files.sort(reverse=True)
+    for _, old in files[keep:]:
+        for name in (old, index_path(old)):
+            try:
+                os.remove(name)
+            except OSError:
+                pass  # уже удален соседней задачей
+
+def iter_product_batches(path, batch_size=10000):
+    """Потоковое чтение товаров пачками по batch_size"""
+    codec = products_codec(path)
+    batch = []
+    with open(path, 'rb') as f:
+        if codec.text:
+            loads = codec.loads
+            items = (loads(line) for line in f if line.strip())
+        else:
+            items = codec.iter_stream(f)
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def load_results(path):
+    """Чтение сводного файла результатов"""
+    with open(path, 'rb') as f:
+        return get_codec().loads(f.read())
+
+def read_summary(path):
+    """Сводка задачи без разбора списка товаров
+
+    Серверы пишут компактный JSON с ключом "products" последним, поэтому
+    сводка - все до ,"products":[ (внутри строк кавычки экранированы и
+    такая последовательность встретиться не может). Старые файлы
+    читаются целиком, вместе с сохраненными первыми товарами.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.find(b',"products":[')
+            if pos > 0:
+                return get_codec().loads(mm[:pos] + b'}')
+            return get_codec().loads(mm[:])
+
+class ProductReader:
+    """Срезы файла товаров через mmap и индекс смещений
+
+    Разбираются только запрошенные товары. Для файлов без индекса
+    смещения один раз находятся проходом по файлу.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.codec = products_codec(path)
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.offsets = self.load_index(size)
+
+    def load_index(self, size):
+        offsets = array('Q')
+        try:
+            with open(index_path(self.path), 'rb') as f:
+                offsets.frombytes(f.read())
+            if offsets and offsets[-1] == size:
+                return offsets
+        except OSError:
+            pass
+        return self.build_index()
+
+    def build_index(self):
+        """Смещения записей проходом по файлу"""
+        offsets = array('Q', [0])
+        if self.codec.text:
+            position = 0
+            for line in iter(self.mm.readline, b'') if self.mm else ():
+                position += len(line)
+                if line.strip():
+                    offsets.append(position)
+            return offsets
+        unpacker = self.codec.msgpack.Unpacker(raw=False, strict_map_key=False)
+        unpacker.feed(self.mm[:])
+        for _ in unpacker:
+            offsets.append(unpacker.tell())
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read(self, offset=0, limit=100):
+        """Товары [offset, offset + limit)"""
+        offset = max(0, offset)
+        end = min(len(self), offset + max(0, limit))
+        loads = self.codec.loads
+        offsets = self.offsets
+        mm = self.mm
+        return [loads(mm[offsets[i]:offsets[i + 1]]) for i in range(offset, end)]
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_products_page(summary, offset=0, limit=100):
+    """(всего товаров, срез) по сводке задачи
+
+    Без products_file (старые результаты) - срез сохраненных первых товаров.
+    """
+    products_file = summary.get('products_file')
+    if products_file and os.path.exists(products_file):
+        with ProductReader(products_file) as reader:
+            return len(reader), reader.read(offset, limit)
+    products = summary.get('products') or []
+    return len(products), products[max(0, offset):max(0, offset) + max(0, limit)]
+
+# Больше товаров за один запрос /results не отдается
+MAX_PAGE_LIMIT = 1000
+
+def parse_page_params(get):
+    """Разбор offset/limit запроса /results; get(name) -> строка или None"""
+    offset = int(get('offset') or 0)
+    limit = int(get('limit') or 100)
+    if offset < 0 or not 0 <= limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f'offset должен быть >= 0, limit - 0..{MAX_PAGE_LIMIT}')
+    return offset, limit
+
+def results_page(summary, offset=0, limit=100):
+    """Ответ /results: сводка без списка товаров и запрошенный срез"""
+    total, products = read_products_page(summary, offset, limit)
+    return {
+        'summary': {k: v for k, v in summary.items() if k != 'products'},
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'products': products
+    }
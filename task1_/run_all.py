@@ -3,19 +3,52 @@ import subprocess
 import time
 import sys
 import os
-import threading
 import signal
-import requests
 import json
 import socket
+import urllib.request
 from pathlib import Path
 
+from log_pump import LogPump
+from price_history import history_path
+from results_io import read_summary, read_products_page
+from resource_usage import ProcessSampler, efficiency, pid_for_port, usage_rows
+
+# Соответствие пакетов pip и имен модулей для импорта
+DEPENDENCIES = {
+    'aiohttp': 'aiohttp',
+    'beautifulsoup4': 'bs4',
+    'requests': 'requests',
+    'psutil': 'psutil',
+    'lxml': 'lxml',
+}
+
+# Сколько серверы ждут текущие задачи при остановке (--drain-timeout по умолчанию)
+DRAIN_TIMEOUT = 10
+
+# Режим фронт-прокси: первый порт пула серверов и порт прокси
+POOL_BASE_PORT = 8100
+FRONT_PORT = 8090
+
+# Рабочие каталоги серверов пула: у каждого свои *_results.json,
+# results/, checkpoints/ и history/
+POOL_DIR = 'pool'
+
+# Серверы пула: (тип, скрипт, имя для вывода)
+POOL_SERVERS = (
+    ('async', 'async_server.py', 'Асинхронный'),
+    ('threaded', 'threaded_server.py', 'Многопоточный'),
+)
+
 class AllInOneSystem:
-    def __init__(self):
+    def __init__(self, log_dir=None):
         self.processes = []
+        self.server_processes = {}  # 'async'/'threaded' -> процесс для замера ресурсов
+        self.pool = []  # серверы пула в режиме фронт-прокси
         self.async_port = 8080
         self.threaded_port = 8081
         self.running = True
+        self.log_pump = LogPump(log_dir=log_dir)
         signal.signal(signal.SIGINT, self.signal_handler)
         
     def signal_handler(self, signum, frame):
@@ -36,15 +69,13 @@ class AllInOneSystem:
         """Установка зависимостей"""
         print("Проверка зависимостей...")
         
-        deps = ['aiohttp', 'beautifulsoup4', 'requests', 'psutil', 'lxml']
-        
         try:
-            import importlib
-            for dep in deps:
-                try:
-                    importlib.import_module(dep.replace('-', '_'))
+            import importlib.util
+            for dep, module in DEPENDENCIES.items():
+                # find_spec только ищет модуль, не импортируя его
+                if importlib.util.find_spec(module) is not None:
                     print(f"   {dep} - OK")
-                except ImportError:
+                else:
                     print(f"   Устанавливаю {dep}...")
                     subprocess.check_call([sys.executable, "-m", "pip", "install", dep, "--quiet"])
                     print(f"   {dep} установлен")
@@ -55,7 +86,68 @@ class AllInOneSystem:
             print(f"Ошибка установки: {e}")
             return False
     
-    def start_async_server(self):
+    def spawn_server(self, name, script, port, log_name=None, extra_args=None, cwd=None):
+        """Запуск процесса сервера без ожидания готовности
+        
+        cwd - рабочий каталог процесса (файлы результатов пишутся в него).
+        """
+        # -u отключает буферизацию вывода, иначе строки приходят пачками
+        cmd = [sys.executable, "-u", os.path.abspath(script), "--port", str(port)] + list(extra_args or [])
+        env = dict(os.environ, PYTHONIOENCODING='utf-8')
+        
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=cwd
+        )
+        
+        self.processes.append((f"{name} сервер", process))
+        
+        # Вывод читает общий мультиплексор
+        self.log_pump.add(name, process, log_name=log_name)
+        
+        return process
+    
+    def probe_ready(self, port):
+        """Один запрос к /ready"""
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}/ready", timeout=0.5) as response:
+                return response.status == 200
+        except Exception:
+            return False
+    
+    def wait_ready(self, servers, timeout=15.0):
+        """Ожидание готовности серверов с короткой экспоненциальной паузой
+        
+        servers - словарь {имя: (порт, процесс)}. Возвращает {имя: True/False}.
+        """
+        status = {name: False for name in servers}
+        pending = dict(servers)
+        delay = 0.02
+        deadline = time.monotonic() + timeout
+        
+        while pending and time.monotonic() < deadline:
+            for name, (port, process) in list(pending.items()):
+                if self.probe_ready(port):
+                    status[name] = True
+                    del pending[name]
+                elif process.poll() is not None:
+                    # Процесс завершился - ждать бессмысленно
+                    print(f"{name} сервер завершился с кодом {process.returncode}")
+                    del pending[name]
+            
+            if pending:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+        
+        for name in pending:
+            print(f"{name} сервер не ответил на /ready за {timeout:.0f} сек")
+        
+        return status
+    
+    def start_async_server(self, wait=True):
         """Запуск асинхронного сервера"""
         print(f"Запуск асинхронного сервера на порту {self.async_port}...")
         
@@ -65,51 +157,27 @@ class AllInOneSystem:
             self.async_port = 8082
             if not self.check_port(self.async_port):
                 print("Не удалось найти свободный порт для асинхронного сервера")
-                return False
+                return None
         
         # Запускаем сервер в отдельном процессе
-        cmd = [sys.executable, "async_server.py", "--port", str(self.async_port)]
-        
         try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+            process = self.spawn_server(
+                "Асинхронный", "async_server.py", self.async_port, log_name="async"
             )
-            
-            self.processes.append(("Асинхронный сервер", process))
-            
-            # Читаем вывод в отдельном потоке
-            threading.Thread(
-                target=self.read_output, 
-                args=(process, "Асинхронный"),
-                daemon=True
-            ).start()
-            
-            # Даем время на запуск
-            time.sleep(3)
-            
-            # Проверяем запуск
-            try:
-                response = requests.get(f"http://localhost:{self.async_port}", timeout=2)
-                if response.status_code == 200:
-                    print(f"Асинхронный сервер запущен: http://localhost:{self.async_port}")
-                    return True
-            except:
-                # Сервер может быть еще запускается
-                print(f"Асинхронный сервер запускается...")
-                time.sleep(2)
-                return True
-                
+            self.server_processes['async'] = process
         except Exception as e:
             print(f"Ошибка запуска асинхронного сервера: {e}")
+            return None
         
-        return False
+        if wait:
+            ready = self.wait_ready({"Асинхронный": (self.async_port, process)})
+            if not ready["Асинхронный"]:
+                return None
+            print(f"Асинхронный сервер запущен: http://localhost:{self.async_port}")
+        
+        return process
     
-    def start_threaded_server(self):
+    def start_threaded_server(self, wait=True):
         """Запуск многопоточного сервера"""
         print(f"Запуск многопоточного сервера на порту {self.threaded_port}...")
         
@@ -119,92 +187,183 @@ class AllInOneSystem:
             self.threaded_port = 8083
             if not self.check_port(self.threaded_port):
                 print("Не удалось найти свободный порт для многопоточного сервера")
-                return False
+                return None
         
         # Запускаем сервер в отдельном процессе
-        cmd = [sys.executable, "threaded_server.py", "--port", str(self.threaded_port)]
-        
         try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+            process = self.spawn_server(
+                "Многопоточный", "threaded_server.py", self.threaded_port, log_name="threaded"
             )
-            
-            self.processes.append(("Многопоточный сервер", process))
-            
-            # Читаем вывод в отдельном потоке
-            threading.Thread(
-                target=self.read_output, 
-                args=(process, "Многопоточный"),
-                daemon=True
-            ).start()
-            
-            # Даем время на запуск
-            time.sleep(3)
-            
-            # Проверяем запуск
-            try:
-                response = requests.get(f"http://localhost:{self.threaded_port}", timeout=2)
-                if response.status_code == 200:
-                    print(f"Многопоточный сервер запущен: http://localhost:{self.threaded_port}")
-                    return True
-            except:
-                print(f"Многопоточный сервер запускается...")
-                time.sleep(2)
-                return True
-                
+            self.server_processes['threaded'] = process
         except Exception as e:
             print(f"Ошибка запуска многопоточного сервера: {e}")
+            return None
+        
+        if wait:
+            ready = self.wait_ready({"Многопоточный": (self.threaded_port, process)})
+            if not ready["Многопоточный"]:
+                return None
+            print(f"Многопоточный сервер запущен: http://localhost:{self.threaded_port}")
         
-        return False
+        return process
     
-    def read_output(self, process, name):
-        """Чтение вывода процесса"""
-        try:
-            while self.running:
-                output = process.stdout.readline()
-                if output:
-                    print(f"[{name}] {output.strip()}")
-                time.sleep(0.1)
-        except:
-            pass
+    def start_servers(self):
+        """Параллельный запуск обоих серверов
+        
+        Оба процесса стартуют сразу, затем готовность опрашивается
+        одновременно. Возвращает (async_ok, threaded_ok).
+        """
+        started = time.monotonic()
+        servers = {}
+        
+        async_process = self.start_async_server(wait=False)
+        if async_process:
+            servers["Асинхронный"] = (self.async_port, async_process)
+        
+        threaded_process = self.start_threaded_server(wait=False)
+        if threaded_process:
+            servers["Многопоточный"] = (self.threaded_port, threaded_process)
+        
+        ready = self.wait_ready(servers)
+        for name, (port, _) in servers.items():
+            if ready[name]:
+                print(f"{name} сервер запущен: http://localhost:{port}")
+        
+        print(f"Готовность за {time.monotonic() - started:.2f} сек")
+        return ready.get("Асинхронный", False), ready.get("Многопоточный", False)
+    
+    def free_port(self, port):
+        """Первый свободный порт, начиная с port"""
+        while not self.check_port(port):
+            port += 1
+        return port
+    
+    def start_pool(self, size):
+        """Запуск size серверов каждого типа на портах от POOL_BASE_PORT"""
+        port = POOL_BASE_PORT
+        servers = {}
+        for i in range(1, size + 1):
+            for kind, script, title in POOL_SERVERS:
+                port = self.free_port(port)
+                name = f"{title} #{i}"
+                server = {'name': name, 'script': script, 'port': port, 'log_name': f"{kind}_{i}",
+                          'cwd': os.path.join(POOL_DIR, f"{kind}_{i}")}
+                # История цен остается общей для серверов одного типа
+                server['args'] = ["--history", os.path.abspath(history_path(kind))]
+                os.makedirs(server['cwd'], exist_ok=True)
+                server['process'] = self.spawn_server(name, script, port, log_name=server['log_name'],
+                                                      extra_args=server['args'], cwd=server['cwd'])
+                self.pool.append(server)
+                servers[name] = (port, server['process'])
+                port += 1
+        
+        ready = self.wait_ready(servers)
+        print(f"Серверов пула готово: {sum(ready.values())} из {len(servers)}")
+        return [f"http://localhost:{server['port']}" for server in self.pool if ready[server['name']]]
+    
+    def supervise_pool(self):
+        """Перезапуск упавших серверов пула на тех же портах
+        
+        Прокси сам снимает упавший сервер с балансировки и возвращает
+        его после успешной проверки здоровья.
+        """
+        for server in self.pool:
+            process = server['process']
+            if process.poll() is None:
+                continue
+            print(f"{server['name']} сервер завершился с кодом {process.returncode}, перезапуск...")
+            self.processes = [(n, p) for n, p in self.processes if p is not process]
+            server['process'] = self.spawn_server(
+                server['name'], server['script'], server['port'], log_name=server['log_name'],
+                extra_args=server['args'], cwd=server['cwd']
+            )
+    
+    def run_front(self, pool_size=2, front_port=FRONT_PORT, shard_pages=5):
+        """Режим фронт-прокси: пул серверов и один публичный /parse
+        
+        Большие диапазоны страниц прокси режет на шарды и раздает наименее
+        загруженным серверам пула; лаунчер следит за процессами пула.
+        """
+        print("="*60)
+        print(f"ФРОНТ-ПРОКСИ: ПУЛ ИЗ {pool_size} СЕРВЕРОВ КАЖДОГО ТИПА")
+        print("="*60)
+        
+        self.install_dependencies()
+        backends = self.start_pool(pool_size)
+        if not backends:
+            print("Не удалось запустить серверы пула")
+            self.stop_all()
+            return
+        
+        front_port = self.free_port(front_port)
+        args = ["--shard-pages", str(shard_pages)]
+        for url in backends:
+            args += ["--backend", url]
+        process = self.spawn_server("Фронт-прокси", "front_proxy.py", front_port,
+                                    log_name="front", extra_args=args)
+        if not self.wait_ready({"Фронт-прокси": (front_port, process)})["Фронт-прокси"]:
+            self.stop_all()
+            return
+        
+        print(f"\nПрокси: http://localhost:{front_port}/parse (состояние пула: /status)")
+        print('curl -X POST http://localhost:%d/parse -d \'{"end_page":20,"shard_pages":5}\'' % front_port)
+        print("Ctrl+C - остановка")
+        
+        # Ctrl+C обрабатывает signal_handler: stop_all и выход
+        while self.running:
+            time.sleep(1)
+            self.supervise_pool()
+    
+    def show_logs(self, count=30):
+        """Показать последние строки журналов серверов"""
+        entries = self.log_pump.recent(count)
+        print(f"\nЖУРНАЛ СЕРВЕРОВ (последние {len(entries)} строк):")
+        if not entries:
+            print("   Журнал пуст")
+        for stamp, tag, line in entries:
+            print(f"   {stamp} [{tag}] {line}")
     
     def run_test(self, pages=2):
         """Запуск тестового парсинга"""
         print(f"\nЗапуск тестового парсинга ({pages} страниц)...")
         
-        # Даем серверам время на полный запуск
-        time.sleep(5)
-        
         results = {}
+        usage = {}
         
-        # Тест асинхронного сервера
+        # Тест асинхронного сервера; процесс сервера замеряется все время теста
         print(f"\n1. Тестирование асинхронного сервера...")
-        async_result = self.test_async_server(pages)
+        with ProcessSampler(self.server_pid('async', self.async_port)) as sampler:
+            async_result = self.test_async_server(pages)
+        usage['async'] = sampler.usage
         if async_result:
             results['async'] = async_result
         
-        # Ждем между тестами
-        time.sleep(3)
-        
         # Тест многопоточного сервера
         print(f"\n2. Тестирование многопоточного сервера...")
-        threaded_result = self.test_threaded_server(pages)
+        with ProcessSampler(self.server_pid('threaded', self.threaded_port)) as sampler:
+            threaded_result = self.test_threaded_server(pages)
+        usage['threaded'] = sampler.usage
         if threaded_result:
             results['threaded'] = threaded_result
         
         # Сравниваем результаты
         if results.get('async') and results.get('threaded'):
-            self.compare_results(results['async'], results['threaded'])
+            self.compare_results(results['async'], results['threaded'], usage, pages)
         
         return results
     
+    def server_pid(self, name, port):
+        """PID сервера: запущенного лаунчером (если он еще работает) или найденного по порту"""
+        process = self.server_processes.get(name)
+        if process is not None and process.poll() is None:
+            return process.pid
+        # Завершившийся процесс: его PID мог достаться другому
+        self.server_processes.pop(name, None)
+        return pid_for_port(port)
+    
     def test_async_server(self, pages):
         """Тестирование асинхронного сервера"""
+        import requests
         try:
             print(f"   Отправка запроса на парсинг {pages} страниц...")
             
@@ -227,12 +386,13 @@ class AllInOneSystem:
                 
                 # Читаем результаты из файла
                 if os.path.exists("async_results.json"):
-                    with open("async_results.json", "r", encoding="utf-8") as f:
-                        data = json.load(f)
+                    data = read_summary("async_results.json")
                     print(f"   Товаров: {data.get('total_products', 0)}")
                     print(f"   Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
                 
                 return result
+            elif response.status_code == 429:
+                print(f"   Сервер перегружен, повторите через {response.headers.get('Retry-After', '?')} сек")
             else:
                 print(f"   Ошибка: HTTP {response.status_code}")
                 
@@ -243,6 +403,7 @@ class AllInOneSystem:
     
     def test_threaded_server(self, pages):
         """Тестирование многопоточного сервера"""
+        import requests
         try:
             print(f"   Отправка запроса на парсинг {pages} страниц...")
             
@@ -260,60 +421,53 @@ class AllInOneSystem:
             )
             
             if response.status_code == 202:
-                print("   Парсинг запущен в фоновом режиме...")
-                print("   Ожидаю 15 секунд...")
+                job_id = response.json()['job_id']
+                print(f"   Парсинг запущен в фоновом режиме (задача {job_id})...")
                 
-                # Ждем завершения
-                for i in range(15):
-                    if os.path.exists("threaded_results.json"):
-                        time.sleep(1)  # Даем время на запись
-                        try:
-                            with open("threaded_results.json", "r", encoding="utf-8") as f:
-                                data = json.load(f)
-                            
-                            if 'error' not in data:
-                                print("   Завершено:")
-                                print(f"      Товаров: {data.get('total_products', 0)}")
-                                print(f"      Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
-                                print(f"      Потоков: {data.get('threads_used', 0)}")
-                                print(f"      Время: {data.get('execution_time', 0):.2f} сек")
-                                return data
-                        except:
-                            pass
-                    time.sleep(1)
-                
-                print("   Время ожидания истекло")
+                # Сервер отвечает в момент завершения (long-poll)
+                job = self.wait_for_job(self.threaded_port, job_id)
+                if job is None:
+                    print("   Время ожидания истекло")
+                elif job['status'] == 'error':
+                    print(f"   Ошибка парсинга: {job.get('error')}")
+                else:
+                    data = job['result']
+                    print("   Завершено:")
+                    print(f"      Товаров: {data.get('total_products', 0)}")
+                    print(f"      Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
+                    print(f"      Потоков: {data.get('threads_used', 0)}")
+                    print(f"      Время: {data.get('execution_time', 0):.2f} сек")
+                    return data
                 
+            elif response.status_code == 429:
+                print(f"   Сервер перегружен, повторите через {response.headers.get('Retry-After', '?')} сек")
             else:
                 print(f"   Неожиданный ответ: HTTP {response.status_code}")
                 
-        except requests.exceptions.Timeout:
-            print("   Таймаут (ожидаемо, сервер возвращает 202)")
-            print("   Проверяю файлы результатов...")
-            time.sleep(10)
-            
-            if os.path.exists("threaded_results.json"):
-                try:
-                    with open("threaded_results.json", "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    
-                    if 'error' not in data:
-                        print("   Результаты получены:")
-                        print(f"      Товаров: {data.get('total_products', 0)}")
-                        print(f"      Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
-                        return data
-                except:
-                    print("   Не удалось прочитать результаты")
-            else:
-                print("   Файл результатов не найден")
-                
         except Exception as e:
             print(f"   Ошибка: {e}")
         
         return None
     
-    def compare_results(self, async_result, threaded_result):
-        """Сравнение результатов"""
+    def wait_for_job(self, port, job_id, timeout=300):
+        """Ожидание завершения задачи через GET /jobs/{id}?wait="""
+        import requests
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            wait = min(30, max(1, int(deadline - time.time())))
+            response = requests.get(
+                f"http://localhost:{port}/jobs/{job_id}",
+                params={'wait': wait},
+                timeout=wait + 5
+            )
+            response.raise_for_status()
+            job = response.json()
+            if job['status'] in ('done', 'error'):
+                return job
+        return None
+    
+    def compare_results(self, async_result, threaded_result, usage=None, pages=0):
+        """Сравнение результатов; usage - замеры ресурсов процессов серверов"""
         print("\n" + "="*60)
         print("СРАВНЕНИЕ РЕЗУЛЬТАТОВ")
         print("="*60)
@@ -324,15 +478,13 @@ class AllInOneSystem:
         
         if os.path.exists("async_results.json"):
             try:
-                with open("async_results.json", "r", encoding="utf-8") as f:
-                    async_data = json.load(f)
+                async_data = read_summary("async_results.json")
             except:
                 pass
         
         if os.path.exists("threaded_results.json"):
             try:
-                with open("threaded_results.json", "r", encoding="utf-8") as f:
-                    threaded_data = json.load(f)
+                threaded_data = read_summary("threaded_results.json")
             except:
                 pass
         
@@ -363,9 +515,25 @@ class AllInOneSystem:
         threads_used = threaded_data.get('threads_used', 0)
         print(f"{'Потоков':<25} {'-':<15} {threads_used:<15} {'-'}")
         
+        # Ресурсы процессов за время теста
+        usage = usage or {}
+        async_side = {
+            'usage': usage.get('async'),
+            'efficiency': efficiency(usage.get('async'), pages, async_products)
+        }
+        threaded_side = {
+            'usage': usage.get('threaded'),
+            'efficiency': efficiency(usage.get('threaded'), pages, threaded_products)
+        }
+        if async_side['usage'] or threaded_side['usage']:
+            print("-"*65)
+            for label, async_value, threaded_value in usage_rows(async_side, threaded_side):
+                print(f"{label:<25} {str(async_value):<15} {str(threaded_value):<15}")
+        
         # Сохраняем отчет
         report = {
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'pages': pages,
             'ports': {
                 'async': self.async_port,
                 'threaded': self.threaded_port
@@ -373,13 +541,17 @@ class AllInOneSystem:
             'async_server': {
                 'products': async_products,
                 'total_price': async_price,
-                'execution_time': async_time
+                'execution_time': async_time,
+                'resources': async_side['usage'],
+                'efficiency': async_side['efficiency']
             },
             'threaded_server': {
                 'products': threaded_products,
                 'total_price': threaded_price,
                 'execution_time': threaded_time,
-                'threads_used': threads_used
+                'threads_used': threads_used,
+                'resources': threaded_side['usage'],
+                'efficiency': threaded_side['efficiency']
             },
             'comparison': {
                 'products_difference': prod_diff,
@@ -404,83 +576,90 @@ class AllInOneSystem:
         print("4. Показать результаты")
         print("5. Экспорт в CSV")
         print("6. Остановить все и выйти")
+        print("7. Показать журнал серверов")
         print("="*60)
         
         try:
-            choice = input("Выберите действие (1-6): ").strip()
+            choice = input("Выберите действие (1-7): ").strip()
             return choice
         except KeyboardInterrupt:
             return '6'
         except:
             return '6'
     
+    def fetch_results(self, port, job='latest', offset=0, limit=3):
+        """Страница результатов с сервера (GET /results) или None"""
+        url = f"http://localhost:{port}/results/{job}?offset={offset}&limit={limit}"
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return json.loads(response.read())
+        except Exception:
+            return None
+    
+    def read_results_page(self, port, filename, limit=3):
+        """Сводка и первые товары: с сервера, иначе из файлов через индекс"""
+        page = self.fetch_results(port, limit=limit)
+        if page:
+            return page['summary'], page['products']
+        if not os.path.exists(filename):
+            return None, []
+        summary = read_summary(filename)
+        _, products = read_products_page(summary, 0, limit)
+        return summary, products
+    
     def show_results(self):
         """Показать результаты"""
         print("\nРЕЗУЛЬТАТЫ:")
         
-        for name, filename in [("Асинхронный", "async_results.json"), 
-                               ("Многопоточный", "threaded_results.json")]:
-            if os.path.exists(filename):
-                try:
-                    with open(filename, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    
-                    print(f"\n{name}:")
-                    print(f"   Товаров: {data.get('total_products', 0)}")
-                    print(f"   Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
-                    print(f"   Время: {data.get('execution_time', 0):.2f} сек")
-                    
-                    if 'threads_used' in data:
-                        print(f"   Потоков: {data.get('threads_used')}")
-                    
-                    # Примеры товаров
-                    products = data.get('products', [])[:3]
-                    if products:
-                        print("   Примеры:")
-                        for i, p in enumerate(products, 1):
-                            name_short = p.get('name', '')[:50]
-                            if len(p.get('name', '')) > 50:
-                                name_short += '...'
-                            print(f"      {i}. {p.get('price', 0):,} руб - {name_short}".replace(',', ' '))
-                    
-                except Exception as e:
-                    print(f"   Ошибка чтения {filename}: {e}")
-            else:
-                print(f"\n{name}: файл не найден")
+        for name, filename, port in [("Асинхронный", "async_results.json", self.async_port), 
+                                     ("Многопоточный", "threaded_results.json", self.threaded_port)]:
+            try:
+                data, products = self.read_results_page(port, filename)
+                if data is None:
+                    print(f"\n{name}: файл не найден")
+                    continue
+                
+                print(f"\n{name}:")
+                print(f"   Товаров: {data.get('total_products', 0)}")
+                print(f"   Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
+                print(f"   Время: {data.get('execution_time', 0):.2f} сек")
+                
+                if 'threads_used' in data:
+                    print(f"   Потоков: {data.get('threads_used')}")
+                
+                # Примеры товаров
+                if products:
+                    print("   Примеры:")
+                    for i, p in enumerate(products, 1):
+                        name_short = p.get('name', '')[:50]
+                        if len(p.get('name', '')) > 50:
+                            name_short += '...'
+                        print(f"      {i}. {p.get('price', 0):,} руб - {name_short}".replace(',', ' '))
+                
+            except Exception as e:
+                print(f"   Ошибка чтения {filename}: {e}")
     
     def export_to_csv(self):
-        """Экспорт в CSV"""
-        print("\nЭКСПОРТ В CSV:")
+        """Экспорт всех товаров в CSV (или Parquet/Arrow)"""
+        print("\nЭКСПОРТ:")
         
         try:
-            import csv
-        except:
-            print("Не удалось импортировать модуль csv")
+            fmt = input("Формат (csv/parquet/arrow) [csv]: ").strip().lower() or 'csv'
+        except Exception:
+            fmt = 'csv'
+        
+        import export
+        if fmt not in export.FORMATS:
+            print(f"Неизвестный формат: {fmt}")
             return
         
         for name, filename in [("async", "async_results.json"), 
                                ("threaded", "threaded_results.json")]:
             if os.path.exists(filename):
                 try:
-                    with open(filename, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    
-                    csv_filename = f"{name}_results.csv"
-                    products = data.get('products', [])
-                    
-                    with open(csv_filename, 'w', newline='', encoding='utf-8-sig') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['Название', 'Цена (руб)', 'Артикул', 'Время парсинга'])
-                        
-                        for product in products:
-                            writer.writerow([
-                                product.get('name', ''),
-                                product.get('price', 0),
-                                product.get('label', ''),
-                                data.get('timestamp', '')
-                            ])
-                    
-                    print(f"{name}: {len(products)} товаров -> {csv_filename}")
+                    output = f"{name}_results{export.FORMATS[fmt][0]}"
+                    output, count = export.export_results(filename, fmt, output)
+                    print(f"{name}: {count} товаров -> {output}")
                     
                 except Exception as e:
                     print(f"Ошибка экспорта {filename}: {e}")
@@ -491,11 +670,17 @@ class AllInOneSystem:
         """Остановить все процессы"""
         print("\nОстановка системы...")
         
+        # Сначала SIGTERM всем: серверы дорабатывают задачи параллельно
         for name, process in self.processes:
             try:
                 print(f"   Останавливаю {name}...")
                 process.terminate()
-                process.wait(timeout=2)
+            except:
+                pass
+        
+        for name, process in self.processes:
+            try:
+                process.wait(timeout=DRAIN_TIMEOUT + 2)
                 print(f"   {name} остановлен")
             except:
                 try:
@@ -505,6 +690,9 @@ class AllInOneSystem:
                     print(f"   Не удалось остановить {name}")
         
         self.processes.clear()
+        self.server_processes.clear()
+        self.pool.clear()
+        self.log_pump.stop()
         print("Все процессы остановлены")
     
     def run(self):
@@ -527,8 +715,7 @@ class AllInOneSystem:
                 print("="*60)
                 
                 # Запускаем серверы
-                async_ok = self.start_async_server()
-                threaded_ok = self.start_threaded_server()
+                async_ok, threaded_ok = self.start_servers()
                 servers_started = async_ok or threaded_ok
                 
                 if servers_started:
@@ -539,8 +726,7 @@ class AllInOneSystem:
             
             elif choice == '2':
                 print("\nЗАПУСК СЕРВЕРОВ")
-                async_ok = self.start_async_server()
-                threaded_ok = self.start_threaded_server()
+                async_ok, threaded_ok = self.start_servers()
                 servers_started = async_ok or threaded_ok
                 
                 if servers_started:
@@ -567,6 +753,9 @@ class AllInOneSystem:
             elif choice == '5':
                 self.export_to_csv()
             
+            elif choice == '7':
+                self.show_logs()
+            
             elif choice == '6':
                 print("\nЗавершение работы...")
                 if servers_started:
@@ -586,9 +775,25 @@ class AllInOneSystem:
 
 def main():
     """Точка входа"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Система парсинга Dental-First')
+    parser.add_argument('--log-dir', default=None,
+                        help='Каталог для ротируемых логов серверов')
+    parser.add_argument('--front', action='store_true',
+                        help='Режим фронт-прокси: пул серверов за одним /parse')
+    parser.add_argument('--pool', type=int, default=2,
+                        help='Серверов каждого типа в пуле (с --front)')
+    parser.add_argument('--front-port', type=int, default=FRONT_PORT, help='Порт фронт-прокси')
+    parser.add_argument('--shard-pages', type=int, default=5,
+                        help='Страниц в одном шарде (с --front)')
+    args = parser.parse_args()
+    
     try:
-        system = AllInOneSystem()
-        system.run()
+        system = AllInOneSystem(log_dir=args.log_dir)
+        if args.front:
+            system.run_front(args.pool, args.front_port, args.shard_pages)
+        else:
+            system.run()
     except KeyboardInterrupt:
         print("\n\nПрограмма завершена")
     except Exception as e:
@@ -0,0 +1,349 @@
+# Полнотекстовый поиск товаров: инвертированный индекс по названиям и меткам
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import islice
+
+from dedup import normalize, product_key
+from product_store import get_numpy
+
+_word = re.compile(r'\w+')
+
+# Окончания русских слов; отбрасывается самое длинное, основа не короче 3 букв
+SUFFIXES = (
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ов', 'ев',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ия', 'ию', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+)
+_suffix_lengths = sorted({len(s) for s in SUFFIXES}, reverse=True)
+_suffixes = frozenset(SUFFIXES)
+
+MIN_STEM = 3
+
+MAX_SEARCH_LIMIT = 1000
+
+# С такого числа документов терм хранит и битовую карту
+DENSE = 1024
+
+# Товаров истории цен за один захват блокировки при начальной загрузке
+SEED_CHUNK = 200
+
+@lru_cache(maxsize=1 << 16)
+def stem(word):
+    """Упрощенный стемминг: отбрасывание одного окончания"""
+    for length in _suffix_lengths:
+        if len(word) - length >= MIN_STEM and word[-length:] in _suffixes:
+            return word[:-length]
+    return word
+
+def tokenize(text):
+    """Слова строки после нормализации (регистр, ё -> е)"""
+    return _word.findall(normalize(text))
+
+def terms(text):
+    """Термы индекса: основы слов"""
+    return {stem(word) for word in tokenize(text)}
+
+_nonzero = re.compile(rb'[^\x00]')
+
+# Номера установленных битов для каждого значения байта
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+def price_bounds():
+    """Нижние границы ценовых корзин: круглые цены 1-1.2-1.5-2-2.5-3-4-...-9 на порядок
+
+    Фильтр с круглыми границами (500, 1500, 20000) совпадает с
+    границами корзин и не требует поштучной проверки цен.
+    """
+    steps = (10, 12, 15, 20, 25, 30, 40, 50, 60, 70, 80, 90)
+    return [0] + sorted({step * 10 ** power // 10 for power in range(11) for step in steps})
+
+PRICE_BOUNDS = price_bounds()
+
+def price_bucket(price):
+    return max(0, bisect_right(PRICE_BOUNDS, price) - 1)
+
+def contains(posting, doc):
+    """Есть ли документ в отсортированном списке вхождений"""
+    i = bisect_left(posting, doc)
+    return i < len(posting) and posting[i] == doc
+
+def set_bit(bitmap, doc):
+    index = doc >> 3
+    if index >= len(bitmap):
+        bitmap.extend(bytes(index + 1 - len(bitmap) + 4096))
+    bitmap[index] |= 1 << (doc & 7)
+
+def clear_bit(bitmap, doc):
+    bitmap[doc >> 3] &= ~(1 << (doc & 7)) & 0xFF
+
+def iter_bits(mask):
+    """Номера установленных битов числа по возрастанию (лениво)"""
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for found in _nonzero.finditer(data):
+        base = found.start() << 3
+        for bit in BYTE_BITS[data[found.start()]]:
+            yield base + bit
+
+def bit_list(mask):
+    """Все номера установленных битов; с numpy ненулевые байты ищутся без цикла"""
+    np = get_numpy()
+    if np is None:
+        return list(iter_bits(mask))
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    docs = []
+    for index in np.flatnonzero(np.frombuffer(data, dtype=np.uint8)).tolist():
+        base = index << 3
+        docs.extend(base + bit for bit in BYTE_BITS[data[index]])
+    return docs
+
+def parse_search_params(get):
+    """Параметры /search; get(name) -> строка или None"""
+    limit = int(get('limit') or 20)
+    if not 1 <= limit <= MAX_SEARCH_LIMIT:
+        raise ValueError(f'limit должен быть 1..{MAX_SEARCH_LIMIT}')
+    if not tokenize(get('q') or ''):
+        raise ValueError('q: нужно хотя бы одно слово')
+    min_price = get('min_price')
+    max_price = get('max_price')
+    return {
+        'q': get('q'),
+        'limit': limit,
+        'min_price': int(min_price) if min_price else None,
+        'max_price': int(max_price) if max_price else None,
+    }
+
+class SearchIndex:
+    """Инвертированный индекс товаров, пополняемый по мере разбора страниц
+
+    Документ - товар (ключ dedup.product_key): повторная встреча обновляет
+    цену, но не добавляет вхождений. Для каждого терма (основы слова
+    названия или метки) хранится массив номеров документов по возрастанию,
+    словарь термов отсортирован для префиксного поиска. Запрос - все
+    слова (И), последнее ищется по префиксу основы, как при вводе.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.names = []
+        self.labels = []
+        self.prices = array('q')
+        self.postings = {}   # терм -> array('i') номеров документов
+        self.bitmaps = {}    # частый терм -> bytearray, бит на документ
+        self.terms = []      # отсортированные термы
+        self.new_terms = []  # еще не вставленные в self.terms
+        # Битовые карты товаров по ценовым корзинам для фильтра по цене
+        self.price_buckets = [bytearray() for _ in PRICE_BOUNDS]
+        # Те же карты числами Python до следующего изменения индекса
+        self.term_masks = {}
+        self.price_masks = None
+        self.seeding = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, products):
+        """Добавление товаров страницы (новые - в индекс, известные - новая цена)"""
+        with self.lock:
+            for product in products:
+                self.add_one(product.get('name', ''), product.get('label', ''),
+                             int(product.get('price', 0)), product_key(product))
+
+    def add_one(self, name, label, price, key, update=True):
+        doc = self.ids.get(key)
+        if doc is not None:
+            if not update:
+                return
+            old = price_bucket(self.prices[doc])
+            if old != price_bucket(price):
+                clear_bit(self.price_buckets[old], doc)
+                set_bit(self.price_buckets[price_bucket(price)], doc)
+                self.price_masks = None
+            self.prices[doc] = price
+            return
+        self.term_masks.clear()
+        self.price_masks = None
+        doc = len(self.names)
+        self.ids[key] = doc
+        self.names.append(name)
+        self.labels.append(label)
+        self.prices.append(price)
+        set_bit(self.price_buckets[price_bucket(price)], doc)
+        for term in terms(f"{name} {label}"):
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = array('i')
+                self.new_terms.append(term)
+            posting.append(doc)
+            bitmap = self.bitmaps.get(term)
+            if bitmap is not None:
+                set_bit(bitmap, doc)
+            elif len(posting) >= DENSE:
+                bitmap = self.bitmaps[term] = bytearray()
+                for number in posting:
+                    set_bit(bitmap, number)
+
+    def add_history(self, history):
+        """Начальное заполнение из истории цен (последние цены всех товаров)
+
+        Идет порциями, чтобы поиск и разбор страниц не ждали всей загрузки.
+        """
+        self.seeding = True
+        try:
+            with history.lock:
+                rows = [(history.names[n], history.labels[n], points[-1], history.keys[n])
+                        for n, points in enumerate(history.points) if points]
+            for start in range(0, len(rows), SEED_CHUNK):
+                with self.lock:
+                    for row in rows[start:start + SEED_CHUNK]:
+                        # Цена уже разобранной за это время страницы новее истории
+                        self.add_one(*row, update=False)
+            print(f"Поиск: загружено из истории цен товаров {len(rows)}")
+        finally:
+            self.seeding = False
+
+    def prefix_terms(self, prefix):
+        if self.new_terms:
+            # Новые термы досортировываются к первому запросу, а не при каждой вставке
+            self.terms.extend(self.new_terms)
+            self.terms.sort()
+            self.new_terms = []
+        start = bisect_left(self.terms, prefix)
+        return self.terms[start:bisect_left(self.terms, prefix + '\U0010ffff', start)]
+
+    def has(self, term, doc):
+        bitmap = self.bitmaps.get(term)
+        if bitmap is None:
+            return contains(self.postings[term], doc)
+        index = doc >> 3
+        return index < len(bitmap) and bitmap[index] >> (doc & 7) & 1
+
+    def term_mask(self, term):
+        mask = self.term_masks.get(term)
+        if mask is None:
+            mask = self.term_masks[term] = int.from_bytes(self.bitmaps[term], 'little')
+        return mask
+
+    def price_below(self):
+        """below[b] - битовая карта товаров ценовых корзин младше b"""
+        if self.price_masks is None:
+            below = [0]
+            for bitmap in self.price_buckets:
+                below.append(below[-1] | int.from_bytes(bitmap, 'little') if bitmap else below[-1])
+            self.price_masks = below
+        return self.price_masks
+
+    def mask(self, clause):
+        """Битовая карта документов с любым из термов clause"""
+        result = 0
+        sparse = None
+        for term in clause:
+            if term in self.bitmaps:
+                result |= self.term_mask(term)
+                continue
+            if sparse is None:
+                sparse = bytearray((len(self.names) + 7) // 8)
+            for doc in self.postings[term]:
+                sparse[doc >> 3] |= 1 << (doc & 7)
+        return result if sparse is None else result | int.from_bytes(sparse, 'little')
+
+    def match(self, words):
+        """Документы со всеми словами запроса: список номеров или битовая карта
+
+        Каждое слово - набор термов: основа слова, для последнего - все
+        термы с этим префиксом. Если у самого редкого слова мало документов,
+        они проверяются по остальным поштучно (битовая карта или двоичный
+        поиск), иначе слова пересекаются операцией И над битовыми картами.
+        """
+        clauses = []
+        for i, word in enumerate(words):
+            if i == len(words) - 1:
+                clause = self.prefix_terms(stem(word))
+            else:
+                clause = [stem(word)] if stem(word) in self.postings else []
+            if not clause:
+                return []
+            clauses.append((sum(len(self.postings[t]) for t in clause), clause))
+        clauses.sort(key=lambda c: c[0])
+
+        size, clause = clauses[0]
+        if size < DENSE:
+            if len(clause) == 1:
+                docs = self.postings[clause[0]]
+            else:
+                docs = sorted(set().union(*(self.postings[t] for t in clause)))
+            for size, clause in clauses[1:]:
+                if len(clause) <= 4:
+                    docs = [doc for doc in docs if any(self.has(t, doc) for t in clause)]
+                else:
+                    mask = self.mask(clause)
+                    docs = [doc for doc in docs if mask >> doc & 1]
+            return docs
+
+        mask = self.mask(clause)
+        for size, clause in clauses[1:]:
+            mask &= self.mask(clause)
+        return mask
+
+    def price_mask(self, mask, low, high):
+        """Документы mask с ценой от low до high
+
+        Корзины целиком внутри диапазона берутся разностью накопленных
+        карт, в крайних корзинах, покрытых частично, цены проверяются
+        поштучно.
+        """
+        first, last = price_bucket(low), price_bucket(high)
+        edges = []
+        if first > 0 and low > PRICE_BOUNDS[first]:
+            edges.append(first)
+            first += 1
+        if last + 1 < len(PRICE_BOUNDS) and high < PRICE_BOUNDS[last + 1] - 1 and last >= first:
+            edges.append(last)
+            last -= 1
+        below = self.price_below()
+        result = mask & below[last + 1] & ~below[first] if first <= last else 0
+        if edges:
+            prices = self.prices
+            checked = bytearray((len(self.names) + 7) // 8)
+            for bucket in edges:
+                for doc in bit_list(mask & below[bucket + 1] & ~below[bucket]):
+                    if low <= prices[doc] <= high:
+                        checked[doc >> 3] |= 1 << (doc & 7)
+            result |= int.from_bytes(checked, 'little')
+        return result
+
+    def search(self, q, limit=20, min_price=None, max_price=None):
+        """Товары по запросу q с необязательным фильтром по цене"""
+        started = time.perf_counter()
+        words = tokenize(q)
+        with self.lock:
+            docs = self.match(words) if words else []
+            filtered = min_price is not None or max_price is not None
+            low = min_price if min_price is not None else -2 ** 63
+            high = max_price if max_price is not None else 2 ** 63
+            if isinstance(docs, int):
+                if filtered:
+                    docs = self.price_mask(docs, low, high)
+                total = bin(docs).count('1')  # int.bit_count() - только с Python 3.10
+                docs = iter_bits(docs)
+            else:
+                if filtered:
+                    prices = self.prices
+                    docs = [doc for doc in docs if low <= prices[doc] <= high]
+                total = len(docs)
+            products = [{'name': self.names[doc], 'price': self.prices[doc], 'label': self.labels[doc]}
+                        for doc in islice(docs, limit)]
+            return {
+                'query': q,
+                'total': total,
+                'products': products,
+                'took_ms': round((time.perf_counter() - started) * 1000, 3),
+                'indexed_products': len(self.names),
+                'terms': len(self.postings),
+                'seeding': self.seeding,
+            }
@@ -0,0 +1,181 @@
+# Кодеки для файлов результатов и ответов серверов: json, orjson, msgpack
+import json
+import time
+
+class JsonCodec:
+    """Стандартный json без отступов"""
+
+    name = 'json'
+    content_type = 'application/json; charset=utf-8'
+    text = True
+
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+class OrjsonCodec:
+    """orjson: тот же JSON, кодирование в разы быстрее"""
+
+    name = 'orjson'
+    content_type = 'application/json; charset=utf-8'
+    text = True
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj):
+        # OPT_NON_STR_KEYS - как json.dumps для словарей с числовыми ключами
+        return self.orjson.dumps(obj, option=self.orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+class MsgpackCodec:
+    """MessagePack: двоичный формат, меньше размер"""
+
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+    text = False
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, obj):
+        return self.msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    def iter_stream(self, f):
+        """Объекты, записанные в файл подряд"""
+        return iter(self.msgpack.Unpacker(f, raw=False, strict_map_key=False))
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+}
+
+MEDIA_TYPES = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+}
+
+_instances = {}
+
+def get_codec(name=None):
+    """Кодек по имени; None или 'auto' - самый быстрый доступный JSON
+
+    ImportError, если для выбранного кодека не установлен пакет.
+    """
+    if name in (None, 'auto'):
+        try:
+            return get_codec('orjson')
+        except ImportError:
+            return get_codec('json')
+    if name not in CODECS:
+        raise ValueError(f"Неизвестный кодек: {name}. Доступны: {', '.join(CODECS)}")
+    codec = _instances.get(name)
+    if codec is None:
+        codec = _instances[name] = CODECS[name]()
+    return codec
+
+def negotiate(accept):
+    """Кодек ответа по заголовку Accept (q-веса учитываются)
+
+    JSON отдается быстрым кодеком; если клиент не принимает ни JSON,
+    ни MessagePack, тоже JSON - как раньше.
+    """
+    choices = []
+    for i, part in enumerate((accept or '').split(',')):
+        media, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        name = MEDIA_TYPES.get(media.strip().lower())
+        if name and q > 0:
+            choices.append((-q, i, name))
+
+    for _, _, name in sorted(choices):
+        try:
+            return get_codec(None if name == 'json' else name)
+        except ImportError:
+            continue
+    return get_codec()
+
+def benchmark(data, names=None, repeat=5):
+    """Скорость кодирования/декодирования и размер для каждого кодека"""
+    report = []
+    for name in names or CODECS:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            report.append({'codec': name, 'error': 'не установлен'})
+            continue
+
+        encoded = codec.dumps(data)
+        encode_time = decode_time = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            codec.dumps(data)
+            encode_time = min(encode_time, time.perf_counter() - start)
+            start = time.perf_counter()
+            codec.loads(encoded)
+            decode_time = min(decode_time, time.perf_counter() - start)
+
+        mb = len(encoded) / 1024 / 1024
+        report.append({
+            'codec': name,
+            'size_bytes': len(encoded),
+            'encode_ms': round(encode_time * 1000, 2),
+            'decode_ms': round(decode_time * 1000, 2),
+            'encode_mb_s': round(mb / encode_time, 1) if encode_time else None,
+            'decode_mb_s': round(mb / decode_time, 1) if decode_time else None,
+        })
+    return report
+
+def synthetic_products(count):
+    """Товары, похожие на результаты парсинга, для замера"""
+    return [
+        {'name': f"Товар для стоматологии номер {i}", 'price': (i * 37) % 90000 + 100,
+         'label': f"ART-{i % 517}"}
+        for i in range(count)
+    ]
+
+def main():
+    """Сравнение кодеков на результатах задачи или синтетических товарах"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Замер кодеков сериализации результатов')
+    parser.add_argument('--file', help='Файл товаров задачи (results/*.jsonl)')
+    parser.add_argument('--products', type=int, default=100000, help='Число синтетических товаров')
+    parser.add_argument('--repeat', type=int, default=5, help='Повторов замера')
+    args = parser.parse_args()
+
+    if args.file:
+        from results_io import iter_product_batches
+        data = [p for batch in iter_product_batches(args.file) for p in batch]
+    else:
+        data = synthetic_products(args.products)
+
+    print(f"Товаров: {len(data)}")
+    print(f"{'Кодек':<10}{'Размер, КБ':>12}{'Запись, мс':>12}{'Чтение, мс':>12}{'Запись МБ/с':>13}{'Чтение МБ/с':>13}")
+    for row in benchmark(data, repeat=args.repeat):
+        if 'error' in row:
+            print(f"{row['codec']:<10}  {row['error']}")
+            continue
+        print(f"{row['codec']:<10}{row['size_bytes'] / 1024:>12.0f}{row['encode_ms']:>12}"
+              f"{row['decode_ms']:>12}{row['encode_mb_s']:>13}{row['decode_mb_s']:>13}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
 # Клиент для тестирования
 import requests
-import json
 import time
 import sys
 
+from resource_usage import ProcessSampler, efficiency, pid_for_port, usage_rows
+
 def test_async_server(port=8080, pages=2):
     """Тестирование асинхронного сервера"""
     print(f"\nТестирование асинхронного сервера (порт {port})...")
@@ -42,6 +43,8 @@ def test_async_server(port=8080, pages=2):
             print(f"Сумма: {result.get('total_price', 0):,} руб".replace(',', ' '))
             print(f"Время парсинга: {result.get('execution_time', 0):.2f} сек")
             return result
+        elif response.status_code == 429:
+            print(f"Сервер перегружен, повторите через {response.headers.get('Retry-After', '?')} сек")
         else:
             print(f"Ошибка: HTTP {response.status_code}")
             
@@ -83,57 +86,56 @@ def test_threaded_server(port=8081, pages=2, threads=3):
         if response.status_code == 202:
             result = response.json()
             print(f"Парсинг запущен в фоне")
-            print(f"Результаты будут в файле: {result.get('check_file', 'threaded_results.json')}")
-            
-            # Ждем и проверяем файл
-            print("Ожидаю 15 секунд...")
-            for i in range(15):
-                try:
-                    with open("threaded_results.json", "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    
-                    if 'error' not in data:
-                        print("Результаты получены:")
-                        print(f"   Товаров: {data.get('total_products', 0)}")
-                        print(f"   Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
-                        print(f"   Время: {data.get('execution_time', 0):.2f} сек")
-                        print(f"   Потоков: {data.get('threads_used', 0)}")
-                        return data
-                except:
-                    pass
-                time.sleep(1)
+            print(f"Задача: {result.get('job_id')}")
             
-            print("Время ожидания истекло")
+            # Сервер сам сообщит о завершении (long-poll)
+            job = wait_for_job(port, result['job_id'])
+            if job is None:
+                print("Время ожидания истекло")
+            elif job['status'] == 'error':
+                print(f"Ошибка парсинга: {job.get('error')}")
+            else:
+                data = job['result']
+                print("Результаты получены:")
+                print(f"   Товаров: {data.get('total_products', 0)}")
+                print(f"   Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
+                print(f"   Время: {data.get('execution_time', 0):.2f} сек")
+                print(f"   Потоков: {data.get('threads_used', 0)}")
+                return data
             
+        elif response.status_code == 429:
+            print(f"Сервер перегружен, повторите через {response.headers.get('Retry-After', '?')} сек")
         else:
             print(f"Неожиданный ответ: HTTP {response.status_code}")
             
     except requests.exceptions.Timeout:
-        print("Таймаут (ожидаемо для 202 ответа)")
-        print("Проверяю файл результатов...")
-        time.sleep(10)
-        
-        try:
-            with open("threaded_results.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            if 'error' not in data:
-                print("Результаты в файле:")
-                print(f"   Товаров: {data.get('total_products', 0)}")
-                print(f"   Сумма: {data.get('total_price', 0):,} руб".replace(',', ' '))
-                return data
-            else:
-                print(f"Ошибка в файле: {data.get('error')}")
-        except:
-            print("Файл результатов не найден или поврежден")
-            
+        print("Таймаут запроса")
     except Exception as e:
         print(f"Ошибка: {e}")
     
     return None
 
-def compare_results(async_result, threaded_result):
-    """Сравнение результатов"""
+def wait_for_job(port, job_id, timeout=300):
+    """Ожидание завершения задачи через GET /jobs/{id}?wait=
+
+    Возвращает состояние задачи или None, если время вышло.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        wait = min(30, max(1, int(deadline - time.time())))
+        response = requests.get(
+            f"http://localhost:{port}/jobs/{job_id}",
+            params={'wait': wait},
+            timeout=wait + 5
+        )
+        response.raise_for_status()
+        job = response.json()
+        if job['status'] in ('done', 'error'):
+            return job
+    return None
+
+def compare_results(async_result, threaded_result, usage=None, pages=0):
+    """Сравнение результатов; usage - замеры ресурсов процессов серверов"""
     if not async_result or not threaded_result:
         return
     
@@ -145,15 +147,15 @@ def compare_results(async_result, threaded_result):
     async_data = {}
     threaded_data = {}
     
+    # Только сводные поля, без разбора списка товаров
+    from results_io import read_summary
     try:
-        with open("async_results.json", "r", encoding="utf-8") as f:
-            async_data = json.load(f)
+        async_data = read_summary("async_results.json")
     except:
         pass
     
     try:
-        with open("threaded_results.json", "r", encoding="utf-8") as f:
-            threaded_data = json.load(f)
+        threaded_data = read_summary("threaded_results.json")
     except:
         pass
     
@@ -182,6 +184,19 @@ def compare_results(async_result, threaded_result):
     # Потоки
     threads = threaded_data.get('threads_used', 0)
     print(f"{'Потоков':<20} {'-':<15} {threads:<15} {'-'}")
+    
+    # Ресурсы процессов серверов (если серверы на этой машине)
+    usage = usage or {}
+    if usage.get('async') or usage.get('threaded'):
+        print("-"*60)
+        rows = usage_rows(
+            {'usage': usage.get('async'),
+             'efficiency': efficiency(usage.get('async'), pages, async_count)},
+            {'usage': usage.get('threaded'),
+             'efficiency': efficiency(usage.get('threaded'), pages, threaded_count)}
+        )
+        for label, async_value, threaded_value in rows:
+            print(f"{label:<20} {str(async_value):<15} {str(threaded_value):<15}")
 
 def main():
     """Основная функция"""
@@ -199,21 +214,21 @@ def main():
     
     args = parser.parse_args()
     
-    # Тестируем асинхронный сервер
-    async_result = test_async_server(port=args.async_port, pages=args.pages)
-    
-    # Ждем между тестами
-    time.sleep(3)
+    # Тестируем асинхронный сервер; процесс сервера замеряется во время теста
+    with ProcessSampler(pid_for_port(args.async_port)) as async_sampler:
+        async_result = test_async_server(port=args.async_port, pages=args.pages)
     
     # Тестируем многопоточный сервер
-    threaded_result = test_threaded_server(
-        port=args.threaded_port, 
-        pages=args.pages,
-        threads=args.threads
-    )
+    with ProcessSampler(pid_for_port(args.threaded_port)) as threaded_sampler:
+        threaded_result = test_threaded_server(
+            port=args.threaded_port, 
+            pages=args.pages,
+            threads=args.threads
+        )
     
     # Сравниваем результаты
-    compare_results(async_result, threaded_result)
+    usage = {'async': async_sampler.usage, 'threaded': threaded_sampler.usage}
+    compare_results(async_result, threaded_result, usage, args.pages)
     
     print("\nРезультаты сохранены в файлах:")
     print("   async_results.json")
@@ -1,172 +1,483 @@
 # Многопоточный сервер парсинга
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
 import json
+import os
+import tempfile
 import threading
 import queue
 import time
 from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
-import re
+import signal
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from jobs import JobRegistry, sse_event
+from serialization import negotiate
+from results_io import (write_json_atomic, write_products, products_path, read_summary,
+                        parse_page_params, results_page)
+import export
+from product_store import ProductStore
+import analytics
+from dedup import Deduplicator
+from result_cache import ResultCache, request_key
+from admission import AdmissionController, Overloaded
+from checkpoint import Checkpoint
+import batch
+from crawler import fetch_sync, parse_catalog_html, page_url
+from http_archive import open_archive
+from memory import MemoryMonitor, SnapshotTracker, parse_debug_params, start_tracing
+from details import DETAIL_QUEUE_SIZE, parse_detail, detail_workers, count_details
+from extraction import DEFAULT_PLAN, load_schema, request_plan
+from estimate import SampleEstimate, last_page, parse_mode
+from price_history import PriceHistory, history_path, history_report, parse_history_params
+from search_index import SearchIndex, parse_search_params
+
+def expired(deadline):
+    """Наступил ли срок задачи (None - срока нет)"""
+    return deadline is not None and time.time() >= deadline
+
+def wait_queue(work_queue, deadline):
+    """Ожидание обработки очереди; False - срок наступил раньше"""
+    if deadline is None:
+        work_queue.join()
+        return True
+    while work_queue.unfinished_tasks:
+        if expired(deadline):
+            return False
+        time.sleep(0.05)
+    return True
 
 class ThreadedParserHandler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         """Кастомное логирование"""
         print(f"[{self.client_address[0]}] {format % args}")
     
+    def send_json(self, status, data, headers=None):
+        """Отправка ответа в формате по заголовку Accept: JSON или MessagePack"""
+        codec = negotiate(self.headers.get('Accept'))
+        body = codec.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', codec.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
     def do_GET(self):
         """Обработка GET запросов"""
-        if self.path == '/':
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = parse_qs(parts.query)
+        
+        if path == '/':
             self.send_response(200)
             self.send_header('Content-Type', 'text/plain')
             self.end_headers()
             response = ("Многопоточный сервер парсинга Dental-First\n\n"
                        "Используйте:\n"
                        "POST /parse - запуск парсинга\n"
+                       "GET /ready - готовность сервера\n"
+                       "GET /jobs/{id}?wait=30 - ожидание завершения задачи\n"
+                       "GET /jobs/{id}/events - поток прогресса (SSE)\n"
+                       "GET /export?format=csv|parquet|arrow - экспорт результатов\n"
+                       "GET /stats - статистика цен по задаче\n"
+                       "GET /results/{id|latest}?offset=&limit= - страница товаров задачи\n"
+                       "GET /debug/memory?top=&group= - места выделения памяти (tracemalloc)\n"
+                       "GET /history?name=&label=&since=&until= - история цен товара по обходам\n"
+                       "GET /search?q=&limit=&min_price=&max_price= - поиск товаров по названию и метке\n"
                        f"\nПорт: {self.server.server_port}")
             self.wfile.write(response.encode('utf-8'))
         
-        elif self.path == '/status':
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            response = json.dumps({
+        elif path == '/status':
+            self.send_json(200, {
                 'status': 'running',
                 'server': 'threaded',
                 'port': self.server.server_port,
+                'load': dict(self.server.admission.stats(), max_pages=self.server.max_pages,
+                             max_details=self.server.max_details),
+                'memory': self.server.memory.process_memory(),
                 'endpoints': {
-                    'POST /parse': 'Запуск парсинга каталога'
+                    'POST /parse': 'Запуск парсинга каталога',
+                    'GET /ready': 'Готовность сервера',
+                    'GET /jobs/{id}?wait=30': 'Ожидание завершения задачи (long-poll)',
+                    'GET /jobs/{id}/events': 'Прогресс задачи (Server-Sent Events)',
+                    'GET /export?format=csv|parquet|arrow&job=': 'Экспорт всех товаров задачи',
+                    'GET /stats?job=&quantiles=&bins=&top=': 'Статистика цен по всем товарам задачи',
+                    'GET /results/{id|latest}?offset=&limit=': 'Сводка и страница товаров задачи',
+                    'GET /debug/memory?top=&group=&start=&stop=': 'Топ мест выделения памяти и разница снимков',
+                    'GET /history?name=&label=&since=&until=&limit=': 'История цен товаров по обходам',
+                    'GET /search?q=&limit=&min_price=&max_price=': 'Поиск товаров по названию и метке'
                 }
             })
-            self.wfile.write(response.encode('utf-8'))
+        
+        elif path == '/ready':
+            self.send_json(200, {
+                'ready': True,
+                'server': 'threaded',
+                'port': self.server.server_port
+            })
+        
+        elif path == '/export':
+            self.handle_export(query)
+        
+        elif path == '/stats':
+            self.handle_stats(query)
+        
+        elif path == '/debug/memory':
+            self.handle_debug_memory(query)
+        
+        elif path == '/history':
+            self.handle_history(query)
+        
+        elif path == '/search':
+            self.handle_search(query)
+        
+        elif path.startswith('/results/'):
+            self.handle_results(path[len('/results/'):], query)
+        
+        elif path.startswith('/jobs/') and path.endswith('/events'):
+            self.handle_job_events(path[len('/jobs/'):-len('/events')])
+        
+        elif path.startswith('/jobs/'):
+            self.handle_job(path[len('/jobs/'):], query)
         
         else:
             self.send_response(404)
             self.end_headers()
     
+    def handle_job(self, job_id, query):
+        """Состояние задачи; ?wait=N - ждать завершения до N секунд"""
+        job = self.server.jobs.get(job_id)
+        if not job:
+            self.send_json(404, {'status': 'error', 'message': 'Задача не найдена'})
+            return
+        
+        try:
+            wait = min(float(query.get('wait', ['0'])[0]), 300)
+        except ValueError:
+            wait = 0
+        
+        if wait > 0 and not job.finished:
+            snapshot = job.wait(wait)
+        else:
+            snapshot = job.snapshot()
+        self.send_json(200, snapshot)
+    
+    def handle_job_events(self, job_id):
+        """Поток прогресса задачи в формате Server-Sent Events"""
+        job = self.server.jobs.get(job_id)
+        if not job:
+            self.send_json(404, {'status': 'error', 'message': 'Задача не найдена'})
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        
+        version = None
+        snapshot = job.snapshot()
+        try:
+            while True:
+                if version != snapshot['version']:
+                    version = snapshot['version']
+                    event = 'done' if job.finished else 'progress'
+                    self.wfile.write(sse_event(event, json.dumps(snapshot, ensure_ascii=False)))
+                    if job.finished:
+                        break
+                else:
+                    # Комментарий-пинг, чтобы прокси не закрыли соединение
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+                snapshot = job.wait(15, since_version=version)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент отключился
+            pass
+    
+    def job_results(self, job_id):
+        """Сводка задачи: из реестра или из последнего файла результатов"""
+        if job_id:
+            job = self.server.jobs.get(job_id)
+            return job.result if job else None
+        if os.path.exists('threaded_results.json'):
+            data = read_summary('threaded_results.json')
+            return None if 'error' in data else data
+        return None
+    
+    def handle_export(self, query):
+        """Экспорт всех товаров задачи в CSV, Parquet или Arrow IPC"""
+        fmt = query.get('format', ['csv'])[0]
+        if fmt not in export.FORMATS:
+            self.send_json(400, {'status': 'error', 'message': f"Неизвестный формат: {fmt}"})
+            return
+        
+        results = self.job_results(query.get('job', [None])[0])
+        if not results:
+            self.send_json(404, {'status': 'error', 'message': 'Результаты не найдены'})
+            return
+        
+        suffix, content_type = export.FORMATS[fmt]
+        fd, output = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            export.export_data(results, fmt, output)
+            
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Disposition',
+                             f'attachment; filename="threaded_{results.get("job_id", "results")}{suffix}"')
+            self.send_header('Content-Length', str(os.path.getsize(output)))
+            self.end_headers()
+            with open(output, 'rb') as f:
+                while True:
+                    chunk = f.read(64 * 1024)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+        except RuntimeError as e:
+            self.send_json(501, {'status': 'error', 'message': str(e)})
+        finally:
+            os.remove(output)
+    
+    def handle_stats(self, query):
+        """Статистика цен по всем товарам задачи"""
+        get = lambda name: query.get(name, [None])[0]
+        try:
+            params = analytics.parse_stats_params(get)
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'message': str(e)})
+            return
+        
+        results = self.job_results(get('job'))
+        if not results:
+            self.send_json(404, {'status': 'error', 'message': 'Результаты не найдены'})
+            return
+        
+        try:
+            self.send_json(200, analytics.job_stats(self.server.stores, results, params))
+        except RuntimeError as e:
+            self.send_json(501, {'status': 'error', 'message': str(e)})
+    
+    def handle_history(self, query):
+        """История цен товаров по обходам"""
+        if self.server.history is None:
+            self.send_json(404, {'status': 'error', 'message': 'История цен выключена (--no-history)'})
+            return
+        try:
+            params = parse_history_params(lambda name: query.get(name, [None])[0])
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'message': str(e)})
+            return
+        self.send_json(200, history_report(self.server.history, params))
+    
+    def handle_search(self, query):
+        """Поиск товаров по названию и метке"""
+        try:
+            params = parse_search_params(lambda name: query.get(name, [None])[0])
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'message': str(e)})
+            return
+        self.send_json(200, self.server.search.search(**params))
+    
+    def handle_results(self, job_id, query):
+        """Сводка задачи и срез товаров без чтения всего файла"""
+        try:
+            offset, limit = parse_page_params(lambda name: query.get(name, [None])[0])
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'message': str(e)})
+            return
+        
+        results = self.job_results(None if job_id == 'latest' else job_id)
+        if not results:
+            self.send_json(404, {'status': 'error', 'message': 'Результаты не найдены'})
+            return
+        
+        self.send_json(200, results_page(results, offset, limit))
+    
+    def handle_debug_memory(self, query):
+        """Снимок tracemalloc и разница с предыдущим запросом"""
+        try:
+            report = self.server.memory_snapshots.report(
+                **parse_debug_params(lambda name: query.get(name, [None])[0]))
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'message': str(e)})
+            return
+        
+        report['process'] = self.server.memory.process_memory()
+        report['jobs'] = {job.id: job.snapshot()['memory'] for job in self.server.jobs.active()}
+        self.send_json(200, report)
+    
     def do_POST(self):
         """Обработка POST запросов"""
-        if self.path == '/parse':
+        if urlsplit(self.path).path == '/parse':
             try:
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length)
                 data = json.loads(post_data.decode('utf-8'))
                 
-                # Запускаем парсинг в отдельном потоке
-                thread = threading.Thread(
-                    target=self.parse_in_background,
-                    args=(data,)
-                )
-                thread.daemon = True
-                thread.start()
-                
-                self.send_response(202)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
+                job = self.start_job(data)
                 
-                response = json.dumps({
+                self.send_json(202, {
                     'status': 'processing',
                     'message': 'Парсинг запущен в фоновом режиме',
+                    'job_id': job.id,
+                    'wait_url': f'/jobs/{job.id}?wait=30',
+                    'events_url': f'/jobs/{job.id}/events',
                     'check_file': 'threaded_results.json'
                 })
-                self.wfile.write(response.encode('utf-8'))
                 
+            except Overloaded as e:
+                self.send_json(503 if e.draining else 429, {
+                    'status': 'draining' if e.draining else 'overloaded',
+                    'message': str(e),
+                    'retry_after': e.retry_after
+                }, headers={'Retry-After': str(e.retry_after)})
             except json.JSONDecodeError:
-                self.send_error(400, "Неверный JSON")
+                self.send_json(400, {'status': 'error', 'message': 'Неверный JSON в теле запроса'})
+            except (ValueError, TypeError) as e:
+                # send_error кладет текст в строку статуса (latin-1) - кириллица там падает
+                self.send_json(400, {'status': 'error', 'message': f'Неверные параметры запроса: {e}'})
             except Exception as e:
-                self.send_error(500, str(e))
+                self.send_json(500, {'status': 'error', 'message': str(e)})
         else:
             self.send_response(404)
             self.end_headers()
     
-    def fetch_page(self, url):
-        """Синхронное получение страницы"""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            }
-            response = requests.get(url, headers=headers, timeout=30)
-            return response.text if response.status_code == 200 else None
-        except Exception as e:
-            print(f"Ошибка получения {url}: {e}")
-            return None
-    
-    def parse_product_card(self, soup, product_div):
-        """Парсинг одной карточки товара"""
-        try:
-            # Название товара
-            title_element = product_div.find('p', class_='set-card__title')
-            if title_element:
-                name_link = title_element.find('a', class_='di_b c_b')
-                if name_link:
-                    product_name = name_link.get_text(strip=True)
-                else:
-                    product_name = title_element.get_text(strip=True)
-            else:
-                product_name = "Без названия"
-            
-            # Цена товара
-            price_element = product_div.find('span', class_='set-card__price')
-            price = 0
-            if price_element:
-                price_text = price_element.get_text(strip=True)
-                price_match = re.search(r'[\d\s]+(?=\s*₽)', price_text)
-                if price_match:
-                    price_str = price_match.group().replace(' ', '')
-                    try:
-                        price = int(price_str)
-                    except:
-                        price = 0
-            
-            # Артикул/метка
-            label_element = product_div.find('span', class_='set-card__label')
-            label = label_element.get_text(strip=True) if label_element else ""
-            
-            return {
-                'name': product_name,
-                'price': price,
-                'label': label
-            }
-        except Exception as e:
-            print(f"Ошибка парсинга карточки: {e}")
-            return None
-    
-    def parse_page(self, page_url):
-        """Парсинг одной страницы"""
-        html = self.fetch_page(page_url)
-        if not html:
-            return []
+    def start_job(self, data):
+        """Задача для запроса: из кэша, общая с идущей или новая
         
-        soup = BeautifulSoup(html, 'html.parser')
-        products = []
+        Одинаковые одновременные запросы присоединяются к одному обходу
+        (single-flight), свежие завершенные берутся из кэша ("max_age",
+        "no_cache" управляют кэшем). "schema" - поля карточки поверх схемы
+        сервера.
+        """
+        if 'batch' in data:
+            batch.parse_batch(data)  # ValueError -> 400 до постановки задачи
+        request_plan(data, self.server.plan)  # ошибка в "schema" - тоже 400
+        parse_mode(data)  # и в "mode" с параметрами оценки
+        if data.get('deadline_ms') is not None and float(data['deadline_ms']) <= 0:
+            raise ValueError('"deadline_ms" должен быть положительным')
+        key = request_key(data)
         
-        product_cards = soup.find_all('div', class_='set-card block')
+        if not data.get('no_cache'):
+            cached = self.server.cache.get(key, data.get('max_age'))
+            if cached:
+                job = self.server.jobs.create(data, key)
+                job.finish(cached)
+                return job
         
-        for card in product_cards:
-            product_data = self.parse_product_card(soup, card)
-            if product_data:
-                products.append(product_data)
+        job, created = self.server.jobs.get_or_create(
+            data, key, admit=self.server.admission.enqueue
+        )
+        if created:
+            # Запускаем парсинг в отдельном потоке
+            thread = threading.Thread(
+                target=self.parse_in_background,
+                args=(job, data)
+            )
+            thread.daemon = True
+            thread.start()
+        else:
+            print(f"Запрос присоединен к идущей задаче {job.id}")
+        return job
+    
+    def fetch_page(self, url):
+        """Синхронное получение страницы через общее ядро обхода"""
+        return fetch_sync(url, archive=self.server.archive)
+    
+    def parse_page(self, page_url, links=False, plan=None):
+        """Парсинг одной страницы; links - сохранять ссылки на товары
         
+        None - страница не загрузилась (в отличие от пустой страницы).
+        """
+        # Общий бюджет одновременно загружаемых страниц на весь сервер
+        with self.server.page_slots:
+            html = self.fetch_page(page_url)
+        if html is None:
+            return None
+        products = parse_catalog_html(html, page_url, links, plan=plan or self.server.plan)
+        self.server.search.add(products)
         return products
     
-    def parse_page_worker(self, page_queue, results_queue):
-        """Рабочая функция для потока"""
+    def parse_page_worker(self, page_queue, collect, job, checkpoint, skipped, deadline=None,
+                          links=False, plan=None):
+        """Рабочая функция для потока этапа каталога
+        
+        skipped - страницы, оставленные при остановке сервера. Не
+        загрузившиеся и оставленные по сроку deadline страницы просто не
+        попадают в collect и контрольную точку.
+        """
         while True:
             try:
-                page_url = page_queue.get_nowait()
-                products = self.parse_page(page_url)
-                results_queue.put(products)
+                page_num, page_url = page_queue.get_nowait()
+                if self.server.draining:
+                    # Сервер останавливается - страница остается на продолжение
+                    skipped.append(page_num)
+                    page_queue.task_done()
+                    continue
+                if expired(deadline):
+                    page_queue.task_done()
+                    continue
+                products = self.parse_page(page_url, links, plan)
+                if products is None:
+                    print(f"Страница {page_num} пропущена: ошибка загрузки")
+                    job.progress(0)
+                    page_queue.task_done()
+                    continue
+                checkpoint.record(page_num, products)
+                job.progress(len(products))
+                collect(page_num, products)
                 page_queue.task_done()
             except queue.Empty:
                 break
             except Exception as e:
                 print(f"Ошибка в потоке: {e}")
+                job.progress(0)
                 page_queue.task_done()
     
-    def parse_in_background(self, data):
-        """Фоновая обработка парсинга"""
+    def detail_worker(self, detail_queue, deadline=None):
+        """Рабочая функция для потока этапа карточек; None - конец работы"""
+        while True:
+            product = detail_queue.get()
+            if product is None:
+                detail_queue.task_done()
+                break
+            try:
+                if product.get('url') and not expired(deadline):
+                    with self.server.detail_slots:
+                        html = self.fetch_page(product['url'])
+                    if html and not expired(deadline):
+                        # Опоздавшая карточка не меняет уже собранный итог
+                        product.update(parse_detail(html))
+            except Exception as e:
+                print(f"Ошибка парсинга карточки товара: {e}")
+            finally:
+                detail_queue.task_done()
+    
+    def parse_in_background(self, job, data):
+        """Фоновая обработка парсинга после допуска по нагрузке"""
+        try:
+            if job.ticket:
+                job.ticket.wait()
+                if job.ticket.cancelled:
+                    job.fail('Сервер останавливается, задача не начата')
+                    return
+            if 'batch' in data:
+                self.parse_batch_job(job, data)
+            elif parse_mode(data):
+                self.estimate_job(job, data)
+            else:
+                self.parse_job(job, data)
+        finally:
+            if job.ticket:
+                self.server.admission.release(job.ticket)
+    
+    def parse_job(self, job, data):
+        """Парсинг диапазона страниц и сохранение результатов"""
         try:
             start_time = time.time()
             
@@ -179,46 +490,106 @@ class ThreadedParserHandler(BaseHTTPRequestHandler):
             print(f"Страницы: {start_page}-{end_page}")
             print(f"Потоков: {num_threads}")
             
-            # Создаем очередь страниц
+            checkpoint = Checkpoint('threaded', job.key, resume=data.get('resume', False))
+            resumed_pages = len(checkpoint.pages)
+            plan = request_plan(data, self.server.plan)
+            deadline = self.job_deadline(job, data)
+            job.start(end_page - start_page + 1)
+            
+            # Товары по номерам страниц; после срока задачи closed не дает
+            # запоздавшим потокам дописывать в уже собранный итог
+            results = {}
+            results_lock = threading.Lock()
+            closed = threading.Event()
+            
+            # Страницы каталога сдвигаются во время обхода, поэтому одна
+            # карточка может прийти дважды - повторы убираем до этапа карточек
+            dedup = Deduplicator.for_pages(end_page - start_page + 1) if data.get('dedup', True) else None
+            
+            # Второй этап: ограниченная очередь и свои потоки для страниц товаров
+            links = bool(data.get('details'))
+            detail_queue = queue.Queue(maxsize=DETAIL_QUEUE_SIZE) if links else None
+            detail_threads = []
+            for _ in range(detail_workers(data) if links else 0):
+                thread = threading.Thread(target=self.detail_worker, args=(detail_queue, deadline))
+                thread.daemon = True
+                thread.start()
+                detail_threads.append(thread)
+            
+            def collect(page_num, products):
+                with results_lock:
+                    if closed.is_set():
+                        return
+                    if dedup:
+                        products = dedup.filter(products)
+                    results[page_num] = products
+                if detail_queue is not None:
+                    # Если карточки отстают, поток каталога ждет здесь
+                    for product in products:
+                        detail_queue.put(product)
+            
+            # Создаем очередь страниц; готовые по контрольной точке сразу в результаты
             page_queue = queue.Queue()
             for page_num in range(start_page, end_page + 1):
-                if page_num == 1:
-                    page_url = url
-                else:
-                    page_url = f"{url}?PAGEN_1={page_num}"
-                page_queue.put(page_url)
-            
-            # Создаем очередь для результатов
-            results_queue = queue.Queue()
+                if checkpoint.done(page_num):
+                    products = checkpoint.products(page_num)
+                    job.progress(len(products))
+                    collect(page_num, products)
+                    continue
+                page_queue.put((page_num, page_url(url, page_num)))
             
             # Запускаем потоки
+            skipped = []
             threads = []
             for _ in range(min(num_threads, page_queue.qsize())):
                 thread = threading.Thread(
                     target=self.parse_page_worker,
-                    args=(page_queue, results_queue)
+                    args=(page_queue, collect, job, checkpoint, skipped, deadline, links, plan)
                 )
                 thread.daemon = True
                 thread.start()
                 threads.append(thread)
             
-            # Ждем завершения всех страниц
-            page_queue.join()
+            # Ждем завершения всех страниц обоих этапов, но не дольше срока
+            if wait_queue(page_queue, deadline) and detail_queue is not None:
+                wait_queue(detail_queue, deadline)
+            if expired(deadline):
+                print("Обход остановлен: истек срок задачи")
+            if detail_queue is not None:
+                # Без блокировки: после срока очередь может быть полна
+                threading.Thread(target=lambda: [detail_queue.put(None) for _ in detail_threads],
+                                 daemon=True).start()
+            
+            if skipped:
+                raise RuntimeError(
+                    f"Обход прерван остановкой сервера, не обработано страниц: {len(skipped)}. "
+                    "Повторите запрос с \"resume\": true"
+                )
+            with results_lock:
+                closed.set()
+            failed = [p for p in range(start_page, end_page + 1) if p not in results]
+            if not failed:
+                checkpoint.remove()
             
-            # Собираем результаты
-            all_products = []
-            while not results_queue.empty():
-                products = results_queue.get()
-                all_products.extend(products)
+            # Собираем результаты в порядке страниц
+            all_products = ProductStore()
+            for page_num in sorted(results):
+                all_products.extend(results[page_num])
             
             end_time = time.time()
             execution_time = end_time - start_time
             
             # Считаем общую стоимость
-            total_price = sum(p['price'] for p in all_products)
+            total_price = all_products.total_price()
+            
+            # Полный список товаров - отдельным файлом, в сводке только первые 100
+            products_file = products_path('threaded', job.id, self.server.products_format)
+            write_products(products_file, all_products)
+            self.record_history(all_products, start_time)
             
             # Сохраняем результаты
             result_data = {
+                'job_id': job.id,
                 'timestamp': datetime.now().isoformat(),
                 'url': url,
                 'pages_parsed': f"{start_page}-{end_page}",
@@ -226,31 +597,321 @@ class ThreadedParserHandler(BaseHTTPRequestHandler):
                 'total_products': len(all_products),
                 'total_price': total_price,
                 'execution_time': round(execution_time, 2),
+                'duplicates_removed': dedup.duplicates if dedup else 0,
+                'resumed_pages': resumed_pages,
+                'details_fetched': count_details(all_products),
+                'partial': bool(failed),
+                'pages_completed': [p for p in range(start_page, end_page + 1) if p not in failed],
+                'pages_skipped': failed,
+                'products_file': products_file,
                 'products': all_products[:100]  # Первые 100 товаров
             }
             
-            with open('threaded_results.json', 'w', encoding='utf-8') as f:
-                json.dump(result_data, f, ensure_ascii=False, indent=2)
+            write_json_atomic('threaded_results.json', result_data)
+            
+            summary = {k: v for k, v in result_data.items() if k != 'products'}
+            summary['results_file'] = 'threaded_results.json'
+            if not failed:
+                # Неполный результат не кэшируем: повтор догрузит страницы
+                self.server.cache.put(job.key, summary)
+            job.finish(summary)
             
             print(f"Многопоточный парсинг завершен:")
             print(f"  Товаров: {len(all_products)}")
+            if dedup and dedup.duplicates:
+                print(f"  Удалено повторов: {dedup.duplicates}")
             print(f"  Время: {execution_time:.2f} сек")
             print(f"  Сумма: {total_price:,} руб".replace(',', ' '))
             print(f"  Потоков использовано: {num_threads}")
             
         except Exception as e:
             print(f"Ошибка при парсинге: {e}")
+            job.fail(e)
+            
+            write_json_atomic('threaded_results.json', {
+                'job_id': job.id,
+                'timestamp': datetime.now().isoformat(),
+                'error': str(e),
+                'status': 'error'
+            })
+
+    def parse_batch_job(self, job, data):
+        """Пакетный обход нескольких разделов общими потоками
+        
+        Потоки берут страницы у batch.BatchScheduler; с одного хоста
+        одновременно загружается не больше per_host страниц.
+        """
+        try:
+            start_time = time.time()
+            entries = batch.parse_batch(data)
+            scheduler = batch.BatchScheduler(entries)
+            num_threads = min(data.get('threads', 5), 10)  # Максимум 10 потоков
+            host_limit = batch.per_host_limit(data)
+            host_slots = {}
+            host_lock = threading.Lock()
+            pages = [[] for _ in entries]
+            plan = request_plan(data, self.server.plan)
+            
+            print(f"Запуск пакетного парсинга: разделов {len(entries)}, страниц {scheduler.total}")
+            job.start(scheduler.total)
+            
+            deadline = self.job_deadline(job, data)
+            
+            def worker():
+                for task in scheduler:
+                    if self.server.draining or expired(deadline):
+                        return
+                    host = urlsplit(task.url).netloc
+                    with host_lock:
+                        slot = host_slots.setdefault(host, threading.BoundedSemaphore(host_limit))
+                    try:
+                        with slot:
+                            products = self.parse_page(task.url, plan=plan)
+                    except Exception as e:
+                        print(f"Ошибка в потоке: {e}")
+                        products = None
+                    if products is None:
+                        # Не загрузилась - попадет в pages_skipped раздела
+                        job.progress(0)
+                        continue
+                    pages[task.entry].append((task.page, products))
+                    job.progress(len(products))
+            
+            threads = [threading.Thread(target=worker, daemon=True)
+                       for _ in range(min(num_threads, scheduler.total))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(None if deadline is None else max(0, deadline - time.time()))
+            
+            if self.server.draining:
+                raise RuntimeError("Пакетный обход прерван остановкой сервера")
+            
+            # Снимок: потоки, застрявшие на загрузке после срока, дописывают в pages
+            pages = [list(entry_pages) for entry_pages in pages]
+            all_products, categories = batch.group_results(entries, pages, data.get('dedup', True))
+            partial = any(c['pages_skipped'] for c in categories)
+            execution_time = time.time() - start_time
+            total_price = all_products.total_price()
+            
+            products_file = products_path('threaded', job.id, self.server.products_format)
+            write_products(products_file, all_products)
+            self.record_history(all_products, start_time)
+            
+            result_data = {
+                'job_id': job.id,
+                'timestamp': datetime.now().isoformat(),
+                'url': entries[0]['url'],
+                'pages_parsed': f"{scheduler.total} стр. в {len(entries)} разделах",
+                'threads_used': num_threads,
+                'total_products': len(all_products),
+                'total_price': total_price,
+                'execution_time': round(execution_time, 2),
+                'duplicates_removed': sum(c['duplicates_removed'] for c in categories),
+                'partial': partial,
+                'categories': categories,
+                'products_file': products_file,
+                'products': all_products[:100]  # Первые 100 товаров
+            }
+            
+            write_json_atomic('threaded_results.json', result_data)
+            
+            summary = {k: v for k, v in result_data.items() if k != 'products'}
+            summary['results_file'] = 'threaded_results.json'
+            if not partial:
+                self.server.cache.put(job.key, summary)
+            job.finish(summary)
             
-            with open('threaded_results.json', 'w', encoding='utf-8') as f:
-                json.dump({
-                    'timestamp': datetime.now().isoformat(),
-                    'error': str(e),
-                    'status': 'error'
-                }, f, ensure_ascii=False, indent=2)
+            print(f"Пакетный парсинг завершен: {len(all_products)} товаров")
+            print(f"  Время: {execution_time:.2f} сек")
+            
+        except Exception as e:
+            print(f"Ошибка при пакетном парсинге: {e}")
+            job.fail(e)
 
-def run_threaded_server(port=8081, host='localhost'):
+    @staticmethod
+    def job_deadline(job, data):
+        """Момент срока "deadline_ms" (от поступления запроса) или None"""
+        if data.get('deadline_ms') is None:
+            return None
+        return job.created + float(data['deadline_ms']) / 1000
+    
+    def record_history(self, products, when):
+        """Цены обхода в историю; ошибка истории не прерывает задачу"""
+        if self.server.history is None:
+            return
+        try:
+            stats = self.server.history.record(products, when)
+            print(f"  История цен: новых товаров {stats['new_products']}, "
+                  f"изменений цен {stats['price_changes']}, записано {stats['bytes_written']} байт")
+        except Exception as e:
+            print(f"Ошибка записи истории цен: {e}")
+    
+    def fetch_sample_page(self, url, plan):
+        """Товары страницы выборки; None - страница не загрузилась"""
+        with self.server.page_slots:
+            html = self.fetch_page(url)
+        if html is None:
+            return None
+        products = parse_catalog_html(html, url, plan=plan)
+        self.server.search.add(products)
+        return products
+    
+    def estimate_job(self, job, data):
+        """Приблизительный обход ("mode": "estimate") по выборке страниц
+        
+        Раунд выборки загружается пулом потоков; раунды идут, пока интервал
+        не сузится до "target_error", не наступит срок "deadline_ms" (от
+        поступления запроса) или не кончатся страницы.
+        """
+        try:
+            params = parse_mode(data)
+            url = data.get('url', 'https://dental-first.ru/catalog')
+            start_page = int(data.get('start_page', 1))
+            end_page = int(data.get('end_page', 3))
+            num_threads = min(data.get('threads', 5), 10)  # Максимум 10 потоков
+            plan = request_plan(data, self.server.plan)
+            deadline = self.job_deadline(job, data)
+            start_time = time.time()
+            sampled = ProductStore()
+            
+            known = {}
+            if params['discover']:
+                first_url = page_url(url, start_page)
+                with self.server.page_slots:
+                    html = self.fetch_page(first_url)
+                if html is None:
+                    raise RuntimeError(f"Страница {start_page} недоступна, последняя страница не найдена")
+                end_page = last_page(html, start_page)
+                known[start_page] = parse_catalog_html(html, first_url, plan=plan)
+                self.server.search.add(known[start_page])
+            
+            sample = SampleEstimate(start_page, end_page, params['strata'], params['confidence'],
+                                    params['seed'], known)
+            print(f"Оценка по выборке: {url}, страницы {start_page}-{end_page}, блоков {len(sample.strata)}")
+            job.start(sample.pages_total)
+            for products in known.values():
+                job.progress(len(products))
+                sampled.extend(products)
+            
+            executor = ThreadPoolExecutor(max_workers=num_threads)
+            futures = {}
+            try:
+                while True:
+                    pages = sample.next_round(params['round_size'])
+                    if not pages:
+                        reason = 'exhausted'
+                        break
+                    futures = {executor.submit(self.fetch_sample_page, page_url(url, page), plan): page
+                               for page in pages}
+                    timeout = None if deadline is None else max(0.0, deadline - time.time())
+                    done, pending = wait(futures, timeout)
+                    for future in done:
+                        products = None if future.exception() else future.result()
+                        sample.record(futures[future], products)
+                        job.progress(len(products or ()))
+                        sampled.extend(products or ())
+                    if pending or (deadline is not None and time.time() >= deadline):
+                        reason = 'deadline'
+                    elif self.server.draining:
+                        reason = 'draining'
+                    else:
+                        reason = sample.stop_reason(params['target_error'], params['max_sample'])
+                    if reason:
+                        break
+            finally:
+                # Незавершенные загрузки раунда не ждем; еще не начатые отменяем
+                # вручную (cancel_futures у shutdown есть только с Python 3.9)
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+            
+            report = sample.report()
+            report['stop_reason'] = reason
+            execution_time = time.time() - start_time
+            
+            # В файл товаров идут только товары страниц выборки
+            products_file = products_path('threaded', job.id, self.server.products_format)
+            write_products(products_file, sampled)
+            
+            result_data = {
+                'job_id': job.id,
+                'timestamp': datetime.now().isoformat(),
+                'url': url,
+                'mode': 'estimate',
+                'pages_parsed': f"{report['pages_sampled']} стр. из {start_page}-{end_page}",
+                'threads_used': num_threads,
+                'total_products': report['total_products'],
+                'total_price': report['total_price'],
+                'execution_time': round(execution_time, 2),
+                'duplicates_removed': 0,
+                'estimate': report,
+                'products_file': products_file,
+                'products': sampled[:100]  # Первые 100 товаров выборки
+            }
+            
+            write_json_atomic('threaded_results.json', result_data)
+            
+            summary = {k: v for k, v in result_data.items() if k != 'products'}
+            summary['results_file'] = 'threaded_results.json'
+            if reason not in ('deadline', 'draining'):
+                self.server.cache.put(job.key, summary)
+            job.finish(summary)
+            
+            error = report['relative_error']
+            print(f"Оценка завершена ({reason}): страниц {report['pages_sampled']} из {report['pages_in_range']}")
+            print(f"  Товаров: ~{report['total_products']}")
+            print(f"  Сумма: ~{report['total_price']:,} руб".replace(',', ' ')
+                  + (f" (±{error:.1%})" if error is not None else ''))
+            
+        except Exception as e:
+            print(f"Ошибка при оценке по выборке: {e}")
+            job.fail(e)
+
+def drain(server, timeout):
+    """Плавная остановка: без новых задач, текущие дописывают контрольную точку"""
+    print(f"\nОстановка сервера: ожидание задач до {timeout:.0f} сек...")
+    server.draining = True
+    cancelled = server.admission.close()
+    if cancelled:
+        print(f"Отменено задач в очереди: {cancelled}")
+    if not server.admission.wait_idle(timeout):
+        print("Прервано по таймауту: часть задач не завершена")
+
+def run_threaded_server(port=8081, host='localhost', max_jobs=4, max_queue=8, max_pages=16,
+                        max_details=8, drain_timeout=10.0, products_format='jsonl', archive=None,
+                        plan=None, history=None):
     """Запуск многопоточного сервера"""
-    server = HTTPServer((host, port), ThreadedParserHandler)
+    # Каждый запрос в своем потоке, иначе long-poll блокирует остальных
+    server = ThreadingHTTPServer((host, port), ThreadedParserHandler)
+    server.daemon_threads = True
+    server.memory = MemoryMonitor()
+    server.memory_snapshots = SnapshotTracker()
+    server.jobs = JobRegistry(monitor=server.memory)
+    server.stores = analytics.StoreCache()
+    server.cache = ResultCache()
+    server.admission = AdmissionController(max_jobs=max_jobs, max_queue=max_queue)
+    server.max_pages = max_pages
+    server.page_slots = threading.BoundedSemaphore(max_pages)
+    server.max_details = max_details
+    server.detail_slots = threading.BoundedSemaphore(max_details)
+    server.draining = False
+    server.products_format = products_format
+    server.archive = archive  # http_archive.HttpArchive: запись или воспроизведение
+    server.plan = plan or DEFAULT_PLAN  # схема полей карточки (--schema)
+    server.history = history  # price_history.PriceHistory или None
+    server.search = SearchIndex()  # пополняется разобранными страницами
+    if history is not None:
+        threading.Thread(target=server.search.add_history, args=(history,), daemon=True).start()
+    
+    def on_sigterm(signum, frame):
+        # Задачи дорабатывают, пока сервер еще отвечает на /jobs
+        def stop():
+            drain(server, drain_timeout)
+            server.shutdown()
+        threading.Thread(target=stop, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, on_sigterm)
     
     print("="*60)
     print("МНОГОПОТОЧНЫЙ СЕРВЕР ЗАПУЩЕН")
@@ -266,21 +927,54 @@ def run_threaded_server(port=8081, host='localhost'):
     
     try:
         server.serve_forever()
+        print("Сервер остановлен")
     except KeyboardInterrupt:
+        drain(server, drain_timeout)
         print("\n\nСервер остановлен пользователем")
     except Exception as e:
         print(f"\nОшибка сервера: {e}")
+    finally:
+        server.server_close()
 
 def main():
     """Точка входа"""
     parser = argparse.ArgumentParser(description='Многопоточный сервер парсинга')
     parser.add_argument('--port', type=int, default=8081, help='Порт сервера')
     parser.add_argument('--host', default='localhost', help='Хост сервера')
+    parser.add_argument('--max-jobs', type=int, default=4, help='Одновременных задач парсинга')
+    parser.add_argument('--max-queue', type=int, default=8, help='Задач в очереди ожидания')
+    parser.add_argument('--max-pages', type=int, default=16, help='Одновременно загружаемых страниц')
+    parser.add_argument('--max-details', type=int, default=8,
+                        help='Одновременно загружаемых страниц товаров')
+    parser.add_argument('--products-format', choices=['jsonl', 'msgpack'], default='jsonl',
+                        help='Формат файлов results/ с полным списком товаров')
+    parser.add_argument('--record', metavar='ARCHIVE', help='Записывать загруженные страницы в zip-архив')
+    parser.add_argument('--replay', metavar='ARCHIVE', help='Отдавать страницы из архива, без сети')
+    parser.add_argument('--replay-latency', action='store_true',
+                        help='При воспроизведении выдерживать записанное время загрузки')
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help='Сколько секунд ждать текущие задачи при остановке')
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='FRAMES',
+                        help='Включить tracemalloc с глубиной стека FRAMES (0 - выключен)')
+    parser.add_argument('--schema', metavar='FILE',
+                        help='JSON-схема полей карточки (по умолчанию name, price, label)')
+    parser.add_argument('--history', metavar='FILE', default=history_path('threaded'),
+                        help='Файл истории цен (по умолчанию %(default)s; серверы пула пишут в общий)')
+    parser.add_argument('--no-history', action='store_true', help='Не вести историю цен')
     
     args = parser.parse_args()
     
     try:
-        run_threaded_server(port=args.port, host=args.host)
+        start_tracing(args.tracemalloc)
+        run_threaded_server(
+            port=args.port, host=args.host,
+            max_jobs=args.max_jobs, max_queue=args.max_queue, max_pages=args.max_pages,
+            max_details=args.max_details, drain_timeout=args.drain_timeout,
+            products_format=args.products_format,
+            archive=open_archive(args.record, args.replay, args.replay_latency),
+            plan=load_schema(args.schema) if args.schema else None,
+            history=None if args.no_history else PriceHistory(args.history)
+        )
     except Exception as e:
         print(f"Ошибка запуска: {e}")
         sys.exit(1)